@@ -0,0 +1,186 @@
+#
+# MIT License
+#
+# Copyright (c) 2020-2021 NVIDIA CORPORATION.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.#
+""" Headless closed loop benchmark of ReacherTask on a kinematic plant, no simulator required.
+
+Runs the sinusoidal target of examples/franka_reacher.py for every combination of particles,
+horizon, world and cost configuration, and reports control latency percentiles, optimizer
+iterations per second and end-effector tracking error. Results are written as json.
+
+Example:
+    python benchmarks/benchmark_mpc.py --particles 200 500 --horizons 20 30 \
+        --worlds collision_primitives_3d.yml collision_table.yml \
+        --cost_configs default no_collision:primitive_collision.weight=0,robot_self_collision.weight=0 \
+        --steps 200 --out mpc_benchmark.json
+"""
+import argparse
+import copy
+import itertools
+import json
+import time
+
+import numpy as np
+import torch
+import yaml
+
+from storm_kit.mpc.task.reacher_task import ReacherTask
+
+
+class KinematicPlant(object):
+    """Position controlled robot, tracks the commanded joint state with a first order lag."""
+    def __init__(self, init_q, dt, lag=0.0):
+        n_dofs = len(init_q)
+        self.dt = dt
+        self.lag = lag
+        self.state = {'position':np.array(init_q, dtype=np.float64),
+                      'velocity':np.zeros(n_dofs), 'acceleration':np.zeros(n_dofs)}
+
+    def step(self, command):
+        q = self.state['position']
+        q_next = self.lag * q + (1.0 - self.lag) * command['position']
+        qd_next = (q_next - q) / self.dt
+        self.state = {'position':q_next, 'velocity':qd_next,
+                      'acceleration':(qd_next - self.state['velocity']) / self.dt}
+        return self.get_state()
+
+    def get_state(self):
+        return copy.deepcopy(self.state)
+
+
+def sinusoidal_target(t, period=8.0, amp=0.25, center=[0.55, 0.0, 0.4], n_planes=8):
+    # same target motion as examples/franka_reacher.py, in the robot base frame:
+    plane = np.floor(t / period) * 2 * np.pi / n_planes
+    s = np.sin(2 * np.pi / period * t)
+    return [center[0] + np.sin(plane) * 2 * amp * s,
+            center[1] + np.cos(plane) * 2 * amp * s,
+            center[2] + amp * np.sin(2 * 2 * np.pi / period * t)]
+
+
+def parse_cost_config(arg):
+    """'label:cost.path=value,...' -> (label, {('cost','path'):value}), values are parsed as yaml."""
+    label, _, overrides = arg.partition(':')
+    parsed = {}
+    for item in [o for o in overrides.split(',') if len(o) > 0]:
+        key, val = item.split('=')
+        parsed[tuple(key.split('.'))] = yaml.safe_load(val)
+    return label, parsed
+
+
+class BenchmarkReacherTask(ReacherTask):
+    def __init__(self, task_file, robot_file, world_file, tensor_args, particles, horizon, cost_overrides):
+        self.particles = particles
+        self.horizon = horizon
+        self.cost_overrides = cost_overrides
+        super().__init__(task_file, robot_file, world_file, tensor_args)
+
+    def load_exp_params(self, task_file):
+        exp_params = super().load_exp_params(task_file)
+        exp_params['mppi']['num_particles'] = self.particles
+        exp_params['mppi']['horizon'] = self.horizon
+        for key, val in self.cost_overrides.items():
+            d = exp_params['cost']
+            for k in key[:-1]:
+                d = d[k]
+            d[key[-1]] = val
+        return exp_params
+
+
+def run_scenario(mpc_control, n_steps, warmup, lag, goal_quat):
+    dt = mpc_control.exp_params['control_dt']
+    n_iters = mpc_control.exp_params['mppi']['n_iters']
+    plant = KinematicPlant(mpc_control.exp_params['model']['init_state'], dt, lag)
+    latency = []
+    opt_time = []
+    pos_err = []
+    rot_err = []
+    t_step = 0.0
+    for i in range(n_steps + warmup):
+        t_step += dt
+        mpc_control.update_params(goal_ee_pos=sinusoidal_target(t_step), goal_ee_quat=goal_quat)
+        st_time = time.time()
+        command = mpc_control.get_command(t_step, plant.get_state(), control_dt=dt, WAIT=True)
+        step_time = time.time() - st_time
+        state = plant.step(command)
+        if(i < warmup):
+            continue
+        latency.append(step_time)
+        opt_time.append(mpc_control.opt_dt)
+        ee_error = mpc_control.get_current_error(copy.deepcopy(state))
+        rot_err.append(ee_error[1])
+        pos_err.append(ee_error[2])
+
+    latency = np.array(latency) * 1000.0
+    pos_err = np.array(pos_err)
+    return {'latency_ms':{'p50':float(np.percentile(latency, 50)), 'p90':float(np.percentile(latency, 90)),
+                          'p99':float(np.percentile(latency, 99)), 'max':float(np.max(latency))},
+            'iterations_per_s':float(n_iters * len(opt_time) / np.sum(opt_time)),
+            'position_error_m':{'mean':float(np.mean(pos_err)), 'p90':float(np.percentile(pos_err, 90)),
+                                'max':float(np.max(pos_err))},
+            'orientation_error':{'mean':float(np.mean(rot_err)), 'max':float(np.max(rot_err))},
+            'steps':n_steps}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='headless mpc benchmark')
+    parser.add_argument('--robot', type=str, default='franka')
+    parser.add_argument('--particles', type=int, nargs='+', default=[500])
+    parser.add_argument('--horizons', type=int, nargs='+', default=[30])
+    parser.add_argument('--worlds', type=str, nargs='+', default=['collision_primitives_3d.yml'],
+                        help='obstacle sets from content/configs/gym')
+    parser.add_argument('--cost_configs', type=str, nargs='+', default=['default'],
+                        help="label[:cost.path=value,...] overrides of the task cost config")
+    parser.add_argument('--steps', type=int, default=200, help='measured control steps per scenario')
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--lag', type=float, default=0.0, help='first order lag of the plant, 0 tracks exactly')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--cuda', action='store_true', default=False)
+    parser.add_argument('--out', type=str, default='mpc_benchmark.json')
+    args = parser.parse_args()
+
+    device = torch.device('cuda', 0) if args.cuda else torch.device('cpu')
+    tensor_args = {'device':device, 'dtype':torch.float32}
+    goal_quat = [0.0, 0.99, -0.01, -0.01]
+
+    results = []
+    for particles, horizon, world, cost_arg in itertools.product(args.particles, args.horizons,
+                                                                 args.worlds, args.cost_configs):
+        label, overrides = parse_cost_config(cost_arg)
+        torch.manual_seed(args.seed)
+        np.random.seed(args.seed)
+        mpc_control = BenchmarkReacherTask(args.robot + '_reacher.yml', args.robot + '.yml', world,
+                                           tensor_args, particles, horizon, overrides)
+        try:
+            res = run_scenario(mpc_control, args.steps, args.warmup, args.lag, goal_quat)
+        finally:
+            mpc_control.close()
+        res.update({'particles':particles, 'horizon':horizon, 'world':world, 'cost_config':label,
+                    'device':str(device)})
+        results.append(res)
+        print('{:>6} x {:>3} {:<28} {:<14} latency p50/p90/p99: {:7.2f}/{:7.2f}/{:7.2f}ms '
+              'iters/s: {:7.1f} pos err mean/max: {:.4f}/{:.4f}m'.format(
+                  particles, horizon, world, label, res['latency_ms']['p50'], res['latency_ms']['p90'],
+                  res['latency_ms']['p99'], res['iterations_per_s'], res['position_error_m']['mean'],
+                  res['position_error_m']['max']))
+
+    with open(args.out, 'w') as f:
+        json.dump({'robot':args.robot, 'seed':args.seed, 'results':results}, f, indent=2)
+    print('wrote', args.out)
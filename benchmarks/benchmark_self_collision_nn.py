@@ -0,0 +1,102 @@
+#
+# MIT License
+#
+# Copyright (c) 2020-2021 NVIDIA CORPORATION.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.#
+""" Accuracy/latency of the self collision network (eager and fused at different precisions) against the analytic sphere oracle.
+
+Example:
+    python benchmarks/benchmark_self_collision_nn.py --robot franka --n_samples 15000
+"""
+import argparse
+import copy
+import time
+
+import torch
+
+from storm_kit.mpc.control.control_utils import generate_halton_samples
+from storm_kit.mpc.rollout.arm_base import ArmBase
+from storm_kit.util_file import get_mpc_configs_path, join_path, load_yaml
+
+
+def timed(fn, n_iters, cuda):
+    out = fn()
+    if(cuda):
+        torch.cuda.synchronize()
+    st_time = time.time()
+    for _ in range(n_iters):
+        out = fn()
+    if(cuda):
+        torch.cuda.synchronize()
+    return out, (time.time() - st_time) / n_iters
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='self collision network benchmark')
+    parser.add_argument('--robot', type=str, default='franka')
+    parser.add_argument('--n_samples', type=int, default=15000, help='configurations per call (particles * horizon)')
+    parser.add_argument('--n_iters', type=int, default=20)
+    parser.add_argument('--threshold', type=float, default=0.0, help='collision when distance > threshold')
+    parser.add_argument('--cuda', action='store_true', default=False)
+    args = parser.parse_args()
+
+    device = torch.device('cuda', 0) if args.cuda else torch.device('cpu')
+    tensor_args = {'device':device, 'dtype':torch.float32}
+
+    exp_params = load_yaml(join_path(get_mpc_configs_path(), args.robot + '_reacher.yml'))
+    exp_params['robot_params'] = exp_params['model']
+    exp_params['cost']['primitive_collision']['weight'] = 0.0
+    exp_params['control_space'] = 'pos'
+    # same rollout setup as scripts/train_self_collision.py, two configurations per particle:
+    exp_params['mppi']['horizon'] = 2
+    exp_params['mppi']['num_particles'] = args.n_samples // 2
+    args.n_samples = 2 * (args.n_samples // 2)
+    rollout_fn = ArmBase(exp_params, tensor_args, world_params=None)
+    self_coll = rollout_fn.robot_self_collision_cost.coll
+
+    # joint samples within limits and their oracle distance:
+    dof = rollout_fn.dynamics_model.d_action
+    q = generate_halton_samples(args.n_samples, dof, use_ghalton=True, device=device, float_dtype=tensor_args['dtype'])
+    up_bounds = rollout_fn.dynamics_model.state_upper_bounds[:dof]
+    low_bounds = rollout_fn.dynamics_model.state_lower_bounds[:dof]
+    q = q * (up_bounds - low_bounds) + low_bounds
+    state_dict = rollout_fn.dynamics_model.rollout_open_loop(torch.zeros(rollout_fn.dynamics_model.d_state, **tensor_args),
+                                                             q.view(args.n_samples // 2, 2, dof))
+    link_pos = state_dict['link_pos_seq'].view(args.n_samples, -1, 3)
+    link_rot = state_dict['link_rot_seq'].view(args.n_samples, -1, 3, 3)
+    dist_gt, t = timed(lambda: torch.max(self_coll.check_self_collisions(link_pos, link_rot), dim=-1)[0],
+                       args.n_iters, args.cuda)
+    coll_gt = dist_gt > args.threshold
+    print('{:<10} time: {:7.3f}ms (oracle), in collision: {}/{}'.format('analytic', t * 1000.0,
+                                                                         int(torch.sum(coll_gt)), args.n_samples))
+
+    precisions = [None, 'fp32', 'fp16' if args.cuda else 'int8']
+    for precision in precisions:
+        net = copy.copy(self_coll.robot_nn)
+        if(precision is None):
+            net.fused_model = None
+        else:
+            net.build_fused_model(precision)
+        dist, t = timed(lambda: net.compute_signed_distance(q).view(-1), args.n_iters, args.cuda)
+        err = torch.abs(dist - dist_gt)
+        coll = dist > args.threshold
+        print('{:<10} time: {:7.3f}ms mean err: {:.4f}m max err: {:.4f}m missed: {} false positives: {}'.format(
+            'eager' if precision is None else precision, t * 1000.0, torch.mean(err).item(), torch.max(err).item(),
+            int(torch.sum(coll_gt & ~coll)), int(torch.sum(~coll_gt & coll))))
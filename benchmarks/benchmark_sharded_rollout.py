@@ -0,0 +1,104 @@
+#
+# MIT License
+#
+# Copyright (c) 2020-2021 NVIDIA CORPORATION.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.#
+""" Scaling of cpu rollouts sharded across worker processes.
+
+Times one rollout of num_particles franka reacher particles in the main process with all torch
+threads, then with ShardedRollout on 1 to N workers of threads_per_worker threads each. The costs of
+the sharded rollouts are checked against the single process rollout.
+
+Example:
+    python benchmarks/benchmark_sharded_rollout.py --num_particles 2000 --workers 1 2 4 8 --out sharded.json
+"""
+import argparse
+import copy
+import json
+import time
+
+import numpy as np
+import torch
+
+from storm_kit.mpc.rollout.arm_reacher import ArmReacher
+from storm_kit.mpc.rollout.sharded_rollout import ShardedRollout
+from storm_kit.util_file import get_gym_configs_path, get_mpc_configs_path, join_path, load_yaml
+
+
+def timed(fn, n_iters, n_warmup=2):
+    for _ in range(n_warmup):
+        fn()
+    times = []
+    for _ in range(n_iters):
+        st_time = time.time()
+        fn()
+        times.append((time.time() - st_time) * 1000.0)
+    return float(np.median(times))
+
+
+GOAL = dict(goal_ee_pos=[0.55, 0.0, 0.4], goal_ee_quat=[0.0, 0.99, -0.01, -0.01])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='sharded cpu rollout scaling')
+    parser.add_argument('--robot', type=str, default='franka')
+    parser.add_argument('--world', type=str, default='collision_primitives_3d.yml')
+    parser.add_argument('--num_particles', type=int, default=2000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--threads_per_worker', type=int, default=1)
+    parser.add_argument('--n_iters', type=int, default=10)
+    parser.add_argument('--out', type=str, default='benchmark_sharded_rollout.json')
+    args = parser.parse_args()
+
+    tensor_args = {'device':torch.device('cpu'), 'dtype':torch.float32}
+    torch.manual_seed(0)
+    exp_params = load_yaml(join_path(get_mpc_configs_path(), args.robot + '_reacher.yml'))
+    exp_params['robot_params'] = exp_params['model']
+    exp_params['mppi']['num_particles'] = args.num_particles
+    world_params = load_yaml(join_path(get_gym_configs_path(), args.world))
+
+    rollout_fn = ArmReacher(copy.deepcopy(exp_params), tensor_args, world_params=world_params)
+    rollout_fn.update_params(**GOAL)
+    model = rollout_fn.dynamics_model
+    start_state = torch.zeros(1, model.d_state, **tensor_args)
+    start_state[0, :model.n_dofs] = torch.as_tensor(exp_params['model']['init_state'], **tensor_args)
+    act_seq = 0.1 * torch.randn(args.num_particles, model.num_traj_points, model.d_action, **tensor_args)
+
+    with torch.no_grad():
+        ref_costs = rollout_fn(start_state, act_seq)['costs'].clone()
+        base_ms = timed(lambda: rollout_fn(start_state, act_seq), args.n_iters)
+    print('single process ({} threads): {:.2f} ms'.format(torch.get_num_threads(), base_ms))
+    results = {'num_particles': args.num_particles, 'threads': torch.get_num_threads(),
+               'single_process_ms': base_ms, 'sharded': []}
+
+    for num_workers in args.workers:
+        sharded = ShardedRollout(rollout_fn, exp_params, world_params, num_workers=num_workers,
+                                 threads_per_worker=args.threads_per_worker, tensor_args=tensor_args)
+        sharded.update_params(**GOAL)
+        costs = sharded(start_state, act_seq)['costs']
+        err = float(torch.max(torch.abs(costs - ref_costs)))
+        ms = timed(lambda: sharded(start_state, act_seq), args.n_iters)
+        sharded.close()
+        results['sharded'].append({'workers': num_workers, 'time_ms': ms, 'speedup': base_ms / ms,
+                                   'max_cost_error': err})
+        print('{:3d} workers: {:8.2f} ms speedup {:5.2f} max cost error {:.2e}'.format(num_workers, ms, base_ms / ms, err))
+
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=2)
@@ -0,0 +1,97 @@
+#
+# MIT License
+#
+# Copyright (c) 2020-2021 NVIDIA CORPORATION.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.#
+""" Measures the extra cost of checking spheres between rollout knots against the collisions it catches.
+
+Spheres move along random straight segments (one segment per rollout interval) around a thin wall.
+A collision is missed when the swept sphere intersects the wall but the check reports no collision.
+
+Example:
+    python benchmarks/benchmark_swept_collision.py --max_step 0.3 --substeps 1 2 4
+"""
+import argparse
+import time
+
+import torch
+
+from storm_kit.geom.sdf.world import WorldPrimitiveCollision
+
+
+def timed(fn, n_iters, cuda):
+    out = fn()
+    if(cuda):
+        torch.cuda.synchronize()
+    st_time = time.time()
+    for _ in range(n_iters):
+        out = fn()
+    if(cuda):
+        torch.cuda.synchronize()
+    return out, (time.time() - st_time) / n_iters
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='swept sphere collision benchmark')
+    parser.add_argument('--n_segments', type=int, default=500 * 29 * 30, help='particles * intervals * spheres')
+    parser.add_argument('--radius', type=float, default=0.05)
+    parser.add_argument('--wall', type=float, default=0.02, help='wall thickness (m)')
+    parser.add_argument('--max_step', type=float, default=0.3, help='largest sphere displacement between knots (m)')
+    parser.add_argument('--resolution', type=float, default=0.01, help='sdf grid resolution (m)')
+    parser.add_argument('--substeps', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--n_iters', type=int, default=10)
+    parser.add_argument('--cuda', action='store_true', default=False)
+    args = parser.parse_args()
+
+    device = torch.device('cuda', 0) if args.cuda else torch.device('cpu')
+    tensor_args = {'device':device, 'dtype':torch.float32}
+    world_model = {'coll_objs': {'sphere': {},
+                                 'cube': {'wall': {'dims': [args.wall, 1.0, 1.0],
+                                                   'pose': [0.5, 0.0, 0.5, 0, 0, 0, 1.0]}}}}
+    bounds = [[0.0, -0.6, -0.1], [1.0, 0.6, 1.1]]
+    world_coll = WorldPrimitiveCollision(world_model, tensor_args=tensor_args, bounds=bounds,
+                                         grid_resolution=args.resolution)
+
+    start = torch.rand((args.n_segments, 3), **tensor_args)
+    start[:,0] = 0.2 + 0.6 * start[:,0]
+    start[:,1] = -0.4 + 0.8 * start[:,1]
+    step = torch.randn((args.n_segments, 3), **tensor_args)
+    step = step / torch.norm(step, dim=-1, keepdim=True) * args.max_step * torch.rand((args.n_segments, 1), **tensor_args)
+    end = start + step
+    radius = torch.zeros(args.n_segments, **tensor_args) + args.radius
+
+    # ground truth: exact swept sphere against the wall
+    gt = world_coll.get_swept_sphere_distance(start, end, radius) > 0.0
+    print('segments: {}, colliding: {}'.format(args.n_segments, int(torch.sum(gt))))
+
+    def report(name, dist, t):
+        coll = dist > 0.0
+        missed = int(torch.sum(gt & ~coll))
+        false_pos = int(torch.sum(~gt & coll))
+        print('{:<22} time: {:7.3f}ms missed: {:6d} false positives: {:6d}'.format(name, t * 1000.0, missed, false_pos))
+
+    knots, t = timed(lambda: torch.max(world_coll.check_pts_sdf(start), world_coll.check_pts_sdf(end)) + radius,
+                     args.n_iters, args.cuda)
+    report('knots only (grid)', knots, t)
+    for n in args.substeps:
+        swept, t = timed(lambda: world_coll.check_swept_pts_sdf(start, end, n) + radius, args.n_iters, args.cuda)
+        report('swept grid x{}'.format(n), torch.max(knots, swept), t)
+    swept, t = timed(lambda: world_coll.get_swept_sphere_distance(start, end, radius), args.n_iters, args.cuda)
+    report('swept analytic', swept, t)
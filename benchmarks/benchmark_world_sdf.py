@@ -0,0 +1,103 @@
+#
+# MIT License
+#
+# Copyright (c) 2020-2021 NVIDIA CORPORATION.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.#
+""" Compares memory and query latency of the dense and the sparse (brick) sdf grids of a primitive world.
+
+Example:
+    python benchmarks/benchmark_world_sdf.py --resolution 0.01 --brick_size 8
+"""
+import argparse
+import time
+
+import torch
+
+from storm_kit.geom.sdf.world import WorldPrimitiveCollision
+from storm_kit.util_file import get_gym_configs_path, join_path, load_yaml
+
+
+def sdf_memory(world_coll):
+    tensors = [world_coll.scene_sdf, world_coll.coarse_sdf, world_coll.brick_table, world_coll.brick_sdf]
+    return sum([t.numel() * t.element_size() for t in tensors if t is not None])
+
+
+def time_queries(world_coll, pts, n_iters):
+    world_coll.check_pts_sdf(pts)
+    if(pts.is_cuda):
+        torch.cuda.synchronize()
+    st_time = time.time()
+    for _ in range(n_iters):
+        sdf = world_coll.check_pts_sdf(pts)
+    if(pts.is_cuda):
+        torch.cuda.synchronize()
+    return (time.time() - st_time) / n_iters, sdf
+
+
+def build_world(world_params, bounds, resolution, tensor_args, brick_size=None, narrow_band=0.1):
+    st_time = time.time()
+    world_coll = WorldPrimitiveCollision(world_params['world_model'], tensor_args=tensor_args, bounds=bounds,
+                                         grid_resolution=resolution, brick_size=brick_size, narrow_band=narrow_band)
+    return world_coll, time.time() - st_time
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='sdf grid benchmark')
+    parser.add_argument('--world', type=str, default='collision_primitives_3d.yml', help='gym world file')
+    parser.add_argument('--resolution', type=float, default=0.02, help='fine voxel size (m)')
+    parser.add_argument('--brick_size', type=int, default=8, help='fine voxels per brick edge')
+    parser.add_argument('--narrow_band', type=float, default=0.1, help='fine band around surfaces (m)')
+    parser.add_argument('--n_pts', type=int, default=500 * 30 * 50, help='query points per call')
+    parser.add_argument('--n_iters', type=int, default=20)
+    parser.add_argument('--no_dense', action='store_true', default=False, help='skip the dense grid (large workspaces)')
+    parser.add_argument('--cuda', action='store_true', default=False)
+    args = parser.parse_args()
+
+    device = torch.device('cuda', 0) if args.cuda else torch.device('cpu')
+    tensor_args = {'device':device, 'dtype':torch.float32}
+    world_params = load_yaml(join_path(get_gym_configs_path(), args.world))
+    bounds = [[-1.0, -1.0, -0.2], [1.0, 1.0, 1.0]]
+
+    b = torch.as_tensor(bounds, **tensor_args)
+    pts = b[0] + (b[1] - b[0]) * torch.rand((args.n_pts, 3), **tensor_args)
+
+    results = {}
+    if(not args.no_dense):
+        results['dense'] = build_world(world_params, bounds, args.resolution, tensor_args)
+    results['sparse'] = build_world(world_params, bounds, args.resolution, tensor_args,
+                                    brick_size=args.brick_size, narrow_band=args.narrow_band)
+
+    sdf_ref = None
+    for k in results:
+        world_coll, build_time = results[k]
+        q_time, sdf = time_queries(world_coll, pts, args.n_iters)
+        print('{:<7} build: {:.3f}s memory: {:.2f}MB query: {:.3f}ms ({} pts)'.format(
+            k, build_time, sdf_memory(world_coll) / 1e6, q_time * 1000.0, args.n_pts))
+        if(k == 'dense'):
+            sdf_ref = sdf
+    if(sdf_ref is not None):
+        # within the narrow band both grids should agree exactly:
+        band = torch.abs(sdf_ref) <= args.narrow_band
+        err = torch.abs(sdf - sdf_ref)
+        print('max error in band: {:.5f}m, max error outside band: {:.5f}m'.format(
+            torch.max(err[band]).item() if band.any() else 0.0,
+            torch.max(err[~band]).item() if (~band).any() else 0.0))
+    print('active bricks: {}/{}'.format(int(torch.sum(results['sparse'][0].brick_table >= 0)),
+                                        results['sparse'][0].brick_table.shape[0]))
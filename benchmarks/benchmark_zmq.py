@@ -0,0 +1,180 @@
+#
+# MIT License
+#
+# Copyright (c) 2020-2021 NVIDIA CORPORATION.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.#
+""" Loopback latency and throughput of the zmq robot interface.
+
+An echo thread subscribes to commands and publishes them back as states, like a robot driver would.
+Round trip latency is measured with one message in flight, throughput by streaming messages one way.
+The single frame binary protocol of zmq_robot_interface is compared against the previous json
+metadata + copied data protocol, over inproc and tcp transports.
+
+Example:
+    python benchmarks/benchmark_zmq.py --shapes 30x22 1x22 --transports inproc tcp --out zmq.json
+"""
+import argparse
+import json
+import threading
+import time
+
+import numpy as np
+import zmq
+
+from storm_kit.mpc.utils.zmq_robot_interface import ArraySender, recv_array
+
+
+class BinaryProtocol(object):
+    def __init__(self, socket):
+        self.sender = ArraySender(socket)
+        self.socket = socket
+
+    def send(self, A, topic):
+        self.sender.send(A, topic=topic)
+
+    def recv(self):
+        topic = self.socket.recv()
+        return recv_array(self.socket, copy=False)[0]
+
+
+class JsonProtocol(object):
+    # json metadata frame followed by a copied data frame
+    def __init__(self, socket):
+        self.socket = socket
+
+    def send(self, A, topic):
+        self.socket.send(topic, zmq.SNDMORE)
+        self.socket.send_json({'dtype': str(A.dtype), 'shape': A.shape}, zmq.SNDMORE)
+        self.socket.send(A, copy=True)
+
+    def recv(self):
+        topic = self.socket.recv()
+        md = self.socket.recv_json()
+        msg = self.socket.recv(copy=True)
+        return np.frombuffer(msg, dtype=md['dtype']).reshape(md['shape'])
+
+
+PROTOCOLS = {'binary': BinaryProtocol, 'json': JsonProtocol}
+
+
+def endpoints(transport, port):
+    if(transport == 'inproc'):
+        return 'inproc://bench_cmd_{}'.format(port), 'inproc://bench_state_{}'.format(port)
+    return 'tcp://127.0.0.1:{}'.format(port), 'tcp://127.0.0.1:{}'.format(port + 1)
+
+
+def echo(context, cmd_address, state_address, protocol, done):
+    sub = context.socket(zmq.SUB)
+    sub.connect(cmd_address)
+    sub.subscribe(b'cmd')
+    pub = context.socket(zmq.PUB)
+    pub.bind(state_address)
+    proto_sub, proto_pub = PROTOCOLS[protocol](sub), PROTOCOLS[protocol](pub)
+    poller = zmq.Poller()
+    poller.register(sub, zmq.POLLIN)
+    while not done.is_set():
+        if(poller.poll(100)):
+            proto_pub.send(np.array(proto_sub.recv()), b'state')
+    sub.close()
+    pub.close()
+
+
+def run(transport, protocol, shape, n_iters, port):
+    context = zmq.Context()
+    cmd_address, state_address = endpoints(transport, port)
+    pub = context.socket(zmq.PUB)
+    pub.bind(cmd_address)
+    done = threading.Event()
+    t = threading.Thread(target=echo, args=(context, cmd_address, state_address, protocol, done))
+    t.start()
+    time.sleep(0.1)
+    sub = context.socket(zmq.SUB)
+    sub.connect(state_address)
+    sub.subscribe(b'state')
+    proto_pub, proto_sub = PROTOCOLS[protocol](pub), PROTOCOLS[protocol](sub)
+    poller = zmq.Poller()
+    poller.register(sub, zmq.POLLIN)
+
+    A = np.random.rand(*shape)
+    # pub/sub drops messages until both sides are connected:
+    while True:
+        proto_pub.send(A, b'cmd')
+        if(poller.poll(100)):
+            proto_sub.recv()
+            break
+    while(poller.poll(100)):
+        proto_sub.recv()
+
+    latency = []
+    for _ in range(n_iters):
+        st_time = time.perf_counter()
+        proto_pub.send(A, b'cmd')
+        proto_sub.recv()
+        latency.append((time.perf_counter() - st_time) * 1e6)
+
+    # one way stream, counted on the echo side of the round trip:
+    st_time = time.perf_counter()
+    received = 0
+    for _ in range(n_iters):
+        proto_pub.send(A, b'cmd')
+        while(poller.poll(0)):
+            proto_sub.recv()
+            received += 1
+    while(received < n_iters and poller.poll(1000)):
+        proto_sub.recv()
+        received += 1
+    elapsed = time.perf_counter() - st_time
+
+    done.set()
+    t.join()
+    pub.close()
+    sub.close()
+    context.term()
+    return {'transport': transport, 'protocol': protocol, 'shape': list(shape),
+            'latency_median_us': float(np.median(latency)),
+            'latency_p99_us': float(np.percentile(latency, 99)),
+            'throughput_msg_s': received / elapsed,
+            'dropped': n_iters - received}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='zmq robot interface loopback benchmark')
+    parser.add_argument('--transports', type=str, nargs='+', default=['inproc', 'tcp'])
+    parser.add_argument('--protocols', type=str, nargs='+', default=['binary', 'json'])
+    parser.add_argument('--shapes', type=str, nargs='+', default=['1x22', '30x22', '1000x22'],
+                        help='array shapes as rowsxcols')
+    parser.add_argument('--n_iters', type=int, default=2000)
+    parser.add_argument('--port', type=int, default=5601)
+    parser.add_argument('--out', type=str, default='benchmark_zmq.json')
+    args = parser.parse_args()
+
+    results = []
+    for transport in args.transports:
+        for shape_str in args.shapes:
+            shape = tuple(int(x) for x in shape_str.split('x'))
+            for protocol in args.protocols:
+                res = run(transport, protocol, shape, args.n_iters, args.port)
+                args.port += 2
+                results.append(res)
+                print('{:7s} {:7s} {:>9s} latency {:8.1f} us (p99 {:8.1f}) throughput {:10.0f} msg/s'.format(
+                    transport, protocol, shape_str, res['latency_median_us'], res['latency_p99_us'],
+                    res['throughput_msg_s']))
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=2)
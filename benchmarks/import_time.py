@@ -0,0 +1,97 @@
+#
+# MIT License
+#
+# Copyright (c) 2020-2021 NVIDIA CORPORATION.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.#
+""" Import time budget for the controller stack.
+
+Each module is imported in a fresh interpreter with ``-X importtime``. The time on top of importing
+torch is checked against a budget, and plotting/mesh libraries that should only load with their
+features (matplotlib, trimesh, urdfpy, cv2, open3d) must not show up in sys.modules. Exits with 1 on
+a violation, so it can gate changes to the import graph.
+
+Example:
+    python benchmarks/import_time.py --budget_ms 1500
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+HEAVY_MODULES = ['matplotlib', 'trimesh', 'urdfpy', 'cv2', 'open3d']
+
+DEFAULT_MODULES = ['storm_kit.mpc.control',
+                   'storm_kit.mpc.rollout.arm_reacher',
+                   'storm_kit.mpc.task.reacher_task',
+                   'storm_kit.geom.sdf.robot_world']
+
+
+def import_time(module):
+    """Imports module in a fresh interpreter.
+
+    Returns:
+        (float, list): cumulative import time in ms, heavy modules that were loaded
+    """
+    code = ('import sys, json; import {}; '
+            'print(json.dumps([m for m in {} if m in sys.modules]))'.format(module, HEAVY_MODULES))
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if(proc.returncode != 0):
+        raise RuntimeError('importing {} failed:\n{}'.format(module, proc.stderr[-2000:]))
+    total_us = 0
+    for line in proc.stderr.splitlines():
+        if(not line.startswith('import time:') or 'cumulative' in line):
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # top level imports are not indented:
+        if(not name[1:].startswith(' ')):
+            total_us += int(cumulative)
+    return total_us / 1000.0, json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='import time budget')
+    parser.add_argument('--modules', type=str, nargs='+', default=DEFAULT_MODULES)
+    parser.add_argument('--budget_ms', type=float, default=1500.0, help='allowed import time on top of torch')
+    parser.add_argument('--n_iters', type=int, default=3, help='best of n fresh interpreters')
+    parser.add_argument('--out', type=str, default=None)
+    args = parser.parse_args()
+
+    torch_ms = min(import_time('torch')[0] for _ in range(args.n_iters))
+    print('torch: {:.1f} ms'.format(torch_ms))
+
+    result = {'torch_ms': torch_ms, 'budget_ms': args.budget_ms, 'modules': {}}
+    failed = False
+    for module in args.modules:
+        runs = [import_time(module) for _ in range(args.n_iters)]
+        total_ms = min(r[0] for r in runs)
+        heavy = runs[0][1]
+        extra_ms = total_ms - torch_ms
+        ok = extra_ms <= args.budget_ms and len(heavy) == 0
+        failed = failed or not ok
+        result['modules'][module] = {'total_ms': total_ms, 'extra_ms': extra_ms, 'heavy_modules': heavy}
+        print('{:40s} {:8.1f} ms (+{:.1f} ms over torch) {}{}'.format(module, total_ms, extra_ms,
+                                                                      'OK' if ok else 'FAIL',
+                                                                      '' if len(heavy) == 0 else ' loads ' + ', '.join(heavy)))
+    if(args.out is not None):
+        with open(args.out, 'w') as f:
+            json.dump(result, f, indent=2)
+    if(failed):
+        sys.exit(1)
@@ -0,0 +1,280 @@
+#
+# MIT License
+#
+# Copyright (c) 2020-2021 NVIDIA CORPORATION.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.#
+""" Microbenchmarks of the kernels used inside one mpc iteration, swept over batch sizes and horizons.
+
+Covers forward kinematics + jacobian, the tensor_step_* integrators, every sample library,
+get_stomp_cov, world sdf grid queries, link to link sphere distances, the self collision network
+and every active cost term of ArmReacher. Results are written as json. The script exits with 1 when
+a kernel or the construction of its inputs raises. Given a previous result as baseline, it also exits
+with 1 when a kernel is slower by more than the tolerance, or when a baseline kernel of the swept
+configurations is missing.
+
+This is a plain script like the other benchmarks rather than a pytest-benchmark or asv suite, as the
+repo has neither a test suite nor those dependencies.
+
+Example:
+    python benchmarks/microbenchmarks.py --batch_sizes 100 500 --horizons 10 30 --out micro.json
+    python benchmarks/microbenchmarks.py --baseline micro.json --tolerance 0.2
+"""
+import argparse
+import copy
+import json
+import sys
+import time
+
+import numpy as np
+import torch
+
+from storm_kit.geom.sdf.robot import find_link_distance, find_link_pair_distance
+from storm_kit.mpc.control.control_utils import get_stomp_cov
+from storm_kit.mpc.control.sample_libs import (HaltonSampleLib, HaltonStompSampleLib, KnotSampleLib,
+                                               MultipleSampleLib, RandomSampleLib, SineSampleLib, StompSampleLib)
+from storm_kit.mpc.model.integration_utils import (build_fd_matrix, build_int_matrix, tensor_step_acc,
+                                                   tensor_step_jerk, tensor_step_pos, tensor_step_vel)
+from storm_kit.mpc.rollout.arm_reacher import ArmReacher
+from storm_kit.util_file import get_gym_configs_path, get_mpc_configs_path, join_path, load_yaml
+
+
+def timed(fn, n_iters, cuda, n_warmup=2):
+    # median time of n_iters calls in ms, robust to scheduler noise:
+    for _ in range(n_warmup):
+        fn()
+    times = []
+    for _ in range(n_iters):
+        if(cuda):
+            torch.cuda.synchronize()
+        st_time = time.time()
+        fn()
+        if(cuda):
+            torch.cuda.synchronize()
+        times.append((time.time() - st_time) * 1000.0)
+    return float(np.median(times))
+
+
+def build_rollout(exp_params, world_params, batch_size, horizon, tensor_args):
+    exp_params = copy.deepcopy(exp_params)
+    exp_params['mppi']['num_particles'] = batch_size
+    exp_params['mppi']['horizon'] = horizon
+    rollout_fn = ArmReacher(exp_params, tensor_args, world_params=world_params)
+    rollout_fn.update_params(goal_ee_pos=[0.55, 0.0, 0.4], goal_ee_quat=[0.0, 0.99, -0.01, -0.01])
+    return rollout_fn
+
+
+def kinematics_kernels(rollout_fn, batch_size, horizon, tensor_args):
+    model = rollout_fn.dynamics_model
+    n_dofs = model.n_dofs
+    ee_link = rollout_fn.exp_params['model']['ee_link_name']
+    q = torch.rand((batch_size * horizon, n_dofs), **tensor_args)
+    qd = torch.zeros_like(q)
+    yield 'compute_fk_and_jacobian', lambda: model.robot_model.compute_fk_and_jacobian(q, qd, ee_link)
+
+    start_state = torch.zeros((1, n_dofs * 3), **tensor_args)
+    act = torch.rand((batch_size, horizon, n_dofs), **tensor_args)
+    state_seq = torch.zeros((batch_size, horizon, n_dofs * 3), **tensor_args)
+    dt_h = torch.ones(horizon, **tensor_args) * 0.02
+    int_mat = build_int_matrix(horizon, device=tensor_args['device'], dtype=tensor_args['dtype'])
+    fd_mat = build_fd_matrix(horizon, device=tensor_args['device'], dtype=tensor_args['dtype'], PREV_STATE=True)
+    for name, fn in [('tensor_step_acc', tensor_step_acc), ('tensor_step_vel', tensor_step_vel),
+                     ('tensor_step_pos', tensor_step_pos), ('tensor_step_jerk', tensor_step_jerk)]:
+        yield name, (lambda fn=fn: fn(start_state, act, state_seq, dt_h, n_dofs, int_mat, fd_mat))
+    yield 'rollout_open_loop', lambda: model.rollout_open_loop(start_state[0], act)
+
+
+def sampling_kernels(rollout_fn, batch_size, horizon, tensor_args):
+    d_action = rollout_fn.dynamics_model.d_action
+    shape = torch.Size([batch_size])
+    n_knots = max(horizon // 10, 3)
+    libs = {'HaltonSampleLib':HaltonSampleLib, 'RandomSampleLib':RandomSampleLib,
+            'SineSampleLib':SineSampleLib, 'StompSampleLib':StompSampleLib,
+            'HaltonStompSampleLib':HaltonStompSampleLib}
+    for name, lib_cls in libs.items():
+        lib = lib_cls(horizon=horizon, d_action=d_action, seed=0, tensor_args=tensor_args)
+        yield name + '.get_samples', (lambda lib=lib: lib.get_samples(sample_shape=shape, base_seed=0))
+
+    # MultipleSampleLib only samples with fixed_samples, and then caches. Its parts are built without
+    # caching and the cache is dropped before every call:
+    multi_lib = MultipleSampleLib(horizon=horizon, d_action=d_action, seed=0, tensor_args=tensor_args,
+                                  knot_scale=horizon // n_knots)
+    multi_lib.fixed_samples = True
+    def multi_samples():
+        multi_lib.samples = None
+        return multi_lib.get_samples(sample_shape=shape, base_seed=0)
+    yield 'MultipleSampleLib.get_samples', multi_samples
+    knot_lib = KnotSampleLib(horizon=horizon, d_action=d_action, n_knots=n_knots, degree=2,
+                             tensor_args=tensor_args)
+    yield 'KnotSampleLib.get_samples', lambda: knot_lib.get_samples(sample_shape=shape)
+    yield 'get_stomp_cov', lambda: get_stomp_cov(horizon, d_action, tensor_args=tensor_args)
+
+
+def collision_kernels(rollout_fn, batch_size, horizon, tensor_args):
+    n = batch_size * horizon
+    state_dict = rollout_fn.dynamics_model.rollout_open_loop(
+        torch.zeros(rollout_fn.dynamics_model.d_state, **tensor_args),
+        torch.rand((batch_size, horizon, rollout_fn.dynamics_model.d_action), **tensor_args))
+    link_pos = state_dict['link_pos_seq'].view(n, -1, 3)
+    link_rot = state_dict['link_rot_seq'].view(n, -1, 3, 3)
+
+    if(hasattr(rollout_fn, 'primitive_collision_cost')):
+        world_coll = rollout_fn.primitive_collision_cost.robot_world_coll.world_coll
+        bounds = world_coll.bounds
+        pts = bounds[0] + (bounds[1] - bounds[0]) * torch.rand((n, 3), **tensor_args)
+        yield 'check_pts_sdf', lambda: world_coll.check_pts_sdf(pts)
+
+    if(hasattr(rollout_fn, 'robot_self_collision_cost')):
+        coll = rollout_fn.robot_self_collision_cost.coll
+        coll.build_batch_features(batch_size=n, clone_pose=True, clone_objs=True)
+        coll.check_self_collisions(link_pos, link_rot)
+        sphere_list = coll.get_batch_robot_link_spheres_list()
+        n_links = len(sphere_list)
+        dist = torch.zeros((n, n_links, n_links), **tensor_args)
+        yield 'find_link_distance', lambda: find_link_distance(sphere_list, dist)
+        spheres = coll.get_batch_robot_link_spheres()
+        yield 'find_link_pair_distance', lambda: find_link_pair_distance(spheres, coll._self_coll_pairs, dist, 8192)
+        q = state_dict['state_seq'][:, :, :rollout_fn.n_dofs].reshape(n, -1)
+        yield 'RobotSelfCollisionNet.compute_signed_distance', lambda: coll.robot_nn.compute_signed_distance(q)
+
+
+def cost_kernels(rollout_fn, batch_size, horizon, tensor_args):
+    state_dict = rollout_fn.dynamics_model.rollout_open_loop(
+        torch.zeros(rollout_fn.dynamics_model.d_state, **tensor_args),
+        torch.rand((batch_size, horizon, rollout_fn.dynamics_model.d_action), **tensor_args))
+    ctx = rollout_fn._cost_context(state_dict)
+    # the goal term fills goal_dist for the terms that follow:
+    for term in rollout_fn.cost_graph.terms:
+        term.fn(ctx)
+    for term in rollout_fn.cost_graph.terms:
+        yield 'cost.' + term.name, (lambda term=term: term.fn(ctx))
+    yield 'cost_fn', lambda: rollout_fn.cost_fn(state_dict, None)
+
+
+def compare(results, baseline, tolerance, kernel_filter=None):
+    """Returns the kernels slower than the baseline, and the baseline kernels missing from the
+    results among the groups, batch sizes and horizons that were run.
+    """
+    base = {(r['kernel'], r['batch_size'], r['horizon']):r['time_ms'] for r in baseline['results']
+            if r['time_ms'] is not None}
+    slower = []
+    for r in results:
+        key = (r['kernel'], r['batch_size'], r['horizon'])
+        if(key in base and r['time_ms'] is not None and r['time_ms'] > (1.0 + tolerance) * base[key]):
+            slower.append((key, base[key], r['time_ms']))
+    run = set((r['group'], r['batch_size'], r['horizon']) for r in results)
+    found = set((r['kernel'], r['batch_size'], r['horizon']) for r in results)
+    missing = []
+    for r in baseline['results']:
+        key = (r['kernel'], r['batch_size'], r['horizon'])
+        if(kernel_filter is not None and kernel_filter not in r['kernel']):
+            continue
+        if((r['group'], r['batch_size'], r['horizon']) in run and key not in found):
+            missing.append(key)
+    return slower, missing
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='kernel microbenchmarks')
+    parser.add_argument('--robot', type=str, default='franka')
+    parser.add_argument('--world', type=str, default='collision_primitives_3d.yml')
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[100, 500])
+    parser.add_argument('--horizons', type=int, nargs='+', default=[10, 30])
+    parser.add_argument('--groups', type=str, nargs='+', default=['kinematics', 'sampling', 'collision', 'cost'])
+    parser.add_argument('--filter', type=str, default=None, help='only run kernels containing this string')
+    parser.add_argument('--n_iters', type=int, default=10)
+    parser.add_argument('--cuda', action='store_true', default=False)
+    parser.add_argument('--out', type=str, default='microbenchmarks.json')
+    parser.add_argument('--baseline', type=str, default=None, help='previous result to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative slowdown against the baseline')
+    args = parser.parse_args()
+
+    device = torch.device('cuda', 0) if args.cuda else torch.device('cpu')
+    tensor_args = {'device':device, 'dtype':torch.float32}
+    torch.manual_seed(0)
+    baseline = None
+    if(args.baseline is not None):
+        # read before writing, out and baseline can be the same file:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    exp_params = load_yaml(join_path(get_mpc_configs_path(), args.robot + '_reacher.yml'))
+    exp_params['robot_params'] = exp_params['model']
+    world_params = load_yaml(join_path(get_gym_configs_path(), args.world))
+    groups = {'kinematics':kinematics_kernels, 'sampling':sampling_kernels,
+              'collision':collision_kernels, 'cost':cost_kernels}
+
+    results = []
+    def report(name, group, batch_size, horizon, t, err):
+        results.append({'kernel':name, 'group':group, 'batch_size':batch_size,
+                        'horizon':horizon, 'time_ms':t, 'error':err})
+        if(t is None):
+            print('{:<48} b={:<6} h={:<4} failed: {}'.format(name, batch_size, horizon, err))
+        else:
+            print('{:<48} b={:<6} h={:<4} {:9.3f}ms'.format(name, batch_size, horizon, t))
+
+    for batch_size in args.batch_sizes:
+        for horizon in args.horizons:
+            try:
+                rollout_fn = build_rollout(exp_params, world_params, batch_size, horizon, tensor_args)
+            except Exception as e:
+                report('build_rollout', 'setup', batch_size, horizon, None, repr(e))
+                continue
+            for group in args.groups:
+                kernels = groups[group](rollout_fn, batch_size, horizon, tensor_args)
+                while True:
+                    # the generators build their inputs between kernels, which can raise as well:
+                    try:
+                        name, fn = next(kernels)
+                    except StopIteration:
+                        break
+                    except Exception as e:
+                        report(group + '.setup', group, batch_size, horizon, None, repr(e))
+                        break
+                    if(args.filter is not None and args.filter not in name):
+                        continue
+                    with torch.no_grad():
+                        try:
+                            t = timed(fn, args.n_iters, args.cuda)
+                            err = None
+                        except Exception as e:
+                            t = None
+                            err = repr(e)
+                    report(name, group, batch_size, horizon, t, err)
+
+    with open(args.out, 'w') as f:
+        json.dump({'robot':args.robot, 'device':str(device), 'torch':torch.__version__,
+                   'results':results}, f, indent=2)
+    print('wrote', args.out)
+
+    failed = False
+    for r in results:
+        if(r['error'] is not None):
+            print('FAILED     {:<48} b={:<6} h={:<4} {}'.format(r['kernel'], r['batch_size'], r['horizon'],
+                                                               r['error']))
+            failed = True
+    if(baseline is not None):
+        slower, missing = compare(results, baseline, args.tolerance, args.filter)
+        for (name, b, h), t_base, t in slower:
+            print('REGRESSION {:<48} b={:<6} h={:<4} {:9.3f}ms -> {:9.3f}ms'.format(name, b, h, t_base, t))
+        for name, b, h in missing:
+            print('MISSING    {:<48} b={:<6} h={:<4}'.format(name, b, h))
+        failed = failed or len(slower) > 0 or len(missing) > 0
+    if(failed):
+        sys.exit(1)
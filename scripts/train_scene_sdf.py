@@ -0,0 +1,151 @@
+#
+# MIT License
+#
+# Copyright (c) 2020-2021 NVIDIA CORPORATION.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.#
+
+import argparse
+import os
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from storm_kit.geom.sdf.world import WorldPrimitiveCollision
+from storm_kit.geom.nn_model.scene_sdf import SceneSDFNet
+from storm_kit.util_file import get_gym_configs_path, get_mpc_configs_path, get_weights_path, join_path, load_yaml
+
+
+def iterate_minibatches(n_size, batch_size, device):
+    # yields index tensors for shuffled minibatches, data is sliced directly from tensors:
+    perm = torch.randperm(n_size, device=device)
+    for i in range(0, n_size, batch_size):
+        yield perm[i:i + batch_size]
+
+def create_dataset(world_coll, bounds, num_points, truncation, surface_ratio=0.5, surface_noise=0.05):
+    """Samples points in the scene bounds and labels them with the analytic signed distance.
+    A part of the points is resampled close to surfaces, where the collision cost needs accuracy.
+    """
+    tensor_args = world_coll.tensor_args
+    n_uniform = int(num_points * (1.0 - surface_ratio))
+    x = bounds[0] + (bounds[1] - bounds[0]) * torch.rand((n_uniform, 3), **tensor_args)
+    y = world_coll._batch_signed_distance(x)
+
+    # near surface samples, jittered from uniform points inside the band:
+    candidates = bounds[0] + (bounds[1] - bounds[0]) * torch.rand((num_points * 4, 3), **tensor_args)
+    d = world_coll._batch_signed_distance(candidates)
+    candidates = candidates[torch.abs(d) < truncation]
+    idx = torch.randint(0, candidates.shape[0], (num_points - n_uniform,), device=tensor_args['device'])
+    x_s = candidates[idx] + surface_noise * torch.randn((idx.shape[0], 3), **tensor_args)
+    x_s = torch.max(torch.min(x_s, bounds[1]), bounds[0])
+    y_s = world_coll._batch_signed_distance(x_s)
+
+    x = torch.cat([x, x_s])
+    y = torch.cat([y, y_s]).unsqueeze(-1)
+    # far values don't matter for collision costs:
+    y[y < -truncation] = -truncation
+    return x, y
+
+def train_scene_sdf(world_file, robot_name, num_points=200000, epochs=100, truncation=0.3, mlp_layers=[256, 128]):
+    checkpoints_dir = join_path(get_weights_path(), 'scene_coll_nn')
+    os.makedirs(checkpoints_dir, exist_ok=True)
+    device = torch.device('cuda', 0) if torch.cuda.is_available() else torch.device('cpu')
+    tensor_args = {'device':device, 'dtype':torch.float32}
+
+    world_params = load_yaml(join_path(get_gym_configs_path(), world_file))
+    exp_params = load_yaml(join_path(get_mpc_configs_path(), robot_name + '_reacher.yml'))
+    bounds = torch.as_tensor(exp_params['model']['world_collision_params']['bounds'], **tensor_args)
+    world_coll = WorldPrimitiveCollision(world_params['world_model'], tensor_args=tensor_args)
+
+    x, y = create_dataset(world_coll, bounds, num_points, truncation)
+    n_size = x.shape[0]
+    perm = torch.randperm(n_size, device=device)
+    x = x[perm]
+    y = y[perm]
+    print(torch.min(y), torch.max(y))
+
+    # scale dataset, inputs to [-1, 1] within bounds:
+    mean_x = (bounds[1] + bounds[0]) / 2.0
+    std_x = (bounds[1] - bounds[0]) / 2.0
+    mean_y = torch.zeros(1, **tensor_args)
+    std_y = torch.ones(1, **tensor_args) * truncation
+    x_n = torch.div(x - mean_x, std_x)
+    y_n = torch.div(y - mean_y, std_y)
+
+    x_train = x_n[:int(n_size * 0.9)]
+    y_train = y_n[:int(n_size * 0.9)]
+    x_val = x_n[int(n_size * 0.9):]
+    y_val = y_n[int(n_size * 0.9):]
+
+    nn_model = SceneSDFNet(mlp_layers=mlp_layers)
+    model = nn_model.model.to(**tensor_args)
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-3)
+    f_name = join_path(checkpoints_dir, world_file.split('.')[0] + '_sdf.pt')
+    min_loss = 100.0
+    for e in range(epochs):
+        model.train()
+        loss = []
+        for idx in iterate_minibatches(x_train.shape[0], 1024, device):
+            optimizer.zero_grad()
+            x_b = x_train[idx]
+            y_b = y_train[idx]
+            y_pred = model.forward(x_b)
+            # weight errors close to surfaces more:
+            alpha = 1.0 + 9.0 * (torch.abs(y_b) < 0.2 / truncation)
+            train_loss = torch.mean(alpha * (y_pred - y_b) ** 2)
+            train_loss.backward()
+            optimizer.step()
+            loss.append(train_loss.item())
+
+        model.eval()
+        with torch.no_grad():
+            val_loss = F.mse_loss(model.forward(x_val), y_val, reduction='mean')
+        if(val_loss < min_loss):
+            print('saving model', val_loss.item())
+            torch.save(
+                {
+                    'epoch': e,
+                    'model_state_dict': model.state_dict(),
+                    'optimizer_state_dict': optimizer.state_dict(),
+                    'norm':{'x':{'mean':mean_x, 'std':std_x},
+                            'y':{'mean':mean_y, 'std':std_y}},
+                    'mlp_layers': mlp_layers,
+                    'bounds': bounds.cpu().tolist(),
+                    'truncation': truncation,
+                },
+                f_name)
+            min_loss = val_loss
+        print(e, np.mean(loss), val_loss.item())
+
+    # error in meters on the validation set:
+    with torch.no_grad():
+        y_pred = model.forward(x_val) * std_y + mean_y
+        y_gt = y_val * std_y + mean_y
+        band = torch.abs(y_gt) < 0.1
+        print('mean abs error: {:.4f}m, near surface: {:.4f}m'.format(
+            F.l1_loss(y_pred, y_gt).item(), F.l1_loss(y_pred[band], y_gt[band]).item()))
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='train a scene sdf network')
+    parser.add_argument('--world', type=str, default='collision_primitives_3d.yml', help='gym world file')
+    parser.add_argument('--robot', type=str, default='franka', help='robot task file providing the scene bounds')
+    parser.add_argument('--num_points', type=int, default=200000)
+    parser.add_argument('--epochs', type=int, default=100)
+    args = parser.parse_args()
+    train_scene_sdf(args.world, args.robot, num_points=args.num_points, epochs=args.epochs)
@@ -20,222 +20,180 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 # DEALINGS IN THE SOFTWARE.#
+import argparse
 
 import torch
 import torch.nn.functional as F
 import numpy as np
-from storm_kit.mpc.rollout.arm_base import ArmBase
-from storm_kit.util_file import get_configs_path, get_gym_configs_path, join_path, load_yaml, get_assets_path, get_mpc_configs_path, get_weights_path
 import yaml
-from storm_kit.mpc.control.control_utils import generate_halton_samples
+from storm_kit.util_file import join_path, get_mpc_configs_path, get_weights_path
 from storm_kit.geom.nn_model.robot_self_collision import RobotSelfCollisionNet
-import os
-import matplotlib.pyplot as plt
-class RobotDataset(torch.utils.data.Dataset):
-    def __init__(self, x,y,y_gt):
-        self.x = x
-        self.y = y
-        self.y_gt = y_gt
-    def __len__(self):
-        return self.y.shape[0]
-    def __getitem__(self, idx):
-        sample = {'x': self.x[idx,:], 'y': self.y[idx,:], 'y_gt': self.y_gt[idx,:]}
-        return sample
-def create_dataset(robot_name):
+from storm_kit.geom.nn_model.self_collision_dataset import (generate_self_collision_dataset, load_self_collision_dataset,
+                                                          self_collision_dataset_exists, BoundarySampler,
+                                                          SelfCollisionLabeler)
+
+
+def iterate_minibatches(n_size, batch_size, device):
+    # yields index tensors for shuffled minibatches, data is sliced directly from tensors:
+    perm = torch.randperm(n_size, device=device)
+    for i in range(0, n_size, batch_size):
+        yield perm[i:i + batch_size]
+
+def boundary_accuracy(y_pred, y_gt, band=0.05):
+    # fraction of samples within band of the collision boundary with the correct collision label:
+    mask = torch.abs(y_gt) < band
+    if(torch.sum(mask) == 0):
+        return 1.0
+    return torch.mean(((y_pred[mask] > 0.0) == (y_gt[mask] > 0.0)).float()).item()
+
+def fit(model, optimizer, x_train, y_train, x_val, y_val, norm, epochs, device, save_fn=None, min_epochs=20):
+    mean_x, std_x = norm['x']['mean'], norm['x']['std']
+    mean_y, std_y = norm['y']['mean'], norm['y']['std']
+    # oversample configurations close to collision:
+    coll_mask = y_train[:,0] > -0.02
+    x_coll = torch.div(x_train[coll_mask] - mean_x, std_x)
+    y_coll = torch.div(y_train[coll_mask] - mean_y, std_y)
+    x_train = torch.div(x_train - mean_x, std_x)
+    y_train = torch.div(y_train - mean_y, std_y)
+    x_val = torch.div(x_val - mean_x, std_x)
+    y_val = torch.div(y_val - mean_y, std_y)
+
+    min_loss = 100.0
+    for e in range(epochs):
+        model.train()
+        loss = []
+        for idx in iterate_minibatches(x_train.shape[0], 128, device):
+            optimizer.zero_grad()
+            
+            x_b = x_train[idx]
+            y_b = y_train[idx]
+            y_pred = model.forward(x_b)
+            train_loss = F.mse_loss(y_pred, y_b, reduction='mean')
+            if(x_coll.shape[0] > 0):
+                coll_idx = torch.randint(0, x_coll.shape[0], (32,), device=device)
+                y_coll_pred = model.forward(x_coll[coll_idx])
+                train_loss = train_loss + 1.0*F.mse_loss(y_coll_pred, y_coll[coll_idx], reduction='mean')
+            train_loss.backward()
+            optimizer.step()
+            loss.append(train_loss.item())
+
+        model.eval()
+        with torch.no_grad():
+            y_pred = model.forward(x_val)
+        val_loss = F.mse_loss(y_pred, y_val, reduction='mean')
+        train_loss = np.mean(loss)
+        if(val_loss < min_loss and e>min_epochs):
+            if(save_fn is not None):
+                print('saving model', val_loss.item())
+                save_fn(e)
+            min_loss = val_loss
+        print(e, train_loss, val_loss.item())
+
+def evaluate(model, x, y, norm, band=0.05):
+    model.eval()
+    with torch.no_grad():
+        y_pred = model.forward(torch.div(x - norm['x']['mean'], norm['x']['std']))
+        y_pred = torch.mul(y_pred, norm['y']['std']) + norm['y']['mean']
+    return F.l1_loss(y_pred, y, reduction='mean').item(), boundary_accuracy(y_pred, y, band), y_pred
+
+def create_dataset(robot_name, data_dir=None, num_samples=10000, num_workers=None, device=None, epochs=100,
+                   active_rounds=0, samples_per_round=2000, target_accuracy=0.95, band=0.05):
     checkpoints_dir = get_weights_path()+'/robot_self'
-    num_particles = 5000
     task_file = robot_name+'_reacher.yml'
-    # load robot model:
-    device = torch.device('cuda', 0) 
+    if(device is None):
+        device = torch.device('cuda', 0) if torch.cuda.is_available() else torch.device('cpu')
     tensor_args = {'device':device, 'dtype':torch.float32}
     mpc_yml_file = join_path(get_mpc_configs_path(), task_file)
 
     with open(mpc_yml_file) as file:
         exp_params = yaml.load(file, Loader=yaml.FullLoader)
-    exp_params['robot_params'] = exp_params['model'] #robot_params
-    exp_params['cost']['primitive_collision']['weight'] = 0.0
-    exp_params['control_space'] = 'pos'
-    exp_params['mppi']['horizon'] = 2
-    exp_params['mppi']['num_particles'] = num_particles
-    rollout_fn = ArmBase(exp_params, tensor_args, world_params=None)
-    
-    # sample joint angles
-    dof = rollout_fn.dynamics_model.d_action
-    q_samples = generate_halton_samples(num_particles*2, dof, use_ghalton=True,
-                                        device=tensor_args['device'],
-                                        float_dtype=tensor_args['dtype'])
-
-    # scale samples by joint range:
-    up_bounds = rollout_fn.dynamics_model.state_upper_bounds[:dof]
-    low_bounds = rollout_fn.dynamics_model.state_lower_bounds[:dof]
-
-    range_b = up_bounds - low_bounds
-    q_samples = q_samples * range_b + low_bounds
-    q_samples = q_samples.view(num_particles,2,dof)
-
-    
-    start_state = torch.zeros((rollout_fn.dynamics_model.d_state), **tensor_args)
-
-    state_dict = rollout_fn.dynamics_model.rollout_open_loop(start_state, q_samples)
-    
-    link_pos_seq = state_dict['link_pos_seq']
-    link_rot_seq = state_dict['link_rot_seq']
-    # compute link poses
-    cost = rollout_fn.robot_self_collision_cost.distance
-    dist = cost(link_pos_seq, link_rot_seq)
-
-
-    # dataset:
-    x = q_samples.view(num_particles*2, dof)
-
-    x_data  = x.cpu().numpy()
-    y = dist.view(num_particles*2,1) #* 100.0
-
-    #torch.save(x, 'x_data.p')
-    #torch.save(y, 'y_data.p')
-    #plt.scatter(x_data[:,1], x_data[:,3], c=y.cpu().numpy(), vmin=-0.1, vmax=0.1,cmap='coolwarm')
-    #plt.show()
-    #print(torch.min(y), torch.max(y))
-    #x = x[y > -0.02]
-    #y[y < -0.02] = -0.02
-    #y[y < -0.1] = 0.1
-    #y[y >= -0.02] = 1.0
-    #y[y < -0.02] = 0.0
+    robot_params = exp_params['model']
+    dof = robot_params['robot_collision_params']['dof']
+
+    # generate labels on cpu workers, reuse an existing dataset if present:
+    if(data_dir is None):
+        data_dir = join_path(checkpoints_dir, robot_name + '_self_data')
+    if(not self_collision_dataset_exists(robot_params, data_dir, num_samples)):
+        generate_self_collision_dataset(robot_params, data_dir, num_samples=num_samples,
+                                        num_workers=num_workers)
+    x, y = load_self_collision_dataset(data_dir, tensor_args)
+    n_halton = x.shape[0]
+    # halton samples are ordered, shuffle before splitting:
+    perm = torch.randperm(x.shape[0], device=device)
+    x = x[perm]
+    y = y[perm]
     
     print(torch.min(y), torch.max(y))
     
     n_size = x.shape[0]
-    #print(n_size)
-    # 
     nn_model = RobotSelfCollisionNet(n_joints=dof)
     nn_model.model.to(**tensor_args)
     model = nn_model.model
 
-    # load training set:
     x_train = x[:int((n_size)*0.7),:]
     y_train = y[:int((n_size)*0.7)]
-    x_coll = x_train[y_train[:,0]>-0.02]#.cpu().numpy()
-    y_coll = y_train[y_train[:,0]>-0.02]#.cpu().numpy()
-
-    #x_data = x_train[y_train[:,0]>-0.01].cpu().numpy()
-    #y_data = y_train[y_train[:,0]>-0.01].cpu().numpy()
-    #x_train = x_train.cpu().numpy()
-    #plt.scatter(x_data[:,1], x_data[:,3],c=y_data,vmin=-0.1, vmax=0.1, cmap='coolwarm')
-    #plt.show()
-
-    # scale dataset:
-    mean_x = torch.mean(x, dim=0)#* 0.0 #+ 1.0
-    std_x = torch.mean(x, dim=0)* 0.0 + 1.0
-    mean_y = torch.mean(y, dim=0)#* 0.0 #+ 1.0
-    std_y = torch.mean(y, dim=0)#* 0.0 + 1.0
-    
-    x_train = torch.div((x_train - mean_x),std_x)
-    #x_train[x_train!=x_train] = 0.0
-    x_coll = torch.div(x_coll - mean_x, std_x).detach()
-    y_coll = torch.div(y_coll - mean_y, std_y).detach()
-    y_train_true = y_train.clone()
-    y_train = torch.div((y_train - mean_y),std_y)
-    #y_train[y_train!=y_train] = 0.0
-    #d = y[int((n_size*2)*0.9):]
-    #print(d[d>0.0].shape)
-    #exit()
-    x = torch.div(x - mean_x,std_x)
-    x[x!=x] = 0.0
-    y = torch.div(y - mean_y,std_y)
-    y[y!=y] = 0.0
     x_val = x[int((n_size)*0.7):int((n_size)*0.9),:]
     y_val = y[int((n_size)*0.7):int((n_size)*0.9)]
     x_test = x[int((n_size)*0.9):,:]
     y_test = y[int((n_size)*0.9):]
 
-    train_dataset = RobotDataset(x_train.detach(), y_train.detach(), y_train_true.detach())
-    trainloader = torch.utils.data.DataLoader(train_dataset, batch_size=128, shuffle=True)
-    coll_dataset = RobotDataset(x_coll.detach(), y_coll.detach(), y_coll.detach())
-    collloader = torch.utils.data.DataLoader(coll_dataset, batch_size=32, shuffle=True)
-
+    # scale dataset:
+    mean_x = torch.mean(x, dim=0)
+    std_x = torch.mean(x, dim=0)* 0.0 + 1.0
+    mean_y = torch.mean(y, dim=0)
+    std_y = torch.mean(y, dim=0)
+    norm = {'x':{'mean':mean_x, 'std':std_x},
+            'y':{'mean':mean_y, 'std':std_y}}
 
     optimizer = torch.optim.Adam(model.parameters(),lr=1e-3)
-    #optimizer = torch.optim.SGD(model.parameters(),lr=1e-3)#,momentum=0.97)
 
-    #print(model)
-    epochs = 100
-    min_loss = 100.0
-    # training:
-    for e in range(epochs):
-        model.train()
-        loss = []
-        i = 0
-        x_train = x_train[torch.randperm(x_train.size()[0])]
-        for i, data in enumerate(trainloader):
-            
-            optimizer.zero_grad()
-            
-            y = data['y'].to(device)
-            y_gt = data['y_gt'].to(device)
-            x = data['x'].to(device)
-
-            coll_data = next(iter(collloader))
-
-            x_coll_batch = coll_data['x'].to(device)
-            y_coll_batch = coll_data['y'].to(device)
-            
-            y_pred = (model.forward(x))
-            y_coll_pred = (model.forward(x_coll_batch))
-            #print(y_coll_pred)#, y_coll_batch, x_coll_batch)
-            alpha = 1.0 #torch.where(y_gt > -0.1, 100.0, 1.0)
-            #train_loss = F.binary_cross_entropy_with_logits(y_pred,y) + F.binary_cross_entropy_with_logits(y_coll_pred, y_coll_batch)
-            train_loss = F.mse_loss(y_pred, y, reduction='mean') + 1.0*F.mse_loss(y_coll_pred, y_coll_batch, reduction='mean')
-            #train_loss = torch.nn.BCEWithLogitsLoss(
-            train_loss.backward()
-            optimizer.step()
-            loss.append(train_loss.item())
-            #print(train_loss.item())
-            #i += batch_size
-
-        model.eval()
-        
-        y_pred = model.forward(x_val)
-        #y_pred = torch.sigmoid(model.forward(x_val))
-        #print(x_val)
-        #print(y_pred[0,0])
-        val_loss = F.mse_loss(y_pred, y_val, reduction='mean')
-        #val_loss = F.binary_cross_entropy_with_logits(y_pred,y_val)
-        train_loss = np.mean(loss)
-        if(val_loss < min_loss and e>20):
-            print('saving model', val_loss.item())
-            torch.save(
-                {
-                    'epoch': e,
-                    'model_state_dict': model.state_dict(),
-                    'optimizer_state_dict': optimizer.state_dict(),
-                    'norm':{'x':{'mean':mean_x, 'std':std_x},
-                            'y':{'mean':mean_y, 'std':std_y}}
-                },
-                join_path(checkpoints_dir,
-                          robot_name+'_self_sdf.pt'))
-            min_loss = val_loss
-        print(e, train_loss, val_loss.item())
-
-    with torch.no_grad():
-        x = x_test#[y_test[:,0] > 0.0]
-        y = y_test#[y_test[:,0] > 0.0]
-        
-        #print(x.shape)
-        y_pred = model.forward(x)
-        y_pred = torch.mul(y_pred, std_y) + mean_y
-        y_test = torch.mul(y, std_y) + mean_y
-        print(y_test[y_test>0.0])
-        print(y_pred[y_test>0.0])
-        #print(y_pred.shape, y_test.shape)
-        loss = F.l1_loss(y_pred, y_test, reduction='mean')
-        print(torch.median(y_pred), torch.mean(y_pred))
-        print(loss.item())
+    def save_fn(e):
+        torch.save(
+            {
+                'epoch': e,
+                'model_state_dict': model.state_dict(),
+                'optimizer_state_dict': optimizer.state_dict(),
+                'norm':norm
+            },
+            join_path(checkpoints_dir,
+                      robot_name+'_self_sdf.pt'))
+
+    if(active_rounds > 0):
+        # spend new labels close to the boundary, the model is refined after every round:
+        sampler = BoundarySampler(SelfCollisionLabeler(robot_params), start_idx=n_halton, boundary_band=band)
+        round_epochs = max(epochs // (active_rounds + 1), 1)
+        for r in range(active_rounds):
+            fit(model, optimizer, x_train, y_train, x_val, y_val, norm, round_epochs, device, min_epochs=-1)
+            err, acc, _ = evaluate(model, x_test, y_test, norm, band)
+            print('round', r, 'labels', x_train.shape[0], 'boundary accuracy', acc, 'l1', err)
+            if(acc >= target_accuracy):
+                break
+            x_new, y_new = sampler.step(model, norm, x_train, y_train, samples_per_round)
+            x_train = torch.cat([x_train, x_new])
+            y_train = torch.cat([y_train, y_new])
+
+    fit(model, optimizer, x_train, y_train, x_val, y_val, norm, epochs, device, save_fn=save_fn)
+
+    err, acc, y_pred = evaluate(model, x_test, y_test, norm, band)
+    print(y_test[y_test>0.0])
+    print(y_pred[y_test>0.0])
+    print(torch.median(y_pred), torch.mean(y_pred))
+    print('labels', x_train.shape[0], 'l1', err, 'boundary accuracy', acc)
             
 if __name__=='__main__':
-    create_dataset('franka')
-    # load robot model
-    
-    # load dataset
-
-
-    # 
+    parser = argparse.ArgumentParser(description='train the self collision network')
+    parser.add_argument('--robot', type=str, default='franka', help='robot task file prefix')
+    parser.add_argument('--data_dir', type=str, default=None, help='dataset folder, generated if missing or not matching')
+    parser.add_argument('--num_samples', type=int, default=10000)
+    parser.add_argument('--num_workers', type=int, default=None, help='labelling processes, defaults to all cpus')
+    parser.add_argument('--cpu', action='store_true', default=False, help='train on cpu')
+    parser.add_argument('--epochs', type=int, default=100)
+    parser.add_argument('--active_rounds', type=int, default=0, help='active learning rounds near the collision boundary')
+    parser.add_argument('--samples_per_round', type=int, default=2000)
+    parser.add_argument('--target_accuracy', type=float, default=0.95, help='stops active learning at this boundary accuracy')
+    args = parser.parse_args()
+    device = torch.device('cpu') if args.cpu else None
+    create_dataset(args.robot, data_dir=args.data_dir, num_samples=args.num_samples,
+                   num_workers=args.num_workers, device=device, epochs=args.epochs,
+                   active_rounds=args.active_rounds, samples_per_round=args.samples_per_round,
+                   target_accuracy=args.target_accuracy)
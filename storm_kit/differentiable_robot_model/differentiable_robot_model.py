@@ -107,11 +107,11 @@ class DifferentiableRobotModel(torch.nn.Module):
         # joint is at the beginning of a link
         self._name_to_idx_map = dict()
 
-        for (i, link) in enumerate(self._urdf_model.robot.links):
+        for (i, link_name) in enumerate(self._urdf_model.link_names):
 
-            rigid_body_params = self._urdf_model.get_body_parameters_from_urdf(i, link)
+            rigid_body_params = self._urdf_model.get_body_parameters(i)
 
-            if (learnable_rigid_body_config is not None) and (link.name in learnable_rigid_body_config.learnable_links):
+            if (learnable_rigid_body_config is not None) and (link_name in learnable_rigid_body_config.learnable_links):
                 body = LearnableRigidBody(
                     learnable_rigid_body_config=learnable_rigid_body_config,
                     gt_rigid_body_params=rigid_body_params,
@@ -127,6 +127,11 @@ class DifferentiableRobotModel(torch.nn.Module):
             self._bodies.append(body)
             self._name_to_idx_map[body.name] = i
 
+        # topology is fixed after loading, resolve parents and dof indices once:
+        self._parent_idx = [0] + [self._name_to_idx_map[self._urdf_model.get_name_of_parent_body(self._bodies[i].name)]
+                                  for i in range(1, len(self._bodies))]
+        self._dof_idx = {j:idx for idx, j in enumerate(self._controlled_joints)}
+
     def delete_lxml_objects(self):
         self._urdf_model = None
 
@@ -175,14 +180,13 @@ class DifferentiableRobotModel(torch.nn.Module):
         # propagate the new joint state through the kinematic chain to update bodies position/velocities
         with profiler.record_function("robot_model/fk/for_loop"):
             for i in range(1, len(self._bodies)):
-                if i in self._controlled_joints:
-                    idx = self._controlled_joints.index(i)
+                if i in self._dof_idx:
+                    idx = self._dof_idx[i]
                     self._bodies[i].update_joint_state(q[:, idx].unsqueeze(1), qd[:, idx].unsqueeze(1))
                 body = self._bodies[i]
 
-                parent_name = self._urdf_model.get_name_of_parent_body(body.name)
-                # find the joint that has this link as child
-                parent_body = self._bodies[self._name_to_idx_map[parent_name]]
+                # the body this link is attached to through its joint
+                parent_body = self._bodies[self._parent_idx[i]]
 
                 # transformation operator from child link to parent link
                 childToParentT = body.joint_pose
@@ -260,9 +264,7 @@ class DifferentiableRobotModel(torch.nn.Module):
 
         for i in range(1, len(self._bodies)):
             body = self._bodies[i]
-            parent_name = self._urdf_model.get_name_of_parent_body(body.name)
-
-            parent_body = self._bodies[self._name_to_idx_map[parent_name]]
+            parent_body = self._bodies[self._parent_idx[i]]
 
             # get the inverse of the current joint pose
             inv_pose = body.joint_pose.inverse()
@@ -548,6 +550,35 @@ class DifferentiableRobotModel(torch.nn.Module):
         # st=time.time()
         return ee_pos.to(inp_device), ee_rot.to(inp_device), lin_jac.to(inp_device), ang_jac.to(inp_device)
 
+    def apply_link_jacobian_transpose(
+        self, link_name: str, pts: torch.Tensor, vecs: torch.Tensor
+    ) -> torch.Tensor:
+        r"""
+        Maps cartesian vectors applied at points rigidly attached to a link to joint space, i.e. the
+        sum of J(p)^T v over the points. Uses the body poses of the last forward kinematics call.
+
+        Args:
+            link_name: name of the link the points are attached to
+            pts: points in the base frame [batch_size x n_pts x 3]
+            vecs: vectors applied at the points [batch_size x n_pts x 3]
+
+        Returns: joint space vector [batch_size x n_dofs]
+
+        """
+        tau = torch.zeros([pts.shape[0], self._n_dofs], **self.tensor_args)
+        parent_joint_id = self._urdf_model.find_joint_of_body(link_name)
+        for i, idx in enumerate(self._controlled_joints):
+            if (idx - 1) > parent_joint_id:
+                continue
+            pose = self._bodies[idx].pose
+            axis_idx = self._bodies[idx].axis_idx
+            p_i = pose.translation().unsqueeze(1)
+            z_i = torch.index_select(pose.rotation(), -1, axis_idx).squeeze(-1)
+            # (z_i x (p - p_i)) . v = z_i . ((p - p_i) x v)
+            moment = torch.sum(torch.cross(pts - p_i, vecs, dim=-1), dim=1)
+            tau[:, i] = torch.sum(z_i * moment, dim=-1)
+        return tau
+
     def get_joint_limits(self) -> List[Dict[str, torch.Tensor]]:
         r"""
 
@@ -559,6 +590,14 @@ class DifferentiableRobotModel(torch.nn.Module):
             limits.append(self._bodies[idx].get_joint_limits())
         return limits
 
+    def get_joint_names(self) -> List[str]:
+        r"""
+
+        Returns: a list containing names of the controlled joints, in dof order
+
+        """
+        return [self._urdf_model.get_body_parameters(idx)['joint_name'] for idx in self._controlled_joints]
+
     def get_link_names(self) -> List[str]:
         r"""
 
@@ -53,48 +53,152 @@
 # SOFTWARE.#
 
 # Copyright (c) Facebook, Inc. and its affiliates.
+import hashlib
 import os
 import torch
-from urdf_parser_py.urdf import URDF
+
+from ..util_file import get_cache_path, join_path
+
+# bump when the layout of the compiled description changes:
+DESCRIPTION_VERSION = 1
+_descriptions = {}
+
+
+def get_urdf_hash(urdf_path):
+    with open(urdf_path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def load_robot_description(urdf_path, use_cache=True):
+    """Loads the compiled description of a urdf, see :func:`URDFRobotModel.compile_description`.
+    Descriptions are kept in memory and in a cache file keyed by the hash of the urdf, so the urdf
+    is only parsed when it changes.
+    """
+    urdf_hash = get_urdf_hash(urdf_path)
+    if(urdf_hash in _descriptions):
+        return _descriptions[urdf_hash]
+    cache_file = join_path(join_path(get_cache_path(), 'urdf'), urdf_hash + '.pt')
+    description = None
+    if(use_cache and os.path.exists(cache_file)):
+        try:
+            description = torch.load(cache_file)
+            if(description['version'] != DESCRIPTION_VERSION):
+                description = None
+        except Exception:
+            description = None
+    if(description is None):
+        description = URDFRobotModel.compile_description(URDFRobotModel.parse_urdf(urdf_path))
+        description['urdf_hash'] = urdf_hash
+        if(use_cache):
+            try:
+                os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+                tmp_file = cache_file + '.' + str(os.getpid())
+                torch.save(description, tmp_file)
+                os.replace(tmp_file, cache_file)
+            except OSError:
+                print('WARNING: could not write urdf cache', cache_file)
+    _descriptions[urdf_hash] = description
+    return description
 
 
 class URDFRobotModel(object):
-    def __init__(self, urdf_path, tensor_args={'device':"cpu", 'dtype':torch.float32}):
-        self.robot = URDF.from_xml_file(urdf_path)
+    def __init__(self, urdf_path, tensor_args={'device':"cpu", 'dtype':torch.float32}, use_cache=True):
+        """Robot description from a urdf. Topology, joint and inertial parameters are read from a
+        compiled description, the parsed urdf is only loaded when :attr:`robot` is accessed.
+        """
         self.urdf_path = urdf_path
         self._device = tensor_args['device']
         self.tensor_args = tensor_args
+        self._robot = None
+        self.description = load_robot_description(urdf_path, use_cache)
+        self._link_idx = {name:i for i, name in enumerate(self.description['link_names'])}
+
+    @staticmethod
+    def parse_urdf(urdf_path):
+        from urdf_parser_py.urdf import URDF
+        return URDF.from_xml_file(urdf_path)
+
+    @property
+    def robot(self):
+        if(self._robot is None):
+            self._robot = self.parse_urdf(self.urdf_path)
+        return self._robot
+
+    @staticmethod
+    def compile_description(robot):
+        """Extracts topology indices, joint limits, axes, fixed transforms, inertial parameters and
+        collision meshes of a parsed urdf into plain python types and cpu tensors.
+        """
+        cpu_args = {'device':"cpu", 'dtype':torch.float64}
+        joint_of_body = {}
+        for (i, joint) in enumerate(robot.joints):
+            # first joint wins, same as a linear scan:
+            if(joint.child not in joint_of_body):
+                joint_of_body[joint.child] = i
+        parser = URDFRobotModel.__new__(URDFRobotModel)
+        parser._robot = robot
+        parser.tensor_args = cpu_args
+        parser._joint_of_body = joint_of_body
+        body_params = [parser._parse_body_parameters(i, link) for (i, link) in enumerate(robot.links)]
+
+        collision = {}
+        for link in robot.links:
+            if(link.collision is None or not hasattr(link.collision.geometry, 'filename')):
+                continue
+            origin = link.collision.origin
+            collision[link.name] = (link.collision.geometry.filename,
+                                    None if origin is None else (list(origin.position), list(origin.rotation)))
+        return {'version':DESCRIPTION_VERSION,
+                'link_names':[link.name for link in robot.links],
+                'joint_names':[joint.name for joint in robot.joints],
+                'actuated_joint_names':[joint.name for joint in robot.joints if joint.type != 'fixed'],
+                'joint_parents':[joint.parent for joint in robot.joints],
+                'joint_of_body':joint_of_body,
+                'body_params':body_params,
+                'collision':collision}
 
     def find_joint_of_body(self, body_name):
-        for (i, joint) in enumerate(self.robot.joints):
-            if joint.child == body_name:
-                return i
-        return -1
+        return self.description['joint_of_body'].get(body_name, -1)
+
     def find_link_idx(self, link_name):
-        for (i,link) in enumerate(self.robot.links):
-            if(link.name == link_name):
-                return i
-        return -1
+        return self._link_idx.get(link_name, -1)
 
     def get_name_of_parent_body(self, link_name):
         jid = self.find_joint_of_body(link_name)
-        joint = self.robot.joints[jid]
-        return joint.parent
+        return self.description['joint_parents'][jid]
+
+    @property
+    def link_names(self):
+        return self.description['link_names']
+
+    @property
+    def actuated_joint_names(self):
+        return self.description['actuated_joint_names']
 
     def get_link_collision_mesh(self, link_name):
-        idx = self.find_link_idx(link_name)
-        link = self.robot.links[idx]
-        mesh_fname = link.collision.geometry.filename
-        mesh_origin = link.collision.origin
+        mesh_fname, mesh_origin = self.description['collision'][link_name]
         origin_pose = torch.zeros(6).to(**self.tensor_args)
         if(mesh_origin is not None):
-            origin_pose[:3] = mesh_origin.position
-            origin_pose[3:6] = mesh_origin.rotation
+            origin_pose[:3] = torch.as_tensor(mesh_origin[0])
+            origin_pose[3:6] = torch.as_tensor(mesh_origin[1])
             
         # join to urdf path
         mesh_fname = os.path.join(os.path.dirname(self.urdf_path), mesh_fname)
         return mesh_fname, origin_pose
+
+    def get_body_parameters(self, i):
+        """Parameters of the i-th link from the compiled description, on the device of this model."""
+        params = dict(self.description['body_params'][i])
+        for k, v in params.items():
+            if(isinstance(v, torch.Tensor)):
+                params[k] = v.to(**self.tensor_args)
+        return params
+
     def get_body_parameters_from_urdf(self, i, link):
+        if(not hasattr(self, '_joint_of_body')):
+            self._joint_of_body = self.description['joint_of_body']
+        return self._parse_body_parameters(i, link)
+
+    def _parse_body_parameters(self, i, link):
         body_params = {}
         body_params['joint_id'] = i
         body_params['link_name'] = link.name
@@ -109,7 +213,7 @@ class URDFRobotModel(object):
             joint_axis = torch.zeros((1, 3), **self.tensor_args)
         else:
             link_name = link.name
-            jid = self.find_joint_of_body(link_name)
+            jid = self._joint_of_body.get(link_name, -1)
             joint = self.robot.joints[jid]
             joint_name = joint.name
             # find joint that is the "child" of this body according to urdf
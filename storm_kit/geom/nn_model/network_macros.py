@@ -21,6 +21,8 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 # DEALINGS IN THE SOFTWARE.#
 
+import copy
+
 import torch
 from torch import nn
 from torch.nn import Sequential as Seq, Linear as Lin, ReLU, ReLU6, ELU, Dropout, BatchNorm1d as BN, LayerNorm as LN
@@ -140,6 +142,56 @@ class MLPRegression(nn.Module):
         """        
         self.apply(weights_init)
 
+class FusedMLPRegression(nn.Module):
+    def __init__(self, model, norm_dict, in_key='x', out_key='y'):
+        """Inference copy of a trained :class:`MLPRegression` with the data normalization folded in, so that
+        it maps raw inputs to raw outputs. Dropout is dropped, the input scaling is folded into the first
+        linear layer (or applied before the positional encoding when nerf is used) and the output scaling
+        is folded into the last linear layer. The module is scriptable.
+
+        Args:
+            model (MLPRegression): trained model
+            norm_dict (Dict): normalization dictionary of the form dict={key:{'mean':,'std':}}
+            in_key (str, optional): key of the input data. Defaults to 'x'.
+            out_key (str, optional): key of the output data. Defaults to 'y'.
+        """
+        super(FusedMLPRegression, self).__init__()
+        self.nerf = model.nerf
+        layers = [copy.deepcopy(m) for block in model.mlp_layers for m in block if not isinstance(m, Dropout)]
+        linears = [m for m in layers if isinstance(m, Lin)]
+
+        with torch.no_grad():
+            in_std = norm_dict[in_key]['std'].to(linears[0].weight)
+            # scale_to_net maps 0/0 to 0:
+            in_scale = torch.where(in_std != 0.0, 1.0 / in_std, torch.zeros_like(in_std))
+            in_shift = -1.0 * norm_dict[in_key]['mean'].to(in_std) * in_scale
+            if(not self.nerf):
+                first = linears[0]
+                fused_first = Lin(first.in_features, first.out_features, bias=True).to(first.weight)
+                fused_first.weight.copy_(first.weight * in_scale)
+                bias = first.bias if first.bias is not None else torch.zeros_like(fused_first.bias)
+                fused_first.bias.copy_(bias + first.weight @ in_shift)
+                layers[layers.index(first)] = fused_first
+                in_scale = torch.ones_like(in_scale)
+                in_shift = torch.zeros_like(in_shift)
+
+            last = linears[-1]
+            out_std = norm_dict[out_key]['std'].to(last.weight).view(-1)
+            out_mean = norm_dict[out_key]['mean'].to(last.weight).view(-1)
+            last.weight.copy_(last.weight * out_std.unsqueeze(-1))
+            last.bias.copy_(last.bias * out_std + out_mean)
+
+        self.register_buffer('in_scale', in_scale)
+        self.register_buffer('in_shift', in_shift)
+        self.layers = Seq(*layers)
+
+    def forward(self, x):
+        """forward pass on raw inputs, returns raw outputs."""
+        if(self.nerf):
+            x = x * self.in_scale + self.in_shift
+            x = torch.cat((torch.sin(x), torch.cos(x)),1)
+        return self.layers(x)
+
 def scale_to_base(data, norm_dict, key):
     """Scale the tensor back to the orginal units.  
 
@@ -24,7 +24,7 @@
 import torch
 from torch import nn
 from torch.nn import Sequential as Seq, Linear as Lin, ReLU, ELU, ReLU6
-from .network_macros import MLPRegression, scale_to_base, scale_to_net
+from .network_macros import MLPRegression, FusedMLPRegression, scale_to_base, scale_to_net
 from ...util_file import get_weights_path, join_path
 
 
@@ -48,14 +48,19 @@ class RobotSelfCollisionNet():
         self.model = MLPRegression(in_channels, out_channels, mlp_layers,
                                    dropout_ratio, batch_norm=False, act_fn=act_fn,
                                    layer_norm=False, nerf=True)
+        self.fused_model = None
+        self.precision = None
 
-    def load_weights(self, f_name, tensor_args):
+    def load_weights(self, f_name, tensor_args, precision='fp32'):
         """Loads pretrained network weights if available.
 
         Args:
             f_name (str): file name, this is relative to weights folder in this repo.
             tensor_args (Dict): device and dtype for pytorch tensors
+            precision (str, optional): precision of the fused inference model, see :func:`build_fused_model`.
+                None keeps the eager model. Defaults to 'fp32'.
         """        
+        loaded = False
         try:
             chk = torch.load(join_path(get_weights_path(), f_name))
             self.model.load_state_dict(chk["model_state_dict"])
@@ -63,12 +68,43 @@ class RobotSelfCollisionNet():
             for k in self.norm_dict.keys():
                 self.norm_dict[k]['mean'] = self.norm_dict[k]['mean'].to(**tensor_args)
                 self.norm_dict[k]['std'] = self.norm_dict[k]['std'].to(**tensor_args)
+            loaded = True
         except Exception:
             print('WARNING: Weights not loaded')
         self.model = self.model.to(**tensor_args)
         self.tensor_args = tensor_args
         self.model.eval()
-        
+        if(loaded and precision is not None):
+            self.build_fused_model(precision)
+
+    def build_fused_model(self, precision='fp32'):
+        """Builds a TorchScript inference model with the normalization folded into the network.
+
+        Args:
+            precision (str, optional): 'fp32', 'fp16' (weights and activations in half precision) or
+                'int8' (dynamically quantized linear layers, cpu only). Defaults to 'fp32'.
+        """
+        fused = FusedMLPRegression(self.model, self.norm_dict).to(**self.tensor_args).eval()
+        if(precision == 'fp16'):
+            fused = fused.half()
+        elif(precision == 'int8'):
+            if(torch.device(self.tensor_args['device']).type != 'cpu'):
+                print('WARNING: int8 self collision model is only supported on cpu, using fp32')
+                precision = 'fp32'
+            else:
+                fused = torch.quantization.quantize_dynamic(fused.float(), {nn.Linear}, dtype=torch.qint8)
+        elif(precision != 'fp32'):
+            raise ValueError('Unknown precision: ' + str(precision))
+        self.fused_model = torch.jit.freeze(torch.jit.script(fused))
+        self.precision = precision
+
+    def save_fused_model(self, f_name):
+        """Saves the TorchScript inference model, it runs without this package (inputs/outputs are raw values).
+
+        Args:
+            f_name (str): file name, this is relative to weights folder in this repo.
+        """
+        torch.jit.save(self.fused_model, join_path(get_weights_path(), f_name))
             
     def compute_signed_distance(self, q):
         """Compute the signed distance given the joint config.
@@ -80,6 +116,9 @@ class RobotSelfCollisionNet():
             [tensor]: largest signed distance between any two non-consecutive links of the robot.
         """        
         with torch.no_grad():
+            if(self.fused_model is not None):
+                q_in = q.half() if self.precision == 'fp16' else q
+                return self.fused_model(q_in).to(dtype=q.dtype)
             q_scale = scale_to_net(q, self.norm_dict,'x')
             dist = self.model.forward(q_scale)
             dist_scale = scale_to_base(dist, self.norm_dict, 'y')
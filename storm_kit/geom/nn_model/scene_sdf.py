@@ -0,0 +1,97 @@
+#
+# MIT License
+#
+# Copyright (c) 2020-2021 NVIDIA CORPORATION.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.#
+
+import torch
+from torch import nn
+from torch.nn import ELU
+from .network_macros import MLPRegression, FusedMLPRegression
+from ...util_file import get_weights_path, join_path
+
+
+class SceneSDFNet():
+    """This class loads a coordinate network to predict the signed distance of points to a static scene."""
+    
+    def __init__(self, mlp_layers=[256, 128]):
+        """initialize class
+
+        Args:
+            mlp_layers (list, optional): perceptrons in each layer. Defaults to [256, 128].
+        """        
+        self.mlp_layers = mlp_layers
+        self.model = MLPRegression(3, 1, mlp_layers, 0.0, batch_norm=False, act_fn=ELU,
+                                   layer_norm=False, nerf=False)
+        self.fused_model = None
+        self.norm_dict = None
+        self.bounds = None
+        self.truncation = None
+
+    def load_weights(self, f_name, tensor_args):
+        """Loads trained network weights, see scripts/train_scene_sdf.py.
+
+        Args:
+            f_name (str): file name, this is relative to weights folder in this repo.
+            tensor_args (Dict): device and dtype for pytorch tensors
+        """        
+        chk = torch.load(join_path(get_weights_path(), f_name), map_location=tensor_args['device'])
+        if(chk['mlp_layers'] != self.mlp_layers):
+            self.__init__(chk['mlp_layers'])
+        self.model.load_state_dict(chk["model_state_dict"])
+        self.norm_dict = chk["norm"]
+        for k in self.norm_dict.keys():
+            self.norm_dict[k]['mean'] = self.norm_dict[k]['mean'].to(**tensor_args)
+            self.norm_dict[k]['std'] = self.norm_dict[k]['std'].to(**tensor_args)
+        self.bounds = torch.as_tensor(chk['bounds'], **tensor_args)
+        self.truncation = chk['truncation']
+        self.model = self.model.to(**tensor_args)
+        self.tensor_args = tensor_args
+        self.model.eval()
+        self.fused_model = torch.jit.script(FusedMLPRegression(self.model, self.norm_dict).to(**tensor_args).eval())
+
+    def compute_signed_distance(self, pts):
+        """Compute the signed distance of points to the scene, values are truncated at -truncation.
+
+        Args:
+            pts (tensor): query points [b, 3]
+
+        Returns:
+            [tensor]: signed distance (negative outside, positive inside) [b]
+        """        
+        with torch.no_grad():
+            dist = self.fused_model(pts).view(-1)
+        return dist
+
+    def compute_signed_distance_and_gradient(self, pts):
+        """Compute the signed distance and its gradient w.r.t. the query points.
+
+        Args:
+            pts (tensor): query points [b, 3]
+
+        Returns:
+            [tensor]: signed distance [b]
+            [tensor]: gradient of the signed distance [b, 3]
+        """        
+        with torch.enable_grad():
+            pts = pts.detach().requires_grad_(True)
+            dist = self.fused_model(pts).view(-1)
+            grad = torch.autograd.grad(dist.sum(), pts)[0]
+        return dist.detach(), grad
@@ -0,0 +1,298 @@
+#
+# MIT License
+#
+# Copyright (c) 2020-2021 NVIDIA CORPORATION.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.#
+"""
+Generates self collision datasets on cpu. Joint configurations are sampled from a halton sequence
+that is sharded by index across a process pool, labelled with the analytic sphere distance and
+streamed into memory-mapped ``.npy`` files.
+"""
+import copy
+import hashlib
+import json
+import multiprocessing as mp
+import os
+
+import numpy as np
+import torch
+
+from ...differentiable_robot_model.differentiable_robot_model import DifferentiableRobotModel
+from ...mpc.control.control_utils import generate_prime_numbers, generate_van_der_corput_samples_batch
+from ...util_file import get_assets_path, join_path
+from ..sdf.robot import RobotSphereCollision
+from .network_macros import scale_to_base, scale_to_net
+
+
+class SelfCollisionLabeler(object):
+    """Computes the analytic self collision distance of joint configurations.
+    Uses forward kinematics of the urdf and :func:`RobotSphereCollision.check_self_collisions`,
+    which is the same label as the cost computes in 'analytic' mode.
+    """
+    def __init__(self, robot_params, tensor_args={'device':"cpu", 'dtype':torch.float32}):
+        """
+        Args:
+            robot_params (Dict): model entry of an mpc task file, e.g. franka_reacher.yml
+            tensor_args (Dict): device and dtype for pytorch tensors
+        """
+        self.tensor_args = tensor_args
+        self.link_names = robot_params['link_names']
+        self.robot_model = DifferentiableRobotModel(join_path(get_assets_path(), robot_params['urdf_path']),
+                                                    None, tensor_args=tensor_args)
+        self.n_dofs = self.robot_model._n_dofs
+
+        coll_params = copy.deepcopy(robot_params['robot_collision_params'])
+        coll_params['urdf'] = join_path(get_assets_path(), coll_params['urdf'])
+        # the network is not used for labelling:
+        coll_params['self_collision_precision'] = None
+        self.coll = RobotSphereCollision(coll_params, 1, tensor_args=tensor_args)
+        self.batch_size = None
+        
+        lows = []
+        highs = []
+        for lim in self.robot_model.get_joint_limits():
+            lows.append(float(lim['lower']))
+            highs.append(float(lim['upper']))
+        self.q_lower = torch.as_tensor(lows, **tensor_args)
+        self.q_upper = torch.as_tensor(highs, **tensor_args)
+        
+    def sample(self, start_idx, num_samples):
+        """Halton samples [start_idx, start_idx + num_samples) scaled to the joint limits.
+        Shards with disjoint index ranges together give the same set as one long sequence.
+        """
+        bases = generate_prime_numbers(self.n_dofs)
+        idx_batch = torch.arange(start_idx + 1, start_idx + num_samples + 1)
+        q = torch.stack([generate_van_der_corput_samples_batch(idx_batch, b) for b in bases], dim=-1)
+        q = q.to(**self.tensor_args)
+        return q * (self.q_upper - self.q_lower) + self.q_lower
+
+    def __call__(self, q):
+        """
+        Args:
+            q (tensor): joint configurations [b, n_dofs]
+
+        Returns:
+            tensor: largest penetration over links [b], positive in collision
+        """
+        batch_size = q.shape[0]
+        if(self.batch_size != batch_size):
+            self.batch_size = batch_size
+            self.coll.build_batch_features(batch_size=batch_size, clone_pose=True, clone_objs=True)
+        self.robot_model.update_kinematic_state(q, torch.zeros_like(q))
+        link_pos = []
+        link_rot = []
+        for k in self.link_names:
+            pos, rot = self.robot_model.get_link_pose(k)
+            link_pos.append(pos)
+            link_rot.append(rot)
+        link_pos = torch.stack(link_pos, dim=1)
+        link_rot = torch.stack(link_rot, dim=1)
+        dist = self.coll.check_self_collisions(link_pos, link_rot)
+        return torch.max(dist, dim=-1)[0]
+
+
+_labeler = None
+
+def _init_worker(robot_params):
+    global _labeler
+    # one thread per process, the pool provides the parallelism:
+    torch.set_num_threads(1)
+    _labeler = SelfCollisionLabeler(robot_params)
+
+def _label_shard(args):
+    x_file, y_file, start_idx, num_samples, batch_size = args
+    x_mm = np.load(x_file, mmap_mode='r+')
+    y_mm = np.load(y_file, mmap_mode='r+')
+    with torch.no_grad():
+        for i in range(start_idx, start_idx + num_samples, batch_size):
+            n = min(batch_size, start_idx + num_samples - i)
+            q = _labeler.sample(i, n)
+            x_mm[i:i + n] = q.numpy()
+            y_mm[i:i + n, 0] = _labeler(q).numpy()
+    x_mm.flush()
+    y_mm.flush()
+    return num_samples
+
+def _dataset_meta(robot_params, num_samples):
+    params = {'urdf_path': robot_params['urdf_path'], 'link_names': robot_params['link_names'],
+              'robot_collision_params': robot_params['robot_collision_params']}
+    config_hash = hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+    return {'num_samples': num_samples, 'dof': robot_params['robot_collision_params']['dof'],
+            'config_hash': config_hash}
+
+def self_collision_dataset_exists(robot_params, data_dir, num_samples):
+    """True when data_dir holds a finished dataset of :func:`generate_self_collision_dataset` with the
+    same number of samples, dof and collision model.
+    """
+    meta_file = join_path(data_dir, 'meta.json')
+    if(not os.path.exists(meta_file)):
+        return False
+    with open(meta_file) as f:
+        meta = json.load(f)
+    return meta == _dataset_meta(robot_params, num_samples)
+
+def generate_self_collision_dataset(robot_params, data_dir, num_samples=100000, num_workers=None,
+                                    shard_size=10000, batch_size=1000):
+    """Samples and labels a self collision dataset with a cpu process pool.
+
+    Args:
+        robot_params (Dict): model entry of an mpc task file
+        data_dir (str): output folder, gets x.npy [num_samples, n_dofs], y.npy [num_samples, 1] and
+            meta.json, which is written last and marks the dataset as finished
+        num_samples (int): number of joint configurations
+        num_workers (int, optional): processes, defaults to the number of cpus
+        shard_size (int): samples per task given to a worker
+        batch_size (int): samples labelled per kinematics call inside a worker
+
+    Returns:
+        (str, str): paths of the x and y files
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    dof = robot_params['robot_collision_params']['dof']
+    x_file = join_path(data_dir, 'x.npy')
+    y_file = join_path(data_dir, 'y.npy')
+    meta_file = join_path(data_dir, 'meta.json')
+    if(os.path.exists(meta_file)):
+        os.remove(meta_file)
+    # preallocate temporary files, workers write to disjoint rows. They replace the dataset once
+    # every shard is labelled, so an interrupted run never looks finished:
+    x_tmp = x_file + '.tmp'
+    y_tmp = y_file + '.tmp'
+    x_mm = np.lib.format.open_memmap(x_tmp, mode='w+', dtype=np.float32, shape=(num_samples, dof))
+    y_mm = np.lib.format.open_memmap(y_tmp, mode='w+', dtype=np.float32, shape=(num_samples, 1))
+    del x_mm, y_mm
+
+    shards = [(x_tmp, y_tmp, i, min(shard_size, num_samples - i), batch_size)
+              for i in range(0, num_samples, shard_size)]
+    if(num_workers is None):
+        num_workers = os.cpu_count()
+    ctx = mp.get_context('spawn')
+    done = 0
+    with ctx.Pool(num_workers, initializer=_init_worker, initargs=(robot_params,)) as pool:
+        for n in pool.imap_unordered(_label_shard, shards):
+            done += n
+            print('labelled {}/{}'.format(done, num_samples))
+    os.replace(x_tmp, x_file)
+    os.replace(y_tmp, y_file)
+    with open(meta_file, 'w') as f:
+        json.dump(_dataset_meta(robot_params, num_samples), f)
+    return x_file, y_file
+
+def load_self_collision_dataset(data_dir, tensor_args={'device':"cpu", 'dtype':torch.float32}):
+    """Loads a dataset written by :func:`generate_self_collision_dataset` as tensors.
+
+    Returns:
+        (tensor, tensor): x [n, n_dofs], y [n, 1]
+    """
+    x = torch.from_numpy(np.load(join_path(data_dir, 'x.npy'), mmap_mode='r').copy()).to(**tensor_args)
+    y = torch.from_numpy(np.load(join_path(data_dir, 'y.npy'), mmap_mode='r').copy()).to(**tensor_args)
+    return x, y
+
+class BoundarySampler(object):
+    """Active learning sampler that spends labels close to the collision boundary.
+    Candidates are fresh halton samples and perturbations of labelled samples close to the
+    boundary. They are scored with the current network, using dropout at inference to estimate
+    uncertainty, and the ones with the smallest ``|mean| - beta * std`` are labelled with the
+    analytic oracle. A fraction of fresh samples is kept to explore unseen regions.
+    """
+    def __init__(self, labeler, start_idx=0, pool_factor=10, boundary_band=0.05, n_mc=8, beta=1.0,
+                 explore_ratio=0.2, perturb_std=0.05):
+        """
+        Args:
+            labeler (SelfCollisionLabeler): analytic oracle and halton sampler
+            start_idx (int): first halton index not used by the labelled dataset
+            pool_factor (int): candidates scored per selected sample
+            boundary_band (float): distance [m] below which labelled samples seed perturbations
+            n_mc (int): stochastic forward passes for the uncertainty estimate
+            beta (float): weight of the uncertainty in the score
+            explore_ratio (float): fraction of selected samples drawn uniformly from fresh candidates
+            perturb_std (float): perturbation std, relative to the joint range
+        """
+        self.labeler = labeler
+        self.halton_idx = start_idx
+        self.pool_factor = pool_factor
+        self.boundary_band = boundary_band
+        self.n_mc = n_mc
+        self.beta = beta
+        self.explore_ratio = explore_ratio
+        self.perturb_std = perturb_std
+        
+    def candidates(self, x_labelled, y_labelled, num_candidates):
+        device = x_labelled.device
+        n_fresh = num_candidates // 2
+        fresh = self.labeler.sample(self.halton_idx, n_fresh).to(device=device)
+        self.halton_idx += n_fresh
+
+        seeds = x_labelled[torch.abs(y_labelled[:,0]) < self.boundary_band]
+        if(seeds.shape[0] == 0):
+            return fresh, fresh
+        q_lower = self.labeler.q_lower.to(device=device)
+        q_upper = self.labeler.q_upper.to(device=device)
+        idx = torch.randint(0, seeds.shape[0], (num_candidates - n_fresh,), device=device)
+        perturbed = seeds[idx] + self.perturb_std * (q_upper - q_lower) * torch.randn_like(seeds[idx])
+        perturbed = torch.max(torch.min(perturbed, q_upper), q_lower)
+        return fresh, torch.cat([fresh, perturbed])
+
+    def score(self, model, norm_dict, q):
+        """Returns mean and std of the predicted distance [m] over stochastic forward passes."""
+        was_training = model.training
+        # keep dropout active for sampling:
+        model.train()
+        with torch.no_grad():
+            q_in = scale_to_net(q, norm_dict, 'x')
+            pred = torch.stack([scale_to_base(model.forward(q_in), norm_dict, 'y')[:,0]
+                                for _ in range(self.n_mc)])
+        model.train(was_training)
+        return torch.mean(pred, dim=0), torch.std(pred, dim=0)
+
+    def select(self, model, norm_dict, x_labelled, y_labelled, num_samples):
+        """Picks num_samples configurations to label next.
+
+        Args:
+            model (nn.Module): current network, takes scaled joint configs
+            norm_dict (Dict): input/output normalization of the network
+            x_labelled (tensor): labelled configs [n, n_dofs]
+            y_labelled (tensor): labels [n, 1]
+            num_samples (int): samples to select
+
+        Returns:
+            tensor: configs [num_samples, n_dofs]
+        """
+        fresh, cand = self.candidates(x_labelled, y_labelled, num_samples * self.pool_factor)
+        mean, std = self.score(model, norm_dict, cand)
+        n_explore = min(int(num_samples * self.explore_ratio), fresh.shape[0])
+        acq = torch.abs(mean) - self.beta * std
+        # fresh candidates come first in cand, pick the explore set without repeats and keep it out of
+        # the top-k so no sample is labelled twice:
+        explore = torch.randperm(fresh.shape[0], device=x_labelled.device)[:n_explore]
+        acq[explore] = float('inf')
+        sel = torch.topk(acq, num_samples - n_explore, largest=False)[1]
+        return torch.cat([cand[sel], cand[explore]])
+
+    def step(self, model, norm_dict, x_labelled, y_labelled, num_samples):
+        """Selects and labels new samples with the analytic oracle.
+
+        Returns:
+            (tensor, tensor): new configs [num_samples, n_dofs] and labels [num_samples, 1]
+        """
+        q = self.select(model, norm_dict, x_labelled, y_labelled, num_samples)
+        with torch.no_grad():
+            y = self.labeler(q.to(**self.labeler.tensor_args)).unsqueeze(-1)
+        return q, y.to(device=x_labelled.device)
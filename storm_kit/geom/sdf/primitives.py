@@ -41,7 +41,7 @@ def sdf_capsule_to_pt(capsule_base, capsule_tip, capsule_radius, pt):
 
     h = torch.clamp(torch.dot(pt_base, tip_base) / torch.dot(tip_base,tip_base), 0.0, 1.0)
     
-    dist = torch.norm(pt_base - tip_base * h) - capsule_radius
+    dist = capsule_radius - torch.norm(pt_base - tip_base * h)
     return dist
 
 def sdf_capsule_to_sphere(capsule_base, capsule_tip, capsule_radius, sphere_pt, sphere_radius):
@@ -61,11 +61,49 @@ def sdf_capsule_to_sphere(capsule_base, capsule_tip, capsule_radius, sphere_pt,
     tip_base = capsule_tip - capsule_base
     
     pt_dot = (pt_base * tip_base).sum(-1)
-    cap_dot = (tip_base * tip_base).sum(-1)
+    cap_dot = torch.clamp((tip_base * tip_base).sum(-1), min=1e-8)
 
     h = torch.clamp(pt_dot / cap_dot, 0.0, 1.0)
     norm = torch.norm(pt_base - tip_base * h.unsqueeze(-1),dim=-1)
-    dist = (norm - capsule_radius) - sphere_radius
+    dist = capsule_radius + sphere_radius - norm
+    return dist
+
+@torch.jit.script
+def sdf_capsule_to_box(capsule_base, capsule_tip, capsule_radius, box_dims, box_trans, box_rot, n_iters=12):
+    # type: (Tensor, Tensor, Tensor, Tensor, Tensor, Tensor, int) -> Tensor
+    """Compute signed distance between capsule and box. The distance from a point on the capsule axis to the
+    box is convex along the axis, so the closest axis point is found by a fixed number of ternary search steps.
+    All inputs broadcast against each other.
+
+    Args:
+        capsule_base (tensor): x,y,z in world frame [...,3]
+        capsule_tip (tensor): x,y,z in world frame [...,3]
+        capsule_radius (tensor): radius of capsule [...]
+        box_dims (tensor): dx,dy,dz of box [...,3]
+        box_trans (tensor): world to box translation [...,3]
+        box_rot (tensor): world to box rotation [...,3,3]
+        n_iters (int): ternary search steps, the axis interval shrinks by (2/3)^n_iters.
+
+    Returns:
+        (tensor): signed distance (negative outside, positive inside) [...]
+    """
+    base = (box_rot @ capsule_base.unsqueeze(-1)).squeeze(-1) + box_trans
+    tip = (box_rot @ capsule_tip.unsqueeze(-1)).squeeze(-1) + box_trans
+    axis = tip - base
+    half_dims = box_dims / 2.0
+    lo = torch.zeros_like(base[...,0])
+    hi = torch.ones_like(base[...,0])
+    for _ in range(n_iters):
+        m_1 = lo + (hi - lo) / 3.0
+        m_2 = hi - (hi - lo) / 3.0
+        q_1 = torch.clamp(torch.abs(base + m_1.unsqueeze(-1) * axis) - half_dims, min=0.0)
+        q_2 = torch.clamp(torch.abs(base + m_2.unsqueeze(-1) * axis) - half_dims, min=0.0)
+        closer = torch.norm(q_1, dim=-1) < torch.norm(q_2, dim=-1)
+        hi = torch.where(closer, m_2, hi)
+        lo = torch.where(closer, lo, m_1)
+    h = (lo + hi) / 2.0
+    q = torch.clamp(torch.abs(base + h.unsqueeze(-1) * axis) - half_dims, min=0.0)
+    dist = capsule_radius - torch.norm(q, dim=-1)
     return dist
 
 
@@ -171,3 +209,30 @@ def get_sphere_primitive_distance(w_sphere, world_spheres, world_cubes):
     return dist
 
 
+@torch.jit.script
+def get_pt_broadphase_distance(pts, cand, inv_rot, inv_trans, half_dims, radius):
+    # type: (Tensor, Tensor, Tensor, Tensor, Tensor, Tensor) -> Tensor
+    """Signed distance between points and their candidate primitives. Every primitive is stored as
+    a rounded box (spheres have zero half_dims, cubes have zero radius).
+
+    Args:
+        pts (tensor): query points [n,3]
+        cand (tensor): candidate primitive indices [n,k], -1 for padding
+        inv_rot (tensor): world to primitive rotation [p,3,3]
+        inv_trans (tensor): world to primitive translation [p,3]
+        half_dims (tensor): half extents of boxes [p,3]
+        radius (tensor): rounding radius [p]
+
+    Returns:
+        (tensor): largest signed distance over candidates (negative outside, positive inside) [n]
+    """
+    dist = torch.full((pts.shape[0],), -1000.0, device=pts.device, dtype=pts.dtype)
+    for k in range(cand.shape[1]):
+        idx = torch.clamp(cand[:,k], min=0)
+        l_pts = (inv_rot[idx] @ pts.unsqueeze(-1)).squeeze(-1) + inv_trans[idx]
+        q = torch.abs(l_pts) - half_dims[idx]
+        q[q < 0.0] = 0.0
+        d = radius[idx] - torch.norm(q, dim=-1)
+        d[cand[:,k] < 0] = -1000.0
+        dist = torch.max(dist, d)
+    return dist
@@ -21,12 +21,10 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 # DEALINGS IN THE SOFTWARE.#
 
-import copy
 import yaml
 
 import numpy as np
 import torch
-import trimesh
 
 from ...differentiable_robot_model.coordinate_transform import CoordinateTransform, rpy_angles_to_matrix, multiply_transform, transform_point
 from ...differentiable_robot_model.urdf_utils import URDFRobotModel
@@ -50,11 +48,17 @@ class RobotCapsuleCollision:
         self.load_robot_collision_model(robot_collision_params)
     
     def load_robot_collision_model(self, robot_collision_params):
-        
+        """Loads capsules in link frame. link_objs is either a dict of capsules (base, tip, radius, pose_offset)
+        or a list of link names, in which case one capsule per link is fit to its collision spheres.
+        """
         robot_links = robot_collision_params['link_objs']
+        if(not isinstance(robot_links, dict)):
+            self._link_capsules = self._capsules_from_spheres(robot_collision_params)
+            self.build_batch_features(self.batch_size)
+            return
 
-        # we store as [Batch, n_link, 7]
-        self._link_capsules = torch.empty((self.batch_size, len(robot_links), 7), **self.tensor_args)
+        # we store as [n_link, 7]
+        self._link_capsules = torch.empty((len(robot_links), 7), **self.tensor_args)
         for j_idx, j in enumerate(robot_links):
             pose = robot_links[j]['pose_offset']
             # create a transform from pose offset:
@@ -75,9 +79,34 @@ class RobotCapsuleCollision:
             tip = torch.tensor(robot_links[j]['tip'], **self.tensor_args).unsqueeze(0)
             base = l_T_c.transform_point(base)
             tip = l_T_c.transform_point(tip)
-            self._link_capsules[:, j_idx,:] = tensor_capsule(base, tip, r, tensor_args=self.tensor_args).unsqueeze(0).repeat(self.batch_size, 1)
+            self._link_capsules[j_idx,:] = tensor_capsule(base, tip, r, tensor_args=self.tensor_args)
         #print(self.link_capsules)
-        self.link_capsules = self._link_capsules.clone()
+        self.build_batch_features(self.batch_size)
+
+    def _capsules_from_spheres(self, robot_collision_params):
+        # capsule axis joins the two furthest sphere centers, radius covers every sphere of the link
+        coll_yml = join_path(get_mpc_configs_path(), robot_collision_params['collision_spheres'])
+        with open(coll_yml) as file:
+            coll_params = yaml.load(file, Loader=yaml.FullLoader)['collision_spheres']
+        robot_links = robot_collision_params['link_objs']
+        link_capsules = torch.empty((len(robot_links), 7), **self.tensor_args)
+        for j_idx, j in enumerate(robot_links):
+            spheres = torch.tensor([s['center'] + [s['radius']] for s in coll_params[j]], **self.tensor_args)
+            c_dist = torch.norm(spheres[:,None,:3] - spheres[None,:,:3], dim=-1)
+            idx = int(torch.argmax(c_dist))
+            base = spheres[idx // spheres.shape[0],:3]
+            tip = spheres[idx % spheres.shape[0],:3]
+            # distance of every center to the capsule axis:
+            axis = tip - base
+            h = torch.clamp(((spheres[:,:3] - base) @ axis) / torch.clamp(axis @ axis, min=1e-8), 0.0, 1.0)
+            d = torch.norm(spheres[:,:3] - (base + h.unsqueeze(-1) * axis), dim=-1)
+            r = torch.max(d + spheres[:,3])
+            link_capsules[j_idx,:] = tensor_capsule(base, tip, r, tensor_args=self.tensor_args)
+        return link_capsules
+
+    def build_batch_features(self, batch_size):
+        self.batch_size = batch_size
+        self.link_capsules = self._link_capsules.unsqueeze(0).repeat(self.batch_size, 1, 1)
     
     def update_robot_link_poses(self, links_pos, links_rot):
         """
@@ -87,20 +116,15 @@ class RobotCapsuleCollision:
            link_rot: [batch, n_links , 3 , 3]
         """
         if(links_pos.shape[0] != self.batch_size):
-            self.batch_size = links_pos.shape[0]
-            self.load_robot_collision_model(self.robot_collision_params)
-        
-        # This contains coordinate tranforms as [batch_size * n_links ]
-        self.l_T_c.set_translation(links_pos)
-        self.l_T_c.set_rotation(links_rot)
+            self.build_batch_features(links_pos.shape[0])
         
-        # Update tranform of link points:
-        self.link_capsules[:,:,:3] = self.l_T_c.transform_point(self._link_capsules[:,:,:3])
-        self.link_capsules[:,:,3:6] = self.l_T_c.transform_point(self._link_capsules[:,:,3:6])
+        # Update tranform of capsule end points, local capsules are broadcast over the batch:
+        self.link_capsules[:,:,:3] = transform_point(self._link_capsules[:,:3].unsqueeze(-2), links_rot, links_pos.unsqueeze(-2)).squeeze(-2)
+        self.link_capsules[:,:,3:6] = transform_point(self._link_capsules[:,3:6].unsqueeze(-2), links_rot, links_pos.unsqueeze(-2)).squeeze(-2)
         
        
     def get_robot_link_objs(self):
-        # return capsule spheres in world frame
+        # return capsules in world frame [batch, n_links, 7]
         
         return self.link_capsules
     
@@ -142,7 +166,8 @@ class RobotMeshCollision:
         
         
     def load_robot_collision_model(self, robot_collision_params):
-        
+        import trimesh
+
         robot_links = robot_collision_params['link_objs']
         robot_urdf = robot_collision_params['urdf']
         n_pts = robot_collision_params['sample_points']
@@ -283,6 +308,9 @@ class RobotSphereCollision:
         #self.link_points = None
         self._link_spheres = None
         self._batch_link_spheres = None
+        self._n_link_spheres = None
+        self._link_sphere_mask = None
+        self.pad_radius = -100.0
 
         self._link_points = None
         self._link_collision_trans = None
@@ -309,7 +337,8 @@ class RobotSphereCollision:
         dof = robot_collision_params['dof']
         
         self.robot_nn = RobotSelfCollisionNet(n_joints=dof)
-        self.robot_nn.load_weights(robot_collision_params['self_collision_weights'], tensor_args)
+        self.robot_nn.load_weights(robot_collision_params['self_collision_weights'], tensor_args,
+                                   precision=robot_collision_params.get('self_collision_precision', 'fp32'))
     
     def load_robot_collision_model(self, robot_collision_params):
         """Load robot collision model, called from constructor
@@ -327,24 +356,33 @@ class RobotSphereCollision:
 
         coll_params = coll_params['collision_spheres']
 
-        self._link_spheres = []
+        # we store spheres as a padded tensor [n_links, max_spheres, 4]. Padded spheres sit at the link
+        # origin with a large negative radius so that they never produce the largest signed distance.
+        self._n_link_spheres = [len(coll_params[j]) for j in robot_links]
+        max_spheres = max(self._n_link_spheres)
+        self._link_spheres = torch.zeros((len(robot_links), max_spheres, 4), **self.tensor_args)
+        self._link_spheres[:,:,3] = self.pad_radius
+        self._link_sphere_mask = torch.zeros((len(robot_links), max_spheres), device=self.tensor_args['device'], dtype=torch.bool)
 
         
-        # we store as [n_link, 7]
         self._link_collision_trans = torch.empty((len(robot_links), 3), **self.tensor_args)
         self._link_collision_rot = torch.empty((len(robot_links), 3, 3), **self.tensor_args)
 
         for j_idx, j in enumerate(robot_links):
             
-            n_spheres = len(coll_params[j])
-            link_spheres = torch.zeros((n_spheres, 4), **self.tensor_args)
+            n_spheres = self._n_link_spheres[j_idx]
 
             for i in range(n_spheres):
                 
-                link_spheres[i,:] = tensor_sphere(coll_params[j][i]['center'], coll_params[j][i]['radius'], tensor_args=self.tensor_args, tensor=link_spheres[i,:])
-            self._link_spheres.append(link_spheres)
+                tensor_sphere(coll_params[j][i]['center'], coll_params[j][i]['radius'], tensor_args=self.tensor_args, tensor=self._link_spheres[j_idx,i,:])
+            self._link_sphere_mask[j_idx,:n_spheres] = True
             
-        self._w_link_spheres = self._link_spheres
+        self._w_link_spheres = self._link_spheres.clone()
+
+        # self collision is checked between non-adjacent links:
+        n_links = len(robot_links)
+        pairs = [[i, j] for i in range(n_links) for j in range(i + 2, n_links)]
+        self._self_coll_pairs = torch.tensor(pairs, device=self.tensor_args['device'], dtype=torch.int64).view(-1, 2)
     def build_batch_features(self, clone_objs=False, clone_pose=True, batch_size=None):
         """clones poses/object instances for computing across batch. Use this once per batch size change to avoid re-initialization over repeated calls.
 
@@ -355,11 +393,11 @@ class RobotSphereCollision:
         """        
         if(batch_size is not None):
             self.batch_size = batch_size
-        if(clone_objs):
-            self._batch_link_spheres = []
-            for i in range(len(self._link_spheres)):
-                self._batch_link_spheres.append(self._link_spheres[i].unsqueeze(0).repeat(self.batch_size, 1, 1).clone())
-        self.w_batch_link_spheres = copy.deepcopy(self._batch_link_spheres)
+        if(clone_objs or self._batch_link_spheres is None):
+            # local spheres are broadcast over the batch when transformed:
+            self._batch_link_spheres = self._link_spheres.unsqueeze(0)
+        if(self.w_batch_link_spheres is None or self.w_batch_link_spheres.shape[0] != self.batch_size):
+            self.w_batch_link_spheres = self._batch_link_spheres.repeat(self.batch_size, 1, 1, 1)
         
     def update_batch_robot_collision_pose(self, links_pos, links_rot):
         """
@@ -404,23 +442,32 @@ class RobotSphereCollision:
         '''
         
         # transform link points:
-        for i in range(len(self._link_spheres)):
-            self._w_link_spheres[i][:,:3] = transform_point(self._link_spheres[:,:3], links_rot[i,:,:], links_pos[i,:,:])
+        self._w_link_spheres[...,:3] = transform_point(self._link_spheres[...,:3], links_rot, links_pos.unsqueeze(-2))
         
 
     def update_batch_robot_collision_objs(self, links_pos, links_rot):
-        '''update pose of link spheres
+        '''update pose of link spheres, all links are transformed in one batched op
 
         Args:
         links_pos: bxnx3
         links_rot: bxnx3x3
         '''
         
-        b, n, _ = links_pos.shape
-        
-        for i in range(n):
-            link_pts = self._batch_link_spheres[i][:,:,:3]
-            self.w_batch_link_spheres[i][:,:,:3] = transform_point(self._batch_link_spheres[i][:,:,:3], links_rot[:,i,:,:], links_pos[:,i,:].unsqueeze(-2))
+        self.w_batch_link_spheres[...,:3] = transform_point(self._batch_link_spheres[...,:3], links_rot, links_pos.unsqueeze(-2))
+
+    def transform_link_spheres(self, links_pos, links_rot):
+        '''link spheres in world frame for any batch size, the batch buffers are not touched
+
+        Args:
+        links_pos: bxnx3
+        links_rot: bxnx3x3
+
+        Returns:
+        tensor: padded spheres [b, n_links, max_spheres, 4]
+        '''
+        centers = transform_point(self._link_spheres[...,:3].unsqueeze(0), links_rot, links_pos.unsqueeze(-2))
+        radius = self._link_spheres[...,3:].unsqueeze(0).expand(centers.shape[0], -1, -1, -1)
+        return torch.cat((centers, radius), dim=-1)
 
     def check_self_collisions_nn(self, q):
         """compute signed distance using NN, uses an instance of :class:`.nn_model.robot_self_collision.RobotSelfCollisionNet`
@@ -435,31 +482,71 @@ class RobotSphereCollision:
         return dist
 
 
-    def check_self_collisions(self, link_trans, link_rot):
-        """Analytic method to compute signed distance between links. This is used to train the NN method :func:`check_self_collisions_nn` amd is not used directly as it is slower.
+    def check_self_collisions_nn_error(self, q, link_trans, link_rot):
+        """Validates the network against the analytic sphere distance, which is used as an oracle.
+
+        Args:
+            q (tensor): joint configs [b, n_joints]
+            link_trans (tensor): link translations for q [b, n_links, 3]
+            link_rot (tensor): link rotations for q [b, n_links, 3, 3]
+
+        Returns:
+            tensor: network distance - analytic distance [b]
+        """
+        dist_nn = self.check_self_collisions_nn(q).view(-1)
+        dist = torch.max(self.check_self_collisions(link_trans, link_rot), dim=-1)[0]
+        return dist_nn - dist
+
+    def check_self_collisions(self, link_trans, link_rot, chunk_size=8192):
+        """Analytic method to compute signed distance between links. This is used to train the NN method :func:`check_self_collisions_nn`.
+        All sphere pairs of all non-adjacent link pairs are computed in one batched op, chunked over the batch.
 
         Args:
-            link_trans ([tensor]): link translation as batch [b,3]
-            link_rot ([type]): link rotation as batch [b,3,3]
+            link_trans ([tensor]): link translation as batch [b,n_links,3]
+            link_rot ([type]): link rotation as batch [b,n_links,3,3]
+            chunk_size (int, optional): batch chunk to bound memory. Defaults to 8192.
 
         Returns:
-            [tensor]: signed distance [b,1]
+            [tensor]: signed distance [b,n_links]
         """        
-        n_links = len(self.w_batch_link_spheres)
+        n_links = self.w_batch_link_spheres.shape[1]
         b, _, _ = link_trans.shape
+        if(self.w_batch_link_spheres.shape[0] != b):
+            self.build_batch_features(batch_size=b)
+        self.update_batch_robot_collision_objs(link_trans, link_rot)
         if self.dist is None or b != self.dist.shape[0]:
-            self.update_batch_robot_collision_objs(link_trans, link_rot)
             self.dist = torch.zeros((b,n_links,n_links), **self.tensor_args) - 100.0
-        dist = self.dist
-        dist = find_link_distance(self.w_batch_link_spheres, dist)
+        dist = find_link_pair_distance(self.w_batch_link_spheres, self._self_coll_pairs, self.dist, chunk_size)
         
         return dist
     def get_robot_link_objs(self):
         raise NotImplementedError
 
     def get_batch_robot_link_spheres(self):
+        """
+        Returns:
+            tensor: link spheres in world frame, padded [b, n_links, max_spheres, 4]
+        """
         return self.w_batch_link_spheres
 
+    def get_batch_robot_link_spheres_list(self):
+        """
+        Returns:
+            List[tensor]: views of the valid spheres of every link [b, n_spheres, 4]
+        """
+        return [self.w_batch_link_spheres[:,i,:n] for i, n in enumerate(self._n_link_spheres)]
+
+    def get_link_sphere_mask(self):
+        return self._link_sphere_mask
+
+    def get_link_sphere_reach(self):
+        """
+        Returns:
+            float: largest distance of a sphere surface from its link origin
+        """
+        reach = torch.norm(self._link_spheres[...,:3], dim=-1) + self._link_spheres[...,3]
+        return float(torch.max(reach[self._link_sphere_mask]))
+
     def get_robot_link_points(self):
         return self.w_link_points
 
@@ -583,3 +670,35 @@ def find_link_distance(links_sphere_list, dist):
             k += 1
     link_dist = torch.max(dist,dim=-1)[0]
     return link_dist
+
+@torch.jit.script
+def find_link_pair_distance(link_spheres, pair_idx, dist, chunk_size):
+    # type: (Tensor, Tensor, Tensor, int) -> Tensor
+    """signed distance between link pairs, computed over all sphere pairs at once.
+
+    Args:
+        link_spheres (tensor): padded link spheres [b, n_links, n_spheres, 4]
+        pair_idx (tensor): link pairs to check [n_pairs, 2]
+        dist (tensor): buffer for link to link distance [b, n_links, n_links], entries not in pair_idx are left untouched.
+        chunk_size (int): number of batch elements computed together.
+
+    Returns:
+        tensor: largest signed distance of every link to the other links [b, n_links]
+    """
+    b = link_spheres.shape[0]
+    n_links = link_spheres.shape[1]
+    flat_idx = pair_idx[:,0] * n_links + pair_idx[:,1]
+    flat_idx_t = pair_idx[:,1] * n_links + pair_idx[:,0]
+    for st in range(0, b, chunk_size):
+        spheres = link_spheres[st:st + chunk_size]
+        c = spheres.shape[0]
+        s_1 = spheres[:, pair_idx[:,0]].unsqueeze(-2)
+        s_2 = spheres[:, pair_idx[:,1]].unsqueeze(-3)
+        # c, n_pairs, n_spheres, n_spheres
+        s_dist = s_1[...,3] + s_2[...,3] - torch.norm(s_1[...,:3] - s_2[...,:3], dim=-1)
+        s_dist = torch.max(torch.max(s_dist, dim=-1)[0], dim=-1)[0]
+        d = dist[st:st + chunk_size].view(c, n_links * n_links)
+        d.index_copy_(1, flat_idx, s_dist)
+        d.index_copy_(1, flat_idx_t, s_dist)
+    link_dist = torch.max(dist, dim=-1)[0]
+    return link_dist
@@ -24,9 +24,9 @@ import copy
 import torch
 
 from ...differentiable_robot_model.coordinate_transform import CoordinateTransform, rpy_angles_to_matrix, multiply_transform, transform_point
-from ...geom.sdf.primitives import sdf_capsule_to_sphere
+from ...geom.sdf.primitives import sdf_capsule_to_sphere, sdf_capsule_to_box
 from .robot import RobotCapsuleCollision, RobotMeshCollision, RobotSphereCollision
-from .world import WorldPointCloudCollision, WorldPrimitiveCollision
+from .world import WorldPointCloudCollision, WorldPrimitiveCollision, WorldNNCollision
 
 
 class RobotWorldCollision:
@@ -41,38 +41,67 @@ class RobotWorldCollision:
     
         
 class RobotWorldCollisionCapsule(RobotWorldCollision):
-    """Collision checking between capsule robot and sphere world"""    
+    """Collision checking between capsule robot and primitive (sphere, cube) world"""    
     def __init__(self, robot_collision_params, world_collision_params, robot_batch_size=1,
-                 world_batch_size=1,tensor_args={'device':"cpu", 'dtype':torch.float32}):
+                 world_batch_size=1,tensor_args={'device':"cpu", 'dtype':torch.float32}, n_iters=12):
         robot_collision = RobotCapsuleCollision(robot_collision_params, tensor_args=tensor_args, batch_size=robot_batch_size)
         world_collision = WorldPrimitiveCollision(world_collision_params, tensor_args=tensor_args, batch_size=world_batch_size)
         super().__init__(robot_collision, world_collision)
-        self.dist = None
+        self.robot_batch_size = robot_batch_size
+        self.n_iters = n_iters
+
+    def build_batch_features(self, batch_size, clone_pose=True, clone_points=True):
+        self.robot_batch_size = batch_size
+        self.robot_coll.build_batch_features(batch_size)
     
     def get_signed_distance(self):
+        """Signed distance between every link capsule and every world primitive, computed in one broadcast op per primitive type.
 
-        link_capsules = self.robot_coll.get_robot_link_objs()
-        world_spheres = self.world_coll.get_objs()
-        if(self.dist is None or self.dist.shape[0] != link_capsules.shape[0]):
-            self.dist = torch.empty((link_capsules.shape[0],link_capsules.shape[1],world_spheres.shape[1]), **self.tensor_args)
-        dist = self.dist
-        for i in range(world_spheres.shape[1]):
+        Returns:
+            tensor: signed distance [b, n_links, n_spheres + n_cubes]
+        """
+        # [b, n_links, 1, 7]
+        link_capsules = self.robot_coll.get_robot_link_objs().unsqueeze(-2)
+        base = link_capsules[...,:3]
+        tip = link_capsules[...,3:6]
+        radius = link_capsules[...,6]
+
+        # [b or 1, 1, n_spheres, 4]
+        world_spheres = self.world_coll.get_sphere_objs().unsqueeze(1)
+        s_dist = sdf_capsule_to_sphere(base, tip, radius, world_spheres[...,:3], world_spheres[...,3])
+
+        inv_rot, inv_trans, dims = self.world_coll.get_cube_tensors()
+        c_dist = sdf_capsule_to_box(base, tip, radius, dims, inv_trans, inv_rot.unsqueeze(0).unsqueeze(0), self.n_iters)
         
-            sphere_pt = world_spheres[:,i,:3]
-            sphere_radius = world_spheres[:,i,3]
-            dist[:,:,i] = sdf_capsule_to_sphere(link_capsules[:,:,:3],
-                                                link_capsules[:,:,3:6], link_capsules[:,:,6],
-                                                sphere_pt, sphere_radius)
+        dist = torch.cat([s_dist, c_dist], dim=-1)
         return dist
 
+    def get_robot_env_sdf(self, link_trans, link_rot):
+        """Compute signed distance between robot capsules and world
+
+        Args:
+            link_trans (tensor): [b,n_links,3]
+            link_rot (tensor): [b,n_links,3,3]
+
+        Returns:
+            tensor : signed distance [b,n_links]
+        """
+        self.update_robot_link_poses(link_trans, link_rot)
+        dist = self.get_signed_distance()
+        if(dist.shape[-1] == 0):
+            return torch.zeros(dist.shape[:-1], **self.tensor_args) - 10.0
+        return torch.max(dist, dim=-1)[0]
+
 class RobotWorldCollisionPrimitive(RobotWorldCollision):
     def __init__(self, robot_collision_params, world_collision_params, robot_batch_size=1,
                  world_batch_size=1,tensor_args={'device':"cpu", 'dtype':torch.float32},
-                 bounds=None, grid_resolution=None):
+                 bounds=None, grid_resolution=None, brick_size=None, narrow_band=0.1, broadphase_params=None):
         robot_collision = RobotSphereCollision(robot_collision_params, robot_batch_size, tensor_args)
 
         
-        world_collision = WorldPrimitiveCollision(world_collision_params, tensor_args=tensor_args, batch_size=world_batch_size, bounds=bounds, grid_resolution=grid_resolution)
+        world_collision = WorldPrimitiveCollision(world_collision_params, tensor_args=tensor_args, batch_size=world_batch_size, bounds=bounds, grid_resolution=grid_resolution,
+                                                  brick_size=brick_size, narrow_band=narrow_band,
+                                                  broadphase_params=broadphase_params)
         self.robot_batch_size = robot_batch_size
 
         super().__init__(robot_collision, world_collision)
@@ -100,31 +129,65 @@ class RobotWorldCollisionPrimitive(RobotWorldCollision):
 
         self.robot_coll.update_batch_robot_collision_objs(link_trans, link_rot)
 
+        # [b, n_links, n_spheres, 4]
         w_link_spheres = self.robot_coll.get_batch_robot_link_spheres()
-        
-                
-        
-        n_links = len(w_link_spheres)
-
-        if(self.dist is None or self.dist.shape[0] != n_links):
-            self.dist = torch.zeros((batch_size, n_links), **self.tensor_args)
-        dist = self.dist
-
-        for i in range(n_links):
-            spheres = w_link_spheres[i]
-            b, n, _ = spheres.shape
-            spheres = spheres.view(b * n, 4)
-
-            # compute distance between world objs and link spheres
-            sdf = self.world_coll.check_pts_sdf(spheres[:,:3]) + spheres[:,3]
-            sdf = sdf.view(b,n)
-            dist[:,i] = torch.max(sdf, dim=-1)[0]
- 
+        b, n_links, n, _ = w_link_spheres.shape
+        spheres = w_link_spheres.view(b * n_links * n, 4)
+
+        # compute distance between world objs and all link spheres in one lookup
+        sdf = self.world_coll.check_pts_sdf(spheres[:,:3]) + spheres[:,3]
+        dist = torch.max(sdf.view(b, n_links, n), dim=-1)[0]
+
         return dist
 
+    def get_robot_sphere_sdf_and_gradient(self, link_trans, link_rot):
+        """signed distance of every link sphere and its gradient w.r.t. the sphere center, from the
+        world sdf. The batch buffers of the rollout are left untouched.
+
+        Args:
+            link_trans (tensor): [b,n_links,3]
+            link_rot (tensor): [b,n_links,3,3]
+
+        Returns:
+            tuple: sphere centers [b,n_links,n_spheres,3], signed distance [b,n_links,n_spheres],
+                gradient [b,n_links,n_spheres,3]
+        """
+        w_link_spheres = self.robot_coll.transform_link_spheres(link_trans, link_rot)
+        b, n_links, n, _ = w_link_spheres.shape
+        spheres = w_link_spheres.view(b * n_links * n, 4)
+        sdf, grad = self.world_coll.check_pts_sdf_and_gradient(spheres[:,:3])
+        sdf = sdf + spheres[:,3]
+        return w_link_spheres[...,:3], sdf.view(b, n_links, n), grad.view(b, n_links, n, 3)
+
 
 
         
+    def check_swept_sphere_collisions(self, horizon, n_substeps=1, analytic=False):
+        """Signed distance of the link spheres between consecutive rollout knots. Reuses the sphere poses of the
+        last :func:`check_robot_sphere_collisions` or :func:`get_robot_env_sdf` call, so no kinematics are recomputed.
+
+        Args:
+            horizon (int): rollout horizon, the last batch must be [batch * horizon]
+            n_substeps (int, optional): sub-segments of the conservative grid bound. Defaults to 1.
+            analytic (bool, optional): exact swept sphere (capsule) distance to the primitives instead of the grid bound.
+
+        Returns:
+            tensor: signed distance of every interval, for the knot at its end [batch, horizon - 1, n_links]
+        """
+        w_link_spheres = self.robot_coll.get_batch_robot_link_spheres()
+        b, n_links, n, _ = w_link_spheres.shape
+        spheres = w_link_spheres.view(b // horizon, horizon, n_links, n, 4)
+        start = spheres[:,:-1,...,:3]
+        end = spheres[:,1:,...,:3]
+        radius = spheres[:,1:,...,3]
+        if(analytic):
+            sdf = self.world_coll.get_swept_sphere_distance(start, end, radius)
+        else:
+            sdf = self.world_coll.check_swept_pts_sdf(start.reshape(-1, 3), end.reshape(-1, 3),
+                                                      n_substeps).view(radius.shape) + radius
+        dist = torch.max(sdf, dim=-1)[0]
+        return dist
+
     def get_robot_env_sdf(self, link_trans, link_rot):
         """Compute signed distance via analytic functino
 
@@ -143,32 +206,38 @@ class RobotWorldCollisionPrimitive(RobotWorldCollision):
 
         self.robot_coll.update_batch_robot_collision_objs(link_trans, link_rot)
 
+        # [b, n_links, n_spheres, 4]
         w_link_spheres = self.robot_coll.get_batch_robot_link_spheres()
-        
-                
-        
-        n_links = len(w_link_spheres)
+        b, n_links, n, _ = w_link_spheres.shape
 
-        if(self.dist is None or self.dist.shape[0] != n_links):
-            self.dist = torch.empty((batch_size, n_links), **self.tensor_args)
-        dist = self.dist
+        # compute distance between world objs and link spheres
+        if(self.world_coll.broadphase_params is not None):
+            d = self.world_coll.get_sphere_distance_broadphase(w_link_spheres)
+        else:
+            d = self.world_coll.get_sphere_distance(w_link_spheres.view(b, n_links * n, 4))
+            if(d.shape[1] == 0):
+                # no primitive in the active region
+                return torch.zeros((b, n_links), **self.tensor_args) - 10.0
+            d = torch.max(d, dim=1)[0].view(b, n_links, n)
+        dist = torch.max(d, dim=-1)[0]
 
-        
+        return dist
 
-        
-        for i in range(n_links):
-            spheres = w_link_spheres[i]
-            #b, n, _ = spheres.shape
-            #spheres = spheres.view(b * n, 4)
 
-            # compute distance between world objs and link spheres
-            d = self.world_coll.get_sphere_distance(spheres)
-            
-            dist[:,i] = torch.max(torch.max(d, dim=-1)[0], dim=-1)[0]
 
-        return dist
 
+class RobotWorldCollisionNN(RobotWorldCollisionPrimitive):
+    """Collision checking between robot spheres and a learned scene sdf, see :class:`.world.WorldNNCollision`"""
+    def __init__(self, robot_collision_params, world_collision_params, robot_batch_size=1,
+                 tensor_args={'device':"cpu", 'dtype':torch.float32}):
+        robot_collision = RobotSphereCollision(robot_collision_params, robot_batch_size, tensor_args)
+        world_collision = WorldNNCollision(world_collision_params, tensor_args=tensor_args)
+        self.robot_batch_size = robot_batch_size
+        RobotWorldCollision.__init__(self, robot_collision, world_collision)
+        self.dist = None
 
+    def get_robot_env_sdf(self, link_trans, link_rot):
+        return self.check_robot_sphere_collisions(link_trans, link_rot)
 
 
 class RobotWorldCollisionVoxel():
@@ -254,28 +323,15 @@ class RobotWorldCollisionVoxel():
         
         self.robot_sphere_model.update_batch_robot_collision_objs(table_link_trans, table_link_rot)
 
-        if(self.res is None or self.res.shape[0] != link_trans.shape[0]):
-            self.res = torch.zeros((link_trans.shape[0], link_trans.shape[1]), **self.tensor_args)
-            
-        res = self.res
-
         # get points:
-        # pts: batch, n_links, n_pts, 3
+        # spheres: batch, n_links, n_spheres, 4
         w_link_spheres = self.robot_sphere_model.get_batch_robot_link_spheres()
-
-        
-        
-        n_links = len(w_link_spheres)
-        
-        for i in range(n_links):
-            spheres = w_link_spheres[i]
-            b, n, _ = spheres.shape
-            spheres_arr = spheres.view(b * n, 4)
-            sdf = self.world.check_pts_sdf(spheres_arr[:,:3])
-            sdf = sdf + spheres_arr[:,3]
-            sdf = sdf.view(b,n)
-            # find largest sdf:
-            res[:,i] = torch.max(sdf, dim=-1)[0]
+        b, n_links, n, _ = w_link_spheres.shape
+        spheres_arr = w_link_spheres.view(b * n_links * n, 4)
+        sdf = self.world.check_pts_sdf(spheres_arr[:,:3])
+        sdf = sdf + spheres_arr[:,3]
+        # find largest sdf:
+        res = torch.max(sdf.view(b, n_links, n), dim=-1)[0]
             
         return res
 
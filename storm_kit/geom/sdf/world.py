@@ -21,20 +21,16 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 # DEALINGS IN THE SOFTWARE.#
 
-import cv2
 import numpy as np
-import trimesh
-from trimesh.voxel.creation import voxelize
 import torch
-import matplotlib
-matplotlib.use('WebAgg') #matplotlib.use('tkagg')
-
-import matplotlib.pyplot as plt
 
 
 from ...differentiable_robot_model.coordinate_transform import CoordinateTransform, rpy_angles_to_matrix, transform_point
 from ...geom.geom_types import tensor_capsule, tensor_sphere, tensor_cube
-from ...geom.sdf.primitives import get_pt_primitive_distance, get_sphere_primitive_distance
+from ...geom.nn_model.scene_sdf import SceneSDFNet
+from ...util_file import join_path
+from ...geom.sdf.primitives import get_pt_primitive_distance, get_sphere_primitive_distance, get_pt_broadphase_distance
+from ...geom.sdf.primitives import sdf_capsule_to_sphere, sdf_capsule_to_box
 
 class WorldCollision:
     def __init__(self, batch_size=1, tensor_args={'device':"cpu", 'dtype':torch.float32}):
@@ -49,7 +45,15 @@ class WorldCollision:
 class WorldGridCollision(WorldCollision):
     """This template class can be used to build a sdf grid using a signed distance function for fast lookup.
     """    
-    def __init__(self, batch_size=1, tensor_args={'device':"cpu", 'dtype':torch.float32},bounds=None, grid_resolution=0.05):
+    def __init__(self, batch_size=1, tensor_args={'device':"cpu", 'dtype':torch.float32},bounds=None, grid_resolution=0.05,
+                 brick_size=None, narrow_band=0.1):
+        """
+        Args:
+            brick_size (int, optional): when set, the sdf is stored as a two-level grid. Fine voxels are only
+                kept in bricks of brick_size^3 voxels close to a surface, other regions fall back to one
+                coarse value per brick. Defaults to None (dense grid).
+            narrow_band (float, optional): distance (m) around surfaces where fine bricks are allocated.
+        """
         super().__init__(batch_size, tensor_args)
         self.bounds = torch.as_tensor(bounds, **tensor_args)
         self.grid_resolution = grid_resolution
@@ -57,7 +61,16 @@ class WorldGridCollision(WorldCollision):
         self.scene_sdf = None
         self.scene_sdf_matrix = None
 
+        self.brick_size = brick_size
+        self.narrow_band = narrow_band
+        self.coarse_sdf = None
+        self.brick_table = None
+        self.brick_sdf = None
+
     def update_world_sdf(self):
+        if(self.brick_size is not None):
+            self._compute_sparse_sdfgrid()
+            return
         sdf_grid = self._compute_sdfgrid()
         self.scene_sdf_matrix = sdf_grid
         self.scene_sdf = sdf_grid.flatten()
@@ -78,6 +91,7 @@ class WorldGridCollision(WorldCollision):
         dist = None
         return dist
     def view_sdf_grid(self, sdf_grid):
+        import matplotlib.pyplot as plt
         ax = plt.axes(projection='3d')
         ind_matrix = [[x,y,z] for x in range(sdf_grid.shape[0]) for y in range(sdf_grid.shape[1]) for z in range(sdf_grid.shape[2])]
         ind_matrix = np.matrix(ind_matrix)
@@ -108,6 +122,16 @@ class WorldGridCollision(WorldCollision):
         #trans = torch
         self.proj_idx_pt = CoordinateTransform(trans=1.0 * trans, rot=rot, tensor_args=self.tensor_args)
 
+    def _grid_indices(self, dims):
+        # all [x,y,z] indices of a grid of size dims, ordered as a flattened tensor
+        return torch.cartesian_prod(*[torch.arange(int(d), **self.tensor_args) for d in dims])
+
+    def _batch_signed_distance(self, pts, chunk_size=100000):
+        # evaluate get_signed_distance in chunks to bound memory on large grids
+        dist = [torch.flatten(self.get_signed_distance(pts[i:i + chunk_size]))
+                for i in range(0, pts.shape[0], chunk_size)]
+        return torch.cat(dist)
+
     def _compute_sdfgrid(self):
         # voxel grid has different bounds
 
@@ -115,32 +139,63 @@ class WorldGridCollision(WorldCollision):
         sdf_grid_dims = torch.Size(((self.bounds[1] - self.bounds[0]) / self.grid_resolution).int())
         self.build_transform_matrices(self.bounds, self.grid_resolution)
 
-        sdf_grid = torch.zeros(sdf_grid_dims, **self.tensor_args)
-        self.num_voxels = torch.tensor([sdf_grid.shape[0], sdf_grid.shape[1],
-                                        sdf_grid.shape[2]],
+        self.num_voxels = torch.tensor([sdf_grid_dims[0], sdf_grid_dims[1],
+                                        sdf_grid_dims[2]],
                                        **self.tensor_args)
 
         # get indices
-
-        ind_matrix = [[x,y,z] for x in range(sdf_grid.shape[0]) for y in range(sdf_grid.shape[1]) for z in range(sdf_grid.shape[2])]
-        
-        ind_matrix = torch.tensor(ind_matrix, **self.tensor_args)
+        ind_matrix = self._grid_indices(sdf_grid_dims)
         self.ind_matrix = ind_matrix
         pt_matrix = self.proj_idx_pt.transform_point(ind_matrix)
 
-        dist_matrix = torch.flatten(self.get_signed_distance(pt_matrix))
+        dist_matrix = self._batch_signed_distance(pt_matrix)
         self.dist_matrix = dist_matrix
-        
-        # get corresponding points
-        # Get closest distance from indice points to points in pointcloud:
-        for i in range(sdf_grid.shape[0]):
-            for j in range(sdf_grid.shape[1]):
-                for k in range(sdf_grid.shape[2]):
-                    sdf_grid[i,j,k] = dist_matrix[i * (sdf_grid.shape[1] * sdf_grid.shape[2])+ j * (sdf_grid.shape[2]) + k]
-                    
-                    
+
+        # indices are in x-major order, so the distances reshape directly to the grid:
+        sdf_grid = dist_matrix.view(sdf_grid_dims)
         return sdf_grid
-    
+
+    def _compute_sparse_sdfgrid(self):
+        """Builds a two-level sdf. The coarse level stores the distance at the center of every brick.
+        Fine voxels are only computed for bricks whose center is within half a brick diagonal
+        (plus narrow_band) of a surface, as the surface can't cross any other brick.
+        """
+        bs = self.brick_size
+        res = self.grid_resolution
+        fine_dims = ((self.bounds[1] - self.bounds[0]) / res).int()
+        self.build_transform_matrices(self.bounds, res)
+        self.num_voxels = fine_dims.to(**self.tensor_args)
+
+        brick_dims = torch.div(fine_dims + bs - 1, bs, rounding_mode='floor')
+        self.num_bricks = brick_dims.to(device=self.tensor_args['device'], dtype=torch.int64)
+
+        # coarse level:
+        brick_inds = self._grid_indices(brick_dims)
+        brick_pitch = res * bs
+        brick_centers = self.bounds[0] + (brick_inds + 0.5) * brick_pitch
+        coarse_sdf = self._batch_signed_distance(brick_centers)
+
+        half_diag = 0.5 * brick_pitch * (3.0 ** 0.5)
+        active = torch.abs(coarse_sdf) <= half_diag + self.narrow_band
+        n_active = int(torch.sum(active))
+
+        brick_table = torch.full((brick_inds.shape[0],), -1, device=self.tensor_args['device'], dtype=torch.int64)
+        brick_table[active] = torch.arange(n_active, device=self.tensor_args['device'], dtype=torch.int64)
+
+        # fine level, voxel values follow the same convention as the dense grid:
+        local_inds = self._grid_indices([bs, bs, bs])
+        fine_inds = brick_inds[active].unsqueeze(1) * bs + local_inds.unsqueeze(0)
+        if(n_active > 0):
+            brick_sdf = self._batch_signed_distance(self.proj_idx_pt.transform_point(fine_inds.view(-1, 3)))
+        else:
+            brick_sdf = torch.zeros(bs ** 3, **self.tensor_args)
+
+        self.coarse_sdf = coarse_sdf
+        self.brick_table = brick_table
+        self.brick_sdf = brick_sdf
+        self.scene_sdf = None
+        self.scene_sdf_matrix = None
+
     def check_pts_sdf(self, pts):
         '''
         finds the signed distance for the points from the stored grid
@@ -151,6 +206,11 @@ class WorldGridCollision(WorldCollision):
         in_bounds = (pts > self.bounds[0] + self.pitch).all(dim=-1)
         in_bounds &= (pts < self.bounds[1] - self.pitch).all(dim=-1)
 
+        if(self.brick_table is not None):
+            sdf = self._check_pts_sparse_sdf(pts, in_bounds)
+            sdf[~in_bounds] = -10.0
+            return sdf
+
         #pts[~in_bounds] = self.bounds[0]
         pt_idx = self.voxel_inds(pts)
         
@@ -165,6 +225,60 @@ class WorldGridCollision(WorldCollision):
         sdf[~in_bounds] = -10.0
         return sdf
 
+    def check_pts_sdf_and_gradient(self, pts):
+        '''
+        signed distance from the stored grid and its central difference gradient, one voxel apart.
+        The gradient is zero where a probe leaves the grid.
+        Args:
+        pts: [n,3]
+        Returns:
+        signed distance [n], gradient w.r.t. pts [n,3]
+        '''
+        sdf = self.check_pts_sdf(pts)
+        offsets = self.pitch * torch.eye(3, **self.tensor_args)
+        # probes [2, 3, n, 3]: +x,+y,+z then -x,-y,-z
+        probes = torch.stack((pts.unsqueeze(0) + offsets.unsqueeze(1), pts.unsqueeze(0) - offsets.unsqueeze(1)))
+        d = self.check_pts_sdf(probes.view(-1, 3)).view(2, 3, -1)
+        grad = ((d[0] - d[1]) / (2.0 * self.pitch)).T.contiguous()
+        grad[(d <= -10.0).any(dim=0).any(dim=0)] = 0.0
+        return sdf, grad
+
+    def check_swept_pts_sdf(self, pts_start, pts_end, n_substeps=1):
+        """Conservative signed distance over the segments between two sets of points. The sdf is 1-lipschitz,
+        so the largest value along a sub-segment is at most the value at its midpoint plus half its length.
+
+        Args:
+            pts_start (tensor): [n,3]
+            pts_end (tensor): [n,3]
+            n_substeps (int, optional): sub-segments per segment, tightens the bound. Defaults to 1.
+
+        Returns:
+            tensor: upper bound of the signed distance along every segment [n]
+        """
+        seg = pts_end - pts_start
+        half_len = torch.norm(seg, dim=-1) / (2.0 * n_substeps)
+        sdf = None
+        for k in range(n_substeps):
+            mid = pts_start + ((k + 0.5) / n_substeps) * seg
+            d = self.check_pts_sdf(mid) + half_len
+            sdf = d if sdf is None else torch.max(sdf, d)
+        return sdf
+
+    def _check_pts_sparse_sdf(self, pts, in_bounds):
+        bs = self.brick_size
+        pt = self.proj_pt_idx.transform_point(pts).to(dtype=torch.int64)
+        pt[~in_bounds] = 0
+
+        b_pt = torch.div(pt, bs, rounding_mode='floor')
+        l_pt = pt - b_pt * bs
+        b_idx = (b_pt[...,0] * self.num_bricks[1] + b_pt[...,1]) * self.num_bricks[2] + b_pt[...,2]
+        l_idx = (l_pt[...,0] * bs + l_pt[...,1]) * bs + l_pt[...,2]
+
+        brick = self.brick_table[b_idx]
+        fine_idx = torch.clamp(brick, min=0) * (bs ** 3) + l_idx
+        sdf = torch.where(brick >= 0, self.brick_sdf[fine_idx], self.coarse_sdf[b_idx])
+        return sdf
+
     def voxel_inds(self, pt, scale=1):
 
         pt = self.proj_pt_idx.transform_point(pt)
@@ -183,10 +297,20 @@ class WorldGridCollision(WorldCollision):
 class WorldPrimitiveCollision(WorldGridCollision):
     """ This class holds a batched collision model
     """
-    def __init__(self, world_collision_params, batch_size=1, tensor_args={'device':"cpu", 'dtype':torch.float32}, bounds=None, grid_resolution=0.05):
-        super().__init__(batch_size, tensor_args, bounds, grid_resolution)
+    def __init__(self, world_collision_params, batch_size=1, tensor_args={'device':"cpu", 'dtype':torch.float32}, bounds=None, grid_resolution=0.05,
+                 brick_size=None, narrow_band=0.1, broadphase_params=None):
+        """
+        Args:
+            broadphase_params (dict, optional): {'cell_size', 'margin'} builds a uniform grid of candidate
+                primitives so that only primitives within margin of a query are evaluated. Distances
+                are exact above -margin and saturate at -margin. Defaults to None (all primitives).
+        """
+        super().__init__(batch_size, tensor_args, bounds, grid_resolution, brick_size, narrow_band)
         self._world_spheres = None
         self._world_cubes = None
+        self._active_mask = None
+        self._cube_tensors = None
+        self._cube_tensors_src = None
         
         self.n_objs = 0
 
@@ -194,6 +318,12 @@ class WorldPrimitiveCollision(WorldGridCollision):
         self.load_collision_model(world_collision_params)
         self.dist = torch.zeros((1,1,1), **self.tensor_args)
 
+        self.broadphase_params = broadphase_params
+        self._bp_table = None
+        self._bp_active_table = None
+        if(broadphase_params is not None):
+            self.build_broadphase()
+
         if(bounds is not None):
             self.update_world_sdf()
 
@@ -229,7 +359,137 @@ class WorldPrimitiveCollision(WorldGridCollision):
             
             
         self.n_objs = self._world_spheres.shape[1] + len(self._world_cubes)
-        
+        self._prim_aabb = None
+
+    def _stack_primitives(self):
+        # spheres and cubes as rounded boxes: [n_spheres + n_cubes, ...]
+        spheres = self._world_spheres[0]
+        n_p = spheres.shape[0] + len(self._world_cubes)
+        inv_rot = torch.eye(3, **self.tensor_args).repeat(n_p, 1, 1)
+        inv_trans = torch.zeros((n_p, 3), **self.tensor_args)
+        half_dims = torch.zeros((n_p, 3), **self.tensor_args)
+        radius = torch.zeros(n_p, **self.tensor_args)
+        aabb = torch.zeros((n_p, 2, 3), **self.tensor_args)
+
+        n_s = spheres.shape[0]
+        inv_trans[:n_s] = -1.0 * spheres[:,:3]
+        radius[:n_s] = spheres[:,3]
+        aabb[:n_s,0] = spheres[:,:3] - spheres[:,3:4]
+        aabb[:n_s,1] = spheres[:,:3] + spheres[:,3:4]
+        for i, cube in enumerate(self._world_cubes):
+            inv_rot[n_s + i] = cube[3].view(3,3)
+            inv_trans[n_s + i] = cube[2].view(3)
+            half_dims[n_s + i] = cube[-1] / 2.0
+            extent = torch.abs(cube[1].view(3,3)) @ half_dims[n_s + i]
+            aabb[n_s + i,0] = cube[0].view(3) - extent
+            aabb[n_s + i,1] = cube[0].view(3) + extent
+        return inv_rot, inv_trans, half_dims, radius, aabb
+
+    def build_broadphase(self):
+        """Builds a uniform grid over the primitives. Every cell stores the (padded) list of
+        primitives whose bounding box, inflated by margin, overlaps the cell.
+        """
+        cell_size = self.broadphase_params['cell_size']
+        margin = self.broadphase_params['margin']
+        inv_rot, inv_trans, half_dims, radius, prim_aabb = self._stack_primitives()
+        self._bp_prims = [inv_rot, inv_trans, half_dims, radius]
+        self._prim_aabb = prim_aabb
+        aabb = prim_aabb.clone()
+        aabb[:,0] -= margin
+        aabb[:,1] += margin
+
+        origin = torch.min(aabb[:,0], dim=0)[0]
+        dims = torch.ceil((torch.max(aabb[:,1], dim=0)[0] - origin) / cell_size).to(dtype=torch.int64)
+        dims = torch.clamp(dims, min=1)
+        cells = torch.cartesian_prod(*[torch.arange(int(d), **self.tensor_args) for d in dims])
+        cell_min = origin + cells * cell_size
+        cell_max = cell_min + cell_size
+
+        # [n_cells, n_prims]
+        overlap = torch.logical_and((cell_min.unsqueeze(1) <= aabb[:,1].unsqueeze(0)).all(dim=-1),
+                                    (cell_max.unsqueeze(1) >= aabb[:,0].unsqueeze(0)).all(dim=-1))
+        n_p = aabb.shape[0]
+        k = max(int(torch.max(torch.sum(overlap, dim=-1))), 1)
+        # sort overlapping primitives first, keeping their index in the key:
+        key = overlap.to(dtype=torch.int64) * (n_p - torch.arange(n_p, device=self.tensor_args['device'], dtype=torch.int64))
+        val = torch.topk(key, k, dim=-1)[0]
+        table = n_p - val
+        table[val == 0] = -1
+        # extra empty row for queries outside the grid:
+        table = torch.cat([table, -1 * torch.ones((1, k), device=self.tensor_args['device'], dtype=torch.int64)])
+
+        self._bp_origin = origin
+        self._bp_dims = dims.to(device=self.tensor_args['device'])
+        self._bp_cell_size = cell_size
+        self._bp_margin = margin
+        self._bp_table = table
+        self._bp_active_table = table
+
+    def set_active_region(self, pts, margin=0.1):
+        """Swept volume prefilter. Primitives that don't overlap the bounding box of pts (inflated by margin)
+        read a distance of -10 until the next call. The box is a single bound over the whole batch, e.g. all
+        the rollouts, so at large particle counts it can cover most of the workspace. The selection is a mask
+        kept on the device, so dim 1 of get_sphere_distance/get_pt_distance still indexes every primitive.
+        With the broadphase, inactive primitives are also dropped from the candidates.
+
+        Args:
+            pts (tensor): points covering the volume swept by the robot, e.g. link positions of the rollouts [n,3]
+            margin (float): inflation of the region, should cover link sphere reach and cost threshold.
+        """
+        pts = pts.view(-1, 3)
+        r_min = torch.min(pts, dim=0)[0] - margin
+        r_max = torch.max(pts, dim=0)[0] + margin
+        if(self._prim_aabb is None):
+            self._prim_aabb = self._stack_primitives()[-1]
+        aabb = self._prim_aabb
+        active = torch.logical_and((aabb[:,0] <= r_max).all(dim=-1), (aabb[:,1] >= r_min).all(dim=-1))
+        self._active_mask = active
+
+        if(self._bp_table is not None):
+            table = self._bp_table
+            self._bp_active_table = torch.where(active[torch.clamp(table, min=0)], table, -1 * torch.ones_like(table))
+
+    def clear_active_region(self):
+        self._active_mask = None
+        self._bp_active_table = self._bp_table
+
+    def _mask_inactive(self, dist, dim):
+        # inactive primitives never give the largest distance:
+        if(self._active_mask is None):
+            return dist
+        shape = [1] * len(dist.shape)
+        shape[dim] = -1
+        return torch.where(self._active_mask.view(shape), dist, torch.full_like(dist, -10.0))
+
+    def _broadphase_candidates(self, pts):
+        cell = torch.floor((pts - self._bp_origin) / self._bp_cell_size).to(dtype=torch.int64)
+        in_grid = torch.logical_and((cell >= 0).all(dim=-1), (cell < self._bp_dims).all(dim=-1))
+        idx = (cell[...,0] * self._bp_dims[1] + cell[...,1]) * self._bp_dims[2] + cell[...,2]
+        idx = torch.where(in_grid, idx, (self._bp_table.shape[0] - 1) * torch.ones_like(idx))
+        return self._bp_active_table[idx]
+
+    def get_pt_distance_broadphase(self, w_pts):
+        """
+        Args:
+        w_pts: [..., 3]
+        Returns:
+        largest signed distance over primitives, saturated at -margin [...]
+        """
+        shape = w_pts.shape[:-1]
+        pts = w_pts.reshape(-1, 3)
+        cand = self._broadphase_candidates(pts)
+        dist = get_pt_broadphase_distance(pts, cand, *self._bp_prims)
+        dist[dist < -self._bp_margin] = -self._bp_margin
+        return dist.view(shape)
+
+    def get_sphere_distance_broadphase(self, w_sphere):
+        """
+        Args:
+        w_sphere: b, n, 4
+        Returns:
+        largest signed distance over primitives, [b, n]
+        """
+        return self.get_pt_distance_broadphase(w_sphere[...,:3]) + w_sphere[...,3]
     
     def update_obj_poses(self, objs_pos, objs_rot):
         """
@@ -248,7 +508,9 @@ class WorldPrimitiveCollision(WorldGridCollision):
         self._world_spheres[:,:,:3] = self.l_T_c.transform_point(self._world_spheres[:,:,:3])
 
         # TODO for cube:
-        
+        self._prim_aabb = None
+        if(self.broadphase_params is not None):
+            self.build_broadphase()
 
     def update_reference_frame(self, r_pos, r_rot):
         """
@@ -265,7 +527,10 @@ class WorldPrimitiveCollision(WorldGridCollision):
 
         for i in range(self._world_spheres.shape[1]):
             self._world_spheres[:,i,:3] = self.l_T_c.transform_point(self._world_spheres[:,i,:3])
-            
+        self._prim_aabb = None
+        if(self.broadphase_params is not None):
+            self.build_broadphase()
+
     def get_sphere_objs(self):
         # return capsule spheres in world frame
         return self._world_spheres
@@ -274,15 +539,52 @@ class WorldPrimitiveCollision(WorldGridCollision):
         # return capsule spheres in world frame
         return self._world_cubes
 
+    def get_cube_tensors(self):
+        """Stacked cubes for broadcast distance queries.
+
+        Returns:
+            world to cube rotation [n,3,3], world to cube translation [n,3], dims [n,3]
+        """
+        if(self._cube_tensors is None or self._cube_tensors_src is not self._world_cubes):
+            cubes = self._world_cubes
+            self._cube_tensors = [torch.stack([c[3].view(3,3) for c in cubes]) if len(cubes) > 0 else torch.zeros((0,3,3), **self.tensor_args),
+                                  torch.stack([c[2].view(3) for c in cubes]) if len(cubes) > 0 else torch.zeros((0,3), **self.tensor_args),
+                                  torch.stack([c[-1].view(3) for c in cubes]) if len(cubes) > 0 else torch.zeros((0,3), **self.tensor_args)]
+            self._cube_tensors_src = cubes
+        return self._cube_tensors
+
     def get_sphere_distance(self, w_sphere):
         """
         Computes the signed distance via analytic function
         Args:
         tensor_sphere: b, n, 4
         """
-        dist = torch.zeros((w_sphere.shape[0], self.n_objs, w_sphere.shape[1]), **self.tensor_args)
         dist = get_sphere_primitive_distance(w_sphere, self._world_spheres, self._world_cubes)
-        return dist
+        return self._mask_inactive(dist, 1)
+
+    def get_swept_sphere_distance(self, start, end, radius):
+        """Signed distance between spheres moving along straight segments and all active primitives.
+        The swept volume of a sphere is a capsule, so this is exact for linear motion.
+
+        Args:
+            start (tensor): sphere centers at the start of the segment [...,3]
+            end (tensor): sphere centers at the end of the segment [...,3]
+            radius (tensor): sphere radii [...]
+
+        Returns:
+            tensor: largest signed distance over primitives [...]
+        """
+        start = start.unsqueeze(-2)
+        end = end.unsqueeze(-2)
+        radius = radius.unsqueeze(-1)
+        world_spheres = self._world_spheres[0]
+        s_dist = sdf_capsule_to_sphere(start, end, radius, world_spheres[:,:3], world_spheres[:,3])
+        inv_rot, inv_trans, dims = self.get_cube_tensors()
+        c_dist = sdf_capsule_to_box(start, end, radius, dims, inv_trans, inv_rot)
+        dist = self._mask_inactive(torch.cat([s_dist, c_dist], dim=-1), -1)
+        if(dist.shape[-1] == 0):
+            return torch.zeros(dist.shape[:-1], **self.tensor_args) - 10.0
+        return torch.max(dist, dim=-1)[0]
 
     def get_pt_distance(self, w_pts):
         """
@@ -291,13 +593,18 @@ class WorldPrimitiveCollision(WorldGridCollision):
         """
         if(len(w_pts.shape) == 2):
             w_pts = w_pts.view(w_pts.shape[0], 1, 3)
-        if(self.dist.shape[0] != w_pts.shape[0] or self.dist.shape[1] != self.n_objs or self.dist_shape[2] != w_pts.shape[1]):
-            self.dist = torch.zeros((w_pts.shape[0], self.n_objs, w_pts.shape[1]), **self.tensor_args)
+        n_objs = self._world_spheres.shape[1] + len(self._world_cubes)
+        if(self.dist.shape[0] != w_pts.shape[0] or self.dist.shape[1] != n_objs or self.dist.shape[2] != w_pts.shape[1]):
+            self.dist = torch.zeros((w_pts.shape[0], n_objs, w_pts.shape[1]), **self.tensor_args)
         dist = self.dist
         dist = get_pt_primitive_distance(w_pts, self._world_spheres, self._world_cubes, dist)
-        return dist
+        return self._mask_inactive(dist, 1)
 
     def get_signed_distance(self, w_pts):
+        if(self._bp_table is not None):
+            if(len(w_pts.shape) == 2):
+                w_pts = w_pts.view(w_pts.shape[0], 1, 3)
+            return self.get_pt_distance_broadphase(w_pts)
         dist = torch.max(self.get_pt_distance(w_pts), dim=1)[0]
         return dist
     
@@ -343,7 +650,8 @@ class WorldPointCloudCollision(WorldGridCollision):
         
         
     def update_world_voxel(self, scene_pc):
-        
+        import trimesh
+        from trimesh.voxel.creation import voxelize
         # Fill pointcloud in tensor:
 
         # marching cubes:
@@ -398,6 +706,7 @@ class WorldPointCloudCollision(WorldGridCollision):
         self._flat_tensor = flat_tensor
         
     def get_signed_distance(self, pts):
+        import trimesh
         dist = trimesh.proximity.signed_distance(self.trimesh_scene_mesh, pts.cpu().numpy())
         return dist
     
@@ -411,6 +720,55 @@ class WorldPointCloudCollision(WorldGridCollision):
         mesh = self.trimesh_scene_voxel.as_boxes() # marching_cubes
         return mesh
         
+class WorldNNCollision(WorldCollision):
+    """Signed distance of a static scene from a coordinate network, a compact alternative to dense
+    grids for large scenes. The network is trained with scripts/train_scene_sdf.py.
+    """
+    def __init__(self, world_collision_params, batch_size=1, tensor_args={'device':"cpu", 'dtype':torch.float32}):
+        """
+        Args:
+            world_collision_params (Dict): model_path (folder or .pt file relative to the weights folder) and
+                scene_name, the weights are loaded from model_path/scene_name_sdf.pt
+        """
+        super().__init__(batch_size, tensor_args)
+        model_file = world_collision_params['model_path']
+        if(not model_file.endswith('.pt')):
+            model_file = join_path(model_file, world_collision_params['scene_name'] + '_sdf.pt')
+        self.sdf_net = SceneSDFNet()
+        self.sdf_net.load_weights(model_file, tensor_args)
+        self.bounds = self.sdf_net.bounds
+        self.n_objs = 1
+
+    def check_pts_sdf(self, pts):
+        '''
+        finds the signed distance for the points from the network, points outside the training bounds are free
+        Args:
+        pts: [n,3]
+        '''
+        in_bounds = (pts > self.bounds[0]).all(dim=-1)
+        in_bounds &= (pts < self.bounds[1]).all(dim=-1)
+        sdf = self.sdf_net.compute_signed_distance(pts)
+        sdf[~in_bounds] = -10.0
+        return sdf
+
+    def check_pts_sdf_and_gradient(self, pts):
+        '''
+        Args:
+        pts: [n,3]
+        Returns:
+        signed distance [n], gradient w.r.t. pts [n,3]
+        '''
+        in_bounds = (pts > self.bounds[0]).all(dim=-1)
+        in_bounds &= (pts < self.bounds[1]).all(dim=-1)
+        sdf, grad = self.sdf_net.compute_signed_distance_and_gradient(pts)
+        sdf[~in_bounds] = -10.0
+        grad[~in_bounds] = 0.0
+        return sdf, grad
+
+    def get_signed_distance(self, pts):
+        return self.check_pts_sdf(pts)
+
+
 class WorldImageCollision(WorldCollision):
     def __init__(self, bounds, tensor_args={'device':"cpu", 'dtype':torch.float32}):
         super().__init__(1, tensor_args)
@@ -424,6 +782,7 @@ class WorldImageCollision(WorldCollision):
         self.ind_pt = None
     
     def update_world(self, image_path):
+        import cv2
         im = cv2.imread(image_path,0)
         _,im = cv2.threshold(im,10,255,cv2.THRESH_BINARY)
 
@@ -28,6 +28,8 @@ import numpy as np
 import torch
 import torch.autograd.profiler as profiler
 
+from ..cost.cost_graph import merge_cost_reports
+
 
 class Controller(ABC):
     """Base class for sampling based controllers."""
@@ -222,7 +224,9 @@ class Controller(ABC):
         value: float
             optimal value estimate (default: 0.)
         info: dict
-            dictionary with side-information
+            dictionary with side-information. With cost term profiling enabled in the rollout
+            function, info['cost_terms'] holds the per term time, memory and cost breakdown
+            merged over iterations, see :func:`merge_cost_reports`.
         """
 
         n_iters = n_iters if n_iters is not None else self.n_iters
@@ -232,6 +236,7 @@ class Controller(ABC):
         state.to(**self.tensor_args)
 
         info = dict(rollout_time=0.0, entropy=[])
+        cost_reports = []
         # shift distribution to hotstart from previous timestep
         if self.hotstart:
             self._shift(shift_steps)
@@ -249,6 +254,8 @@ class Controller(ABC):
                     with profiler.record_function("mppi_update"):
                         self._update_distribution(trajectory)
                     info['rollout_time'] += trajectory['rollout_time']
+                    if('cost_terms' in trajectory):
+                        cost_reports.append(trajectory['cost_terms'])
 
                     # check if converged
                     if self.check_convergence():
@@ -270,6 +277,8 @@ class Controller(ABC):
         #     self.reset_distribution()
 
         info['entropy'].append(self.entropy)
+        if(len(cost_reports) > 0):
+            info['cost_terms'] = merge_cost_reports(cost_reports)
 
         self.num_steps += 1
 
@@ -25,12 +25,12 @@
 import copy
 
 import numpy as np
-import scipy.special
 import torch
 from torch.distributions.multivariate_normal import MultivariateNormal
 from torch.nn.functional import normalize as f_norm
 
 from .control_utils import cost_to_go, matrix_cholesky, batch_cholesky
+from ..cost.cost_graph import merge_cost_reports
 from .olgaussian_mpc import OLGaussianMPC
 
 class MPPI(OLGaussianMPC):
@@ -73,7 +73,15 @@ class MPPI(OLGaussianMPC):
                  seed=0,
                  sample_params={'type': 'halton', 'fixed_samples': True, 'seed':0, 'filter_coeffs':None},
                  tensor_args={'device':torch.device('cpu'), 'dtype':torch.float32},
-                 visual_traj='state_seq'):
+                 visual_traj='state_seq',
+                 chunk_size=None,
+                 guide_params=None):
+        """
+        chunk_size: when smaller than num_particles, particles are rolled out in chunks of this size
+            and the update is accumulated online (see :meth:`_chunked_rollouts`). The rollout
+            function's buffers then only need to hold chunk_size particles.
+        guide_params: gradient guided sampling, see :class:`OLGaussianMPC`. Defaults to None (off).
+        """
         
         super(MPPI, self).__init__(d_action,
                                    action_lows, 
@@ -95,12 +103,143 @@ class MPPI(OLGaussianMPC):
                                    cov_type,
                                    seed,
                                    sample_params=sample_params,
-                                   tensor_args=tensor_args)
+                                   tensor_args=tensor_args,
+                                   guide_params=guide_params)
         self.beta = beta
         self.alpha = alpha  # 0 means control cost is on, 1 means off
         self.update_cov = update_cov
         self.kappa = kappa
         self.visual_traj = visual_traj
+        self.chunk_size = chunk_size if chunk_size else None
+
+    def generate_rollouts(self, state):
+        if(self.chunk_size is None or self.chunk_size >= self.num_particles):
+            return super(MPPI, self).generate_rollouts(state)
+        act_seq = self.sample_actions(state=state)
+        return self._chunked_rollouts(state, act_seq)
+
+    def _chunked_rollouts(self, state, act_seq):
+        """
+            Rolls out act_seq in chunks of chunk_size particles and accumulates what
+            _update_distribution needs, without keeping costs or states of all particles.
+
+            The softmax weights are never formed: a running max of -cost/beta rescales the
+            running sum of exponentials and the exponential weighted sums of actions (and of
+            their second moments when the covariance is updated), i.e. an online log-sum-exp.
+            Normalizing at the end gives the same weighted mean as the softmax over all costs.
+        """
+        n_particles = act_seq.shape[0]
+        chunk_size = self.chunk_size
+        actions = act_seq.to(**self.tensor_args)
+        total_costs = torch.empty(n_particles, **self.tensor_args)
+        max_x = torch.tensor(-float('inf'), **self.tensor_args)
+        sum_exp = torch.zeros(1, **self.tensor_args)
+        sum_act = torch.zeros(self.horizon, self.d_action, **self.tensor_args)
+        sum_act2 = None
+        top_values, top_idx, top_trajs = None, None, None
+        rollout_time = 0.0
+        cost_reports = []
+        for start in range(0, n_particles, chunk_size):
+            end = min(start + chunk_size, n_particles)
+            n = end - start
+            chunk = act_seq[start:end]
+            if(n < chunk_size):
+                # rollout buffers have a fixed batch size, pad with particles that are dropped after:
+                chunk = torch.cat((chunk, act_seq[:chunk_size - n]), dim=0)
+            trajectories = self._rollout_fn(state, chunk)
+            rollout_time += trajectories['rollout_time']
+            if('cost_terms' in trajectories):
+                cost_reports.append(trajectories['cost_terms'])
+
+            chunk_costs = cost_to_go(trajectories['costs'][:n].to(**self.tensor_args), self.gamma_seq)[:,0]
+            total_costs[start:end] = chunk_costs
+            chunk_act = actions[start:end]
+
+            x = (-1.0/self.beta) * chunk_costs
+            new_max = torch.max(max_x, torch.max(x))
+            scale = torch.exp(max_x - new_max)
+            e = torch.exp(x - new_max)
+            sum_exp = sum_exp * scale + torch.sum(e)
+            sum_act = sum_act * scale + torch.sum(e.view(-1, 1, 1) * chunk_act, dim=0)
+            if self.update_cov:
+                chunk_act2 = self._second_moment(e, chunk_act)
+                sum_act2 = chunk_act2 if sum_act2 is None else sum_act2 * scale + chunk_act2
+            max_x = new_max
+
+            # keep the top trajectories of the chunks seen so far:
+            vis_seq = trajectories[self.visual_traj][:n].to(**self.tensor_args)
+            chunk_idx = torch.arange(start, end, device=self.tensor_args['device'])
+            if(top_values is not None):
+                chunk_costs = torch.cat((top_values, chunk_costs))
+                chunk_idx = torch.cat((top_idx, chunk_idx))
+                vis_seq = torch.cat((top_trajs, vis_seq), dim=0)
+            top_values, k_idx = torch.topk(chunk_costs, min(10, chunk_costs.shape[0]))
+            top_idx = torch.index_select(chunk_idx, 0, k_idx)
+            top_trajs = torch.index_select(vis_seq, 0, k_idx)
+
+        trajectories = dict(actions=actions,
+                            total_costs=total_costs,
+                            sum_exp=sum_exp,
+                            sum_act=sum_act,
+                            sum_act2=sum_act2,
+                            top_values=top_values,
+                            top_idx=top_idx,
+                            top_trajs=top_trajs,
+                            rollout_time=rollout_time)
+        if(len(cost_reports) > 0):
+            trajectories['cost_terms'] = merge_cost_reports(cost_reports)
+        return trajectories
+
+    def _second_moment(self, e, act):
+        # exponential weighted second moment of actions in the layout of the covariance type:
+        if self.cov_type == 'diag_AxA':
+            return torch.sum(e.view(-1, 1, 1) * act ** 2, dim=0)
+        elif self.cov_type == 'full_AxA':
+            weighted = torch.sqrt(e).view(-1, 1, 1) * act
+            weighted = weighted.reshape(-1, self.d_action)
+            return torch.matmul(weighted.T, weighted)
+        elif self.cov_type == 'full_HAxHA':
+            weighted = torch.sqrt(e).view(-1, 1) * act.reshape(act.shape[0], -1)
+            return torch.matmul(weighted.T, weighted)
+        elif self.cov_type == 'sigma_I':
+            raise NotImplementedError('Need to implement covariance update of form sigma*I')
+        raise ValueError('Unidentified covariance type in update_distribution')
+
+    def _update_distribution_chunked(self, trajectories):
+        """
+           Same update as _update_distribution from the sums of :meth:`_chunked_rollouts`.
+           The covariance update expands sum_i w_i (a_i - mean)(a_i - mean)^T into moments.
+        """
+        actions = trajectories['actions']
+        self.total_costs = trajectories['total_costs']
+        # largest weight is the lowest cost:
+        best_idx = torch.argmin(self.total_costs)
+        self.best_idx = best_idx
+        self.best_traj = torch.index_select(actions, 0, best_idx).squeeze(0)
+        self.top_values = trajectories['top_values']
+        self.top_idx = trajectories['top_idx']
+        self.top_trajs = trajectories['top_trajs']
+
+        new_mean = trajectories['sum_act'] / trajectories['sum_exp']
+        self.mean_action = (1.0 - self.step_size_mean) * self.mean_action +\
+            self.step_size_mean * new_mean
+
+        if self.update_cov:
+            mean = self.mean_action
+            m2 = trajectories['sum_act2'] / trajectories['sum_exp']
+            if self.cov_type == 'diag_AxA':
+                cov_update = torch.mean(m2 - 2.0 * mean * new_mean + mean ** 2, dim=0)
+            elif self.cov_type == 'full_AxA':
+                cross = torch.matmul(mean.T, new_mean)
+                cov_update = (m2 - cross - cross.T + torch.matmul(mean.T, mean)) / self.horizon
+            elif self.cov_type == 'full_HAxHA':
+                mean = mean.reshape(-1, 1)
+                cross = torch.matmul(mean, new_mean.reshape(1, -1))
+                cov_update = m2 - cross - cross.T + torch.matmul(mean, mean.T)
+            else:
+                raise ValueError('Unidentified covariance type in update_distribution')
+            self.cov_action = (1.0 - self.step_size_cov) * self.cov_action +\
+                self.step_size_cov * cov_update
 
     def _update_distribution(self, trajectories):
         """
@@ -109,6 +248,8 @@ class MPPI(OLGaussianMPC):
 
 
         """
+        if('sum_exp' in trajectories):
+            return self._update_distribution_chunked(trajectories)
         costs = trajectories["costs"].to(**self.tensor_args)
         vis_seq = trajectories[self.visual_traj].to(**self.tensor_args)
         actions = trajectories["actions"].to(**self.tensor_args)
@@ -291,11 +432,15 @@ class MPPI(OLGaussianMPC):
         return control_costs
     
     def _calc_val(self, trajectories):
-        costs = trajectories["costs"].to(**self.tensor_args)
         actions = trajectories["actions"].to(**self.tensor_args)
         delta = actions - self.mean_action.unsqueeze(0)
         
-        traj_costs = cost_to_go(costs, self.gamma_seq)[:,0]
+        if("total_costs" in trajectories):
+            # chunked rollouts only keep the cost to go of every particle:
+            traj_costs = trajectories["total_costs"]
+        else:
+            costs = trajectories["costs"].to(**self.tensor_args)
+            traj_costs = cost_to_go(costs, self.gamma_seq)[:,0]
         control_costs = self._control_costs(delta)
         total_costs = traj_costs + self.beta * control_costs
         # calculate log-sum-exp
@@ -60,7 +60,8 @@ class OLGaussianMPC(Controller):
                  seed=0,
                  sample_params={'type': 'halton', 'fixed_samples': True, 'seed':0, 'filter_coeffs':None},
                  tensor_args={'device':torch.device('cpu'), 'dtype':torch.float32},
-                 fixed_actions=False):
+                 fixed_actions=False,
+                 guide_params=None):
         """
         Parameters
         __________
@@ -71,6 +72,9 @@ class OLGaussianMPC(Controller):
             'repeat' : repeats second to last action
         num_particles : int
             Number of action sequences sampled at every iteration
+        guide_params : dict
+            {'frac', 'n_steps', 'step_size'}: a fraction of the samples takes n_steps down the
+            cost gradient of the rollout function before the rollout, see :meth:`_guide_particles`
         """
 
         super(OLGaussianMPC, self).__init__(d_action,
@@ -92,7 +96,10 @@ class OLGaussianMPC(Controller):
         self.num_particles = num_particles
         self.step_size_mean = step_size_mean
         self.step_size_cov = step_size_cov
-        self.squash_fn = squash_fn
+        # 'feasible' clamps to the action bounds, then squashes into the state bounds along the rollout:
+        self.feasible_actions = (squash_fn == 'feasible')
+        self.squash_fn = 'clamp' if self.feasible_actions else squash_fn
+        self._sample_state = None
 
         self.null_act_frac = null_act_frac
         self.num_null_particles = round(int(null_act_frac * self.num_particles * 1.0))
@@ -125,6 +132,11 @@ class OLGaussianMPC(Controller):
             self.sample_lib = MultipleSampleLib(self.horizon, self.d_action, tensor_args=self.tensor_args, **self.sample_params)
             self.sample_shape = torch.Size([self.num_nonzero_particles - 2])
 
+        self.guide_params = guide_params
+        self.num_guided_particles = 0
+        if(guide_params is not None):
+            self.num_guided_particles = int(guide_params['frac'] * self.sample_shape[0])
+
         self.stomp_matrix = None #self.sample_lib.stomp_cov_matrix
         # initialize covariance types:
         if self.cov_type == 'full_HAxHA':
@@ -140,6 +152,10 @@ class OLGaussianMPC(Controller):
             self.null_act_seqs = torch.zeros(self.num_null_particles, self.horizon, self.d_action, **self.tensor_args)
             
         self.delta = None
+        self.traj_library = None
+        self._goal = None
+        self._pending_goal = False
+        self._goal_ticks = 0
 
     def _get_action_seq(self, mode='mean'):
         if mode == 'mean':
@@ -152,6 +168,9 @@ class OLGaussianMPC(Controller):
             raise ValueError('Unidentified sampling mode in get_next_action')
         
         act_seq = scale_ctrl(act_seq, self.action_lows, self.action_highs, squash_fn=self.squash_fn)
+        if(self.feasible_actions and self._sample_state is not None):
+            act_seq = self.rollout_fn.project_actions(self._sample_state, act_seq.unsqueeze(0),
+                                                      self.action_lows, self.action_highs)[0]
 
         return act_seq
 
@@ -192,7 +211,9 @@ class OLGaussianMPC(Controller):
         
 
         act_seq = scale_ctrl(act_seq, self.action_lows, self.action_highs, squash_fn=self.squash_fn)
-        
+
+        if(self.num_guided_particles > 0 and state is not None):
+            act_seq = self._guide_particles(state, act_seq)
 
         append_acts = self.best_traj.unsqueeze(0)
         
@@ -207,8 +228,33 @@ class OLGaussianMPC(Controller):
 
         
         act_seq = torch.cat((act_seq, append_acts), dim=0)
+        if(self.feasible_actions and state is not None):
+            # every particle, including the null and best ones, respects the state bounds:
+            self._sample_state = state
+            act_seq = self.rollout_fn.project_actions(state, act_seq, self.action_lows, self.action_highs)
         return act_seq
 
+    def _guide_particles(self, state, act_seq):
+        """
+            Moves the first num_guided_particles samples down the cost gradient of the rollout
+            function (see :meth:`RolloutBase.cost_gradient`), so that fewer samples are wasted
+            in collision. Every step changes an action by at most step_size. Guided samples are
+            weighted like the others in the update.
+        """
+        n = self.num_guided_particles
+        guided = act_seq[:n]
+        for _ in range(self.guide_params['n_steps']):
+            grad = self.rollout_fn.cost_gradient(state, guided)
+            if(grad is None):
+                # no cheap gradient in this rollout function:
+                self.num_guided_particles = 0
+                return act_seq
+            grad = grad.to(**self.tensor_args)
+            grad_max = torch.max(torch.abs(grad.view(n, -1)), dim=-1)[0].view(n, 1, 1)
+            guided = guided - self.guide_params['step_size'] * grad / (grad_max + 1e-8)
+            guided = scale_ctrl(guided, self.action_lows, self.action_highs, squash_fn=self.squash_fn)
+        return torch.cat((guided, act_seq[n:]), dim=0)
+
     def generate_rollouts(self, state):
         """
             Samples a batch of actions, rolls out trajectories for each particle
@@ -296,9 +342,70 @@ class OLGaussianMPC(Controller):
         """
             Reset control distribution
         """
+        self._sample_state = None
         self.reset_mean()
         self.reset_covariance()
 
+    def set_trajectory_library(self, library, k=3, max_dist=0.5, settle_iters=20, record_every=10,
+                               goal_change_dist=0.05):
+        """Warm starts the mean from a :class:`TrajectoryLibrary` when the goal jumps.
+
+        Args:
+            library (TrajectoryLibrary): library keyed by joint positions and goal
+            k (int): nearest entries blended into the seed, weighted by inverse distance
+            max_dist (float): entries further than this from the query key are not used
+            settle_iters (int): optimizations after a goal jump before the mean is recorded
+            record_every (int): optimizations between recordings while the goal holds
+            goal_change_dist (float): goal moves shorter than this are tracked without a warm start
+        """
+        self.traj_library = library
+        self.library_params = dict(k=k, max_dist=max_dist, settle_iters=settle_iters, record_every=record_every,
+                                   goal_change_dist=goal_change_dist)
+
+    def set_goal(self, goal):
+        """Tells the controller about the goal of the rollout function, as a flat list.
+        A jump of the goal warm starts the next optimization from the trajectory library.
+        """
+        if(self.traj_library is None or goal is None):
+            return
+        goal = torch.as_tensor(goal, **self.tensor_args)
+        if(self._goal is None or goal.shape != self._goal.shape or
+           torch.norm(goal - self._goal) > self.library_params['goal_change_dist']):
+            self._pending_goal = True
+            self._goal_ticks = 0
+        self._goal = goal
+
+    def _warm_start(self, state):
+        res = self.traj_library.query(self.traj_library.make_key(state, self._goal), self.library_params['k'])
+        if(res is None):
+            return False
+        dist, trajs = res
+        mask = dist <= self.library_params['max_dist']
+        if(not torch.any(mask)):
+            return False
+        dist, trajs = dist[mask], trajs[mask]
+        w = 1.0 / (dist + 1e-6)
+        w = w / torch.sum(w)
+        self.mean_action = torch.sum(w.view(-1, 1, 1) * trajs, dim=0)
+        self.best_traj = trajs[0].clone()
+        # explore around the seed instead of a covariance shrunk on the old goal:
+        self.reset_covariance()
+        return True
+
+    def optimize(self, state, calc_val=False, shift_steps=1, n_iters=None):
+        if(self.traj_library is not None and self._pending_goal):
+            self._pending_goal = False
+            if(self._warm_start(state.view(-1))):
+                # the seed starts at the current state:
+                shift_steps = 0
+        result = super(OLGaussianMPC, self).optimize(state, calc_val=calc_val, shift_steps=shift_steps, n_iters=n_iters)
+        if(self.traj_library is not None and self._goal is not None):
+            self._goal_ticks += 1
+            ticks = self._goal_ticks - self.library_params['settle_iters']
+            if(ticks >= 0 and ticks % self.library_params['record_every'] == 0):
+                self.traj_library.add(self.traj_library.make_key(state.view(-1), self._goal), self.mean_action)
+        return result
+
     def _calc_val(self, cost_seq, act_seq):
         raise NotImplementedError("_calc_val not implemented")
 
@@ -0,0 +1,153 @@
+#
+# MIT License
+#
+# Copyright (c) 2020-2021 NVIDIA CORPORATION.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.#
+import os
+
+import torch
+
+
+def goal_key_from_rollout(rollout_fn):
+    """Goal part of a library key, read from a rollout function after its update_params.
+
+    Goals given as a joint state, a position, a rotation matrix or a quaternion all end up as the
+    end-effector pose of the rollout function, so partial updates keep the rest of the pose.
+
+    Returns:
+        tensor: goal pose [x, y, z, qw, qx, qy, qz], None until both position and orientation are set
+    """
+    goal_ee_pos = getattr(rollout_fn, 'goal_ee_pos', None)
+    goal_ee_quat = getattr(rollout_fn, 'goal_ee_quat', None)
+    if(goal_ee_pos is None or goal_ee_quat is None):
+        return None
+    return torch.cat([goal_ee_pos.view(-1), goal_ee_quat.view(-1)])
+
+
+class TrajectoryLibrary(object):
+    """Converged mean action sequences keyed by (start joint state, goal).
+
+    Keys are stored in one tensor and queried by brute force distance on the controller's device. A
+    few thousand entries take one matrix product, which is cheaper than keeping a tree index up to date
+    on every insert. When full, the oldest entry is replaced. An insert close to an existing key
+    replaces that entry instead, so a repeated motion does not fill the library.
+    """
+    def __init__(self, state_dim, goal_dim, horizon, d_action, capacity=5000, goal_weight=1.0, merge_dist=1e-2,
+                 path=None, autosave_every=100, tensor_args={'device':"cpu", 'dtype':torch.float32}):
+        """
+        Args:
+            state_dim (int): joint positions in the key
+            goal_dim (int): goal entries in the key
+            horizon (int): steps of a stored action sequence
+            d_action (int): action dimension
+            capacity (int): maximum entries
+            goal_weight (float): scale of the goal part of the key against the joint positions
+            merge_dist (float): inserts closer than this to an entry replace it
+            path (str): file the library is loaded from and saved to
+            autosave_every (int): save after this many inserts, 0 only saves on :meth:`save`
+        """
+        self.tensor_args = tensor_args
+        self.state_dim = state_dim
+        self.goal_dim = goal_dim
+        self.horizon = horizon
+        self.d_action = d_action
+        self.capacity = capacity
+        self.merge_dist = merge_dist
+        self.path = path
+        self.autosave_every = autosave_every
+        self.key_scale = torch.cat([torch.ones(state_dim, **tensor_args),
+                                    goal_weight * torch.ones(goal_dim, **tensor_args)])
+        self.keys = torch.zeros(capacity, state_dim + goal_dim, **tensor_args)
+        self.trajs = torch.zeros(capacity, horizon, d_action, **tensor_args)
+        self.stamps = torch.zeros(capacity, dtype=torch.int64, device=tensor_args['device'])
+        self.count = 0
+        self._n_inserts = 0
+        # inserts since the last save or load:
+        self.n_unsaved = 0
+        if(path is not None and os.path.exists(path)):
+            self.load(path)
+
+    def __len__(self):
+        return self.count
+
+    def make_key(self, state, goal):
+        state = torch.as_tensor(state, **self.tensor_args).view(-1)[:self.state_dim]
+        goal = torch.as_tensor(goal, **self.tensor_args).view(-1)
+        return torch.cat([state, goal]) * self.key_scale
+
+    def query(self, key, k=1):
+        """
+        Returns:
+            tuple: distances [k] and action sequences [k, horizon, d_action] of the nearest entries,
+            nearest first, None when the library is empty
+        """
+        if(self.count == 0):
+            return None
+        dist = torch.norm(self.keys[:self.count] - key.unsqueeze(0), dim=-1)
+        dist, idx = torch.topk(dist, min(k, self.count), largest=False)
+        return dist, self.trajs[idx]
+
+    def add(self, key, act_seq):
+        if(self.count > 0):
+            dist = torch.norm(self.keys[:self.count] - key.unsqueeze(0), dim=-1)
+            min_dist, idx = torch.min(dist, dim=0)
+            if(min_dist.item() < self.merge_dist):
+                self._write(int(idx), key, act_seq)
+                return
+        if(self.count < self.capacity):
+            idx = self.count
+            self.count += 1
+        else:
+            idx = int(torch.argmin(self.stamps))
+        self._write(idx, key, act_seq)
+
+    def _write(self, idx, key, act_seq):
+        self._n_inserts += 1
+        self.n_unsaved += 1
+        self.keys[idx] = key
+        self.trajs[idx] = act_seq
+        self.stamps[idx] = self._n_inserts
+        if(self.path is not None and self.autosave_every > 0 and self._n_inserts % self.autosave_every == 0):
+            self.save()
+
+    def save(self, path=None):
+        path = self.path if path is None else path
+        data = {'keys': self.keys[:self.count].cpu(), 'trajs': self.trajs[:self.count].cpu(),
+                'stamps': self.stamps[:self.count].cpu(), 'key_scale': self.key_scale.cpu()}
+        # the controller can be copied to another process, which saves too:
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        torch.save(data, tmp_path)
+        os.replace(tmp_path, path)
+        self.n_unsaved = 0
+
+    def load(self, path):
+        data = torch.load(path, map_location='cpu')
+        if(data['keys'].shape[1] != self.keys.shape[1] or data['trajs'].shape[1:] != self.trajs.shape[1:]):
+            print('WARNING: trajectory library {} does not match the controller, starting empty'.format(path))
+            return
+        n = min(data['keys'].shape[0], self.capacity)
+        # keep the newest entries when the capacity shrank:
+        order = torch.argsort(data['stamps'], descending=True)[:n]
+        self.keys[:n] = (data['keys'][order] / data['key_scale'] * self.key_scale.cpu()).to(**self.tensor_args)
+        self.trajs[:n] = data['trajs'][order].to(**self.tensor_args)
+        self.stamps[:n] = data['stamps'][order].to(self.stamps.device)
+        self.count = n
+        self._n_inserts = int(data['stamps'].max()) if n > 0 else 0
+        self.n_unsaved = 0
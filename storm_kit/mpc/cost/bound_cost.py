@@ -39,17 +39,20 @@ class BoundCost(nn.Module):
         self.bound_thresh = bound_thresh * self.bnd_range
         self.bounds[:,1] -= self.bound_thresh
         self.bounds[:,0] += self.bound_thresh
-    def forward(self, state_batch):
-        inp_device = state_batch.device
-
+    def residual(self, state_batch):
+        # distance outside the shrunk bounds, zero inside:
         bound_mask = torch.logical_and(state_batch < self.bounds[:,1],
                                        state_batch > self.bounds[:,0])
 
         cost = torch.minimum(torch.square(state_batch - self.bounds[:,0]),torch.square(self.bounds[:,1] - state_batch))
         
-        cost[bound_mask] = 0.0
+        cost = cost.masked_fill(bound_mask, 0.0)
+
+        return torch.sqrt(torch.sum(cost, dim=-1))
+
+    def forward(self, state_batch):
+        inp_device = state_batch.device
 
-        cost = (torch.sum(cost, dim=-1))
-        cost = self.weight * self.proj_gaussian(torch.sqrt(cost))
+        cost = self.weight * self.proj_gaussian(self.residual(state_batch))
         
         return cost.to(inp_device)
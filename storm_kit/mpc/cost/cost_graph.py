@@ -0,0 +1,229 @@
+#
+# MIT License
+#
+# Copyright (c) 2020-2021 NVIDIA CORPORATION.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.#
+import time
+
+import torch
+import torch.autograd.profiler as profiler
+
+
+@torch.jit.script
+def gaussian_projection_terms(residuals, weight, s, c, n_pow, r, gaussian):
+    # type: (Tensor, Tensor, Tensor, Tensor, Tensor, Tensor, Tensor) -> Tensor
+    """Weighted gaussian projections of stacked cost residuals.
+    Follows :class:`GaussianProjection`, terms with ``gaussian`` false are only weighted.
+
+    Args:
+        residuals (Tensor): [n_terms, batch, horizon]
+        weight, s, c, n_pow, r (Tensor): projection parameters [n_terms, 1, 1]
+        gaussian (Tensor): bool mask of projected terms [n_terms, 1, 1]
+
+    Returns:
+        Tensor: cost per term [n_terms, batch, horizon]
+    """
+    x = residuals - s
+    x_sq = x * x
+    proj = 1.0 - n_pow * torch.exp(-x_sq / (2.0 * c * c)) + r * x_sq * x_sq
+    cost = torch.where(gaussian, proj, residuals)
+    return weight * cost
+
+@torch.jit.script
+def fused_gaussian_projection(residuals, weight, s, c, n_pow, r, gaussian):
+    # type: (Tensor, Tensor, Tensor, Tensor, Tensor, Tensor, Tensor) -> Tensor
+    """Sum of :func:`gaussian_projection_terms` over terms in a single pass.
+
+    Returns:
+        Tensor: cost [batch, horizon]
+    """
+    return torch.sum(gaussian_projection_terms(residuals, weight, s, c, n_pow, r, gaussian), dim=0)
+
+
+class CostTerm(object):
+    def __init__(self, name, fn, group, weight=None, proj_gaussian=None):
+        """
+        Args:
+            name (str): name used for timings
+            fn (callable): fn(ctx) returns the residual [batch, horizon] for fused terms, or the
+                weighted cost for direct terms. Direct terms can return None to be skipped.
+            group (str): terms are enabled per call by group
+            weight (float, optional): weight of a fused term, None makes the term direct.
+            proj_gaussian (GaussianProjection, optional): projection of a fused term, None only weights it.
+        """
+        self.name = name
+        self.fn = fn
+        self.group = group
+        self.weight = weight
+        self.proj_gaussian = proj_gaussian
+
+    @property
+    def fused(self):
+        return self.weight is not None
+
+
+class CostGraph(object):
+    """Sum of cost terms, resolved once from the cost config.
+    Terms whose cost is ``weight * projection(residual)`` only compute their residual; the
+    residuals are stacked and projected, weighted and summed by one fused kernel. Other terms add
+    their cost directly.
+
+    When profile is enabled, every term is timed with cuda syncs and wrapped in a profiler range,
+    and :func:`get_report` gives per term wall time, cuda memory and weighted contribution to the
+    total cost of the last call.
+    """
+    def __init__(self, tensor_args={'device':"cpu", 'dtype':torch.float32}, profile=False):
+        self.tensor_args = tensor_args
+        self.profile = profile
+        self.terms = []
+        self.report = {}
+        self._plans = {}
+        self._cuda = torch.device(tensor_args['device']).type == 'cuda'
+        self._fused_term = CostTerm('fused_projection', self._project, 'base')
+        
+    def add_term(self, name, fn, group='base', weight=None, proj_gaussian=None):
+        self.terms.append(CostTerm(name, fn, group, weight, proj_gaussian))
+        self._plans = {}
+
+    def _build_plan(self, groups):
+        terms = [t for t in self.terms if t.group in groups]
+        fused = [t for t in terms if t.fused]
+        params = None
+        if(len(fused) > 0):
+            vals = {'weight':[], 's':[], 'c':[], 'n_pow':[], 'r':[], 'gaussian':[]}
+            for t in fused:
+                proj = t.proj_gaussian
+                gaussian = proj is not None and proj._wc != 0.0
+                vals['weight'].append(float(t.weight))
+                vals['s'].append(float(proj._ws) if gaussian else 0.0)
+                vals['c'].append(float(proj._wc) if gaussian else 1.0)
+                vals['n_pow'].append(float(proj.n_pow) if gaussian else 1.0)
+                vals['r'].append(float(proj._wr) if gaussian else 0.0)
+                vals['gaussian'].append(gaussian)
+            params = {k:torch.as_tensor(v, **self.tensor_args).view(-1, 1, 1) for k, v in vals.items() if k != 'gaussian'}
+            params['gaussian'] = torch.as_tensor(vals['gaussian'], device=self.tensor_args['device']).view(-1, 1, 1)
+        return terms, params
+
+    def _project(self, inputs):
+        residuals, params = inputs
+        args = (torch.stack(residuals), params['weight'], params['s'], params['c'], params['n_pow'],
+                params['r'], params['gaussian'])
+        if(self.profile):
+            # keep the weighted cost of every term for the report:
+            return gaussian_projection_terms(*args)
+        return fused_gaussian_projection(*args)
+
+    def _eval(self, term, ctx):
+        if(not self.profile):
+            return term.fn(ctx)
+        with profiler.record_function(term.name):
+            if(self._cuda):
+                torch.cuda.synchronize()
+                mem_start = torch.cuda.memory_allocated()
+                torch.cuda.reset_peak_memory_stats()
+            st = time.time()
+            res = term.fn(ctx)
+            memory = None
+            if(self._cuda):
+                torch.cuda.synchronize()
+                memory = (torch.cuda.max_memory_allocated() - mem_start) / 1e6
+            self.report[term.name] = {'time_ms':(time.time() - st) * 1000.0, 'memory_mb':memory, 'cost':None}
+        return res
+
+    def _record_cost(self, name, cost):
+        # mean over the batch of the cost summed over the horizon:
+        self.report[name]['cost'] = torch.mean(torch.sum(cost, dim=-1)).item()
+
+    def forward(self, ctx, groups):
+        """Computes the total cost.
+
+        Args:
+            ctx (Dict): inputs shared by the terms, terms can add entries for later terms
+            groups (tuple): enabled term groups
+
+        Returns:
+            tensor: cost [batch, horizon]
+        """
+        if(groups not in self._plans):
+            self._plans[groups] = self._build_plan(groups)
+        terms, params = self._plans[groups]
+        if(self.profile):
+            self.report = {}
+
+        cost = None
+        residuals = []
+        fused_names = []
+        for t in terms:
+            res = self._eval(t, ctx)
+            if(t.fused):
+                residuals.append(res)
+                fused_names.append(t.name)
+            elif(res is not None):
+                if(self.profile):
+                    self._record_cost(t.name, res)
+                cost = res if cost is None else cost + res
+        if(len(residuals) > 0):
+            fused_cost = self._eval(self._fused_term, (residuals, params))
+            if(self.profile):
+                for i, name in enumerate(fused_names):
+                    self._record_cost(name, fused_cost[i])
+                fused_cost = torch.sum(fused_cost, dim=0)
+            cost = fused_cost if cost is None else cost + fused_cost
+        return cost
+
+    def __call__(self, ctx, groups):
+        return self.forward(ctx, groups)
+
+    def get_term_times(self):
+        """Last measured time [ms] per term, requires profile=True."""
+        return {k:v['time_ms'] for k, v in self.report.items()}
+
+    def get_report(self):
+        """Breakdown of the last call, requires profile=True.
+
+        Returns:
+            Dict: {term: {'time_ms', 'memory_mb', 'cost', 'cost_fraction'}}. memory_mb is the peak cuda
+            memory allocated by the term (None on cpu), cost the weighted term cost summed over the
+            horizon and averaged over rollouts.
+        """
+        total = sum([abs(v['cost']) for v in self.report.values() if v['cost'] is not None])
+        report = {}
+        for k, v in self.report.items():
+            report[k] = dict(v)
+            report[k]['cost_fraction'] = None if (v['cost'] is None or total == 0.0) else abs(v['cost']) / total
+        return report
+
+
+def merge_cost_reports(reports):
+    """Merges :func:`CostGraph.get_report` of several optimization iterations.
+    Times are summed, memory is the peak and costs are taken from the last iteration.
+    """
+    merged = {}
+    for rep in reports:
+        for k, v in rep.items():
+            if(k not in merged):
+                merged[k] = dict(v)
+                continue
+            merged[k]['time_ms'] += v['time_ms']
+            if(v['memory_mb'] is not None):
+                merged[k]['memory_mb'] = max(merged[k]['memory_mb'], v['memory_mb'])
+            merged[k]['cost'] = v['cost']
+            merged[k]['cost_fraction'] = v['cost_fraction']
+    return merged
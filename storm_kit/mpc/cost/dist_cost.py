@@ -40,6 +40,15 @@ class DistCost(nn.Module):
     
     def forward(self, disp_vec, dist_type="l2", beta=1.0, RETURN_GOAL_DIST=False):
         inp_device = disp_vec.device
+        dist = self.residual(disp_vec, dist_type)
+
+        cost = self.weight * self.proj_gaussian(dist)
+
+        if(RETURN_GOAL_DIST):
+            return cost.to(inp_device), dist.to(inp_device)
+        return cost.to(inp_device)
+
+    def residual(self, disp_vec, dist_type="l2"):
         disp_vec = self.vec_weight * disp_vec.to(self.device)
 
         if dist_type == 'l2':
@@ -53,11 +62,6 @@ class DistCost(nn.Module):
             l1_dist = torch.norm(disp_vec, p=1, dim=-1)
             dist = None
             raise NotImplementedError
-
-        cost = self.weight * self.proj_gaussian(dist)
-
-        if(RETURN_GOAL_DIST):
-            return cost.to(inp_device), dist.to(inp_device)
-        return cost.to(inp_device)
+        return dist
 
 
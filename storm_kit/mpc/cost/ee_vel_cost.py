@@ -42,6 +42,10 @@ class EEVelCost(nn.Module):
     def forward(self, state_batch, jac_batch):
         
         inp_device = state_batch.device
+        cost = self.weight * self.gaussian_projection(self.residual(state_batch, jac_batch))
+        return cost.to(inp_device)
+
+    def residual(self, state_batch, jac_batch):
         jac_batch = jac_batch.to(self.device)
         
         
@@ -52,7 +56,5 @@ class EEVelCost(nn.Module):
         xdot_current = torch.matmul(J, qdot.unsqueeze(-1)).squeeze(-1)
         
         error = torch.sum(torch.square(self.vec_weight * xdot_current), dim=-1)
-
-        cost = self.weight * self.gaussian_projection(error)
-        return cost.to(inp_device)
+        return error
 
@@ -20,10 +20,6 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 # DEALINGS IN THE SOFTWARE.#
-import matplotlib
-matplotlib.use('WebAgg') #matplotlib.use('tkagg')
-import matplotlib.pyplot as plt
-
 import torch
 import torch.nn as nn
 # import torch.nn.functional as F
@@ -47,6 +43,9 @@ class FiniteDifferenceCost(nn.Module):
         """
         ctrl_seq: [B X H X d_act]
         """
+        return self.weight * self.residual(ctrl_seq, dt)
+
+    def residual(self, ctrl_seq, dt):
         dt[dt == 0.0] = 0.0 #dt[-1]
         dt = 1 / dt
         
@@ -81,8 +80,7 @@ class FiniteDifferenceCost(nn.Module):
         
         cost = res[:,:,-1]
             
-        cost[cost < 0.0001] = 0.0
-        cost = self.weight * cost 
+        cost = cost.masked_fill(cost < 0.0001, 0.0)
         
         
         return cost
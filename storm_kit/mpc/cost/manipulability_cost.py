@@ -42,22 +42,22 @@ class ManipulabilityCost(nn.Module):
         self.ndofs = ndofs
         self.thresh = thresh
         self.i_mat = torch.ones((6,1), device=self.device, dtype=self.float_dtype)
-    def forward(self, jac_batch):
-        inp_device = jac_batch.device
-        
-        
-
+    def residual(self, jac_batch):
+        # normalized distance of the manipulability score below thresh:
         with torch.cuda.amp.autocast(enabled=False):
             
             J_J_t = torch.matmul(jac_batch, jac_batch.transpose(-2,-1))
             score = torch.sqrt(torch.det(J_J_t))
-        score[score != score] = 0.0
+        score = score.masked_fill(score != score, 0.0)
         
         
-        score[score > self.thresh] = self.thresh #1.0
-        score = (self.thresh - score) / self.thresh
+        score = torch.clamp(score, max=self.thresh)
+        return (self.thresh - score) / self.thresh
+
+    def forward(self, jac_batch):
+        inp_device = jac_batch.device
 
-        cost = self.weight * score 
+        cost = self.weight * self.residual(jac_batch)
         
         return cost.to(inp_device)
     
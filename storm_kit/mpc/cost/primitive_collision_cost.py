@@ -23,12 +23,27 @@
 import torch
 import torch.nn as nn
 # import torch.nn.functional as F
-from ...geom.sdf.robot_world import RobotWorldCollisionPrimitive
+from ...geom.sdf.robot_world import RobotWorldCollisionPrimitive, RobotWorldCollisionCapsule, RobotWorldCollisionNN
 from .gaussian_projection import GaussianProjection
 
 class PrimitiveCollisionCost(nn.Module):
     def __init__(self, weight=None, world_params=None, robot_params=None, gaussian_params={},
-                 distance_threshold=0.1, tensor_args={'device':torch.device('cpu'), 'dtype':torch.float32}):
+                 distance_threshold=0.1, tensor_args={'device':torch.device('cpu'), 'dtype':torch.float32},
+                 collision_mode='grid', broadphase_params=None, swept_prefilter=False,
+                 continuous=False, sweep_substeps=1, prefilter_margin=None):
+        """
+        Args:
+            collision_mode (str): 'grid' reads the precomputed world sdf, 'analytic' evaluates the primitives,
+                'capsule' evaluates one capsule per link against the primitives, 'nn' queries a learned
+                scene sdf (world_collision_params: model_path, scene_name).
+            broadphase_params (dict): {'cell_size', 'margin'}, only nearby primitives are evaluated in analytic mode.
+            swept_prefilter (bool): cull primitives outside the volume swept by the rollouts at every step.
+            prefilter_margin (float): inflation of the swept volume around the link origins. Defaults to None:
+                the reach of the link spheres plus distance_threshold.
+            continuous (bool): also check the link spheres between consecutive knots to catch tunneling through
+                thin obstacles (grid and analytic modes).
+            sweep_substeps (int): sub-segments of the conservative sweep bound in grid mode.
+        """
         super(PrimitiveCollisionCost, self).__init__()
         
         self.tensor_args = tensor_args
@@ -38,20 +53,45 @@ class PrimitiveCollisionCost(nn.Module):
 
         robot_collision_params = robot_params['robot_collision_params']
         self.batch_size = -1
+        world_collision_params = robot_params['world_collision_params']
         # BUILD world and robot:
-        self.robot_world_coll = RobotWorldCollisionPrimitive(robot_collision_params,
-                                                             world_params['world_model'],
-                                                             tensor_args=self.tensor_args,
-                                                             bounds=robot_params['world_collision_params']['bounds'],
-                                                             grid_resolution=robot_params['world_collision_params']['grid_resolution'])
+        if(collision_mode == 'capsule'):
+            self.robot_world_coll = RobotWorldCollisionCapsule(robot_collision_params,
+                                                               world_params['world_model'],
+                                                               tensor_args=self.tensor_args)
+        elif(collision_mode == 'nn'):
+            self.robot_world_coll = RobotWorldCollisionNN(robot_collision_params,
+                                                          world_collision_params,
+                                                          tensor_args=self.tensor_args)
+        else:
+            self.robot_world_coll = RobotWorldCollisionPrimitive(robot_collision_params,
+                                                                 world_params['world_model'],
+                                                                 tensor_args=self.tensor_args,
+                                                                 bounds=world_collision_params['bounds'],
+                                                                 grid_resolution=world_collision_params['grid_resolution'],
+                                                                 brick_size=world_collision_params.get('brick_size', None),
+                                                                 narrow_band=world_collision_params.get('narrow_band', 0.1),
+                                                                 broadphase_params=broadphase_params)
         
         self.n_world_objs = self.robot_world_coll.world_coll.n_objs
         self.t_mat = None
         self.distance_threshold = distance_threshold
+        self.collision_mode = collision_mode
+        self.swept_prefilter = swept_prefilter
+        self.continuous = continuous and collision_mode in ['grid', 'analytic']
+        self.sweep_substeps = sweep_substeps
+        if(prefilter_margin is None and swept_prefilter and collision_mode == 'analytic'):
+            # beyond this, a primitive is further than distance_threshold from every sphere and has no cost:
+            prefilter_margin = self.robot_world_coll.robot_coll.get_link_sphere_reach() + distance_threshold
+        self.prefilter_margin = prefilter_margin
     def forward(self, link_pos_seq, link_rot_seq):
-
-        
         inp_device = link_pos_seq.device
+        cost = self.weight * self.residual(link_pos_seq, link_rot_seq)
+
+        return cost.to(inp_device)
+
+    def residual(self, link_pos_seq, link_rot_seq):
+        """Clamped and rescaled penetration summed over links [batch, horizon], before weighting."""
         batch_size = link_pos_seq.shape[0]
         horizon = link_pos_seq.shape[1]
         n_links = link_pos_seq.shape[2]
@@ -62,22 +102,47 @@ class PrimitiveCollisionCost(nn.Module):
 
         link_pos_batch = link_pos_seq.view(batch_size * horizon, n_links, 3)
         link_rot_batch = link_rot_seq.view(batch_size * horizon, n_links, 3, 3)
-        dist = self.robot_world_coll.check_robot_sphere_collisions(link_pos_batch,
-                                                                   link_rot_batch)
+        if(self.collision_mode == 'capsule'):
+            dist = self.robot_world_coll.get_robot_env_sdf(link_pos_batch, link_rot_batch)
+        elif(self.collision_mode == 'analytic'):
+            if(self.swept_prefilter):
+                self.robot_world_coll.world_coll.set_active_region(link_pos_batch, self.prefilter_margin)
+            dist = self.robot_world_coll.get_robot_env_sdf(link_pos_batch, link_rot_batch)
+        else:
+            dist = self.robot_world_coll.check_robot_sphere_collisions(link_pos_batch,
+                                                                       link_rot_batch)
         dist = dist.view(batch_size, horizon, n_links)#, self.n_world_objs)
+        if(self.continuous and horizon > 1):
+            swept_dist = self.robot_world_coll.check_swept_sphere_collisions(horizon, self.sweep_substeps,
+                                                                             analytic=self.collision_mode == 'analytic')
+            dist[:,1:] = torch.max(dist[:,1:], swept_dist)
         # cost only when dist is less
-        dist += self.distance_threshold
-
-        dist[dist <= 0.0] = 0.0
-        dist[dist > 0.2] = 0.2
+        dist = torch.clamp(dist + self.distance_threshold, min=0.0, max=0.2)
         dist = dist / 0.25
-        
-        cost = torch.sum(dist, dim=-1)
 
+        return torch.sum(dist, dim=-1)
 
-        cost = self.weight * cost 
+    def gradient(self, link_pos, link_rot):
+        """Weighted cost gradient w.r.t. the link sphere centers, with the clamping of :meth:`residual`.
+        Only the deepest sphere of a link carries a gradient. Swept checks are not differentiated.
 
-        return cost.to(inp_device)
+        Args:
+            link_pos (tensor): [b, n_links, 3]
+            link_rot (tensor): [b, n_links, 3, 3]
+
+        Returns:
+            tuple: sphere centers [b, n_links, n_spheres, 3], gradient [b, n_links, n_spheres, 3],
+                None in capsule mode
+        """
+        if(self.collision_mode == 'capsule'):
+            return None
+        centers, sdf, grad = self.robot_world_coll.get_robot_sphere_sdf_and_gradient(link_pos, link_rot)
+        dist, idx = torch.max(sdf, dim=-1)
+        dist = dist + self.distance_threshold
+        active = ((dist > 0.0) & (dist < 0.2)).to(sdf.dtype)
+        scale = torch.zeros_like(sdf)
+        scale.scatter_(-1, idx.unsqueeze(-1), (active * self.weight / 0.25).unsqueeze(-1))
+        return centers, scale.unsqueeze(-1) * grad
 
 
 
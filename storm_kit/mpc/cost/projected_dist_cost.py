@@ -43,6 +43,10 @@ class ProjectedDistCost(DistCost):
         self.vec_weight = torch.as_tensor(vec_weight, device=device, dtype=float_dtype)
     def forward(self, disp_vec, jac_batch, proj_type="transpose", dist_type="squared_l2", beta=1.0):
         inp_device = disp_vec.device
+        cost = self.weight * self.proj_gaussian(self.residual(disp_vec, jac_batch, proj_type, dist_type))
+        return cost.to(inp_device)
+
+    def residual(self, disp_vec, jac_batch, proj_type="transpose", dist_type="squared_l2"):
         disp_vec = self.vec_weight * disp_vec.to(self.device)
 
         if proj_type == "transpose":
@@ -55,7 +59,7 @@ class ProjectedDistCost(DistCost):
         
 
 
-        return super().forward(disp_vec_projected, dist_type, beta)
+        return super().residual(disp_vec_projected, dist_type)
 
 
     def get_transpose_null_disp(self, disp_vec, jac_batch):
@@ -33,7 +33,13 @@ from .gaussian_projection import GaussianProjection
 class RobotSelfCollisionCost(nn.Module):
     def __init__(self, weight=None, robot_params=None,
                  gaussian_params={}, distance_threshold=-0.01, 
-                 batch_size=2, tensor_args={'device':torch.device('cpu'), 'dtype':torch.float32}):
+                 batch_size=2, tensor_args={'device':torch.device('cpu'), 'dtype':torch.float32},
+                 collision_mode='nn'):
+        """
+        Args:
+            collision_mode (str): 'nn' uses the learned self collision network on joint angles,
+                'analytic' computes sphere distances between non-adjacent links from link poses.
+        """
         super(RobotSelfCollisionCost, self).__init__()
         self.tensor_args = tensor_args
         self.device = tensor_args['device']
@@ -55,6 +61,7 @@ class RobotSelfCollisionCost(nn.Module):
         bounds = robot_params['world_collision_params']['bounds']
         self.distance_threshold = distance_threshold
         self.batch_size = batch_size
+        self.collision_mode = collision_mode
         
         # initialize NN model:
         self.coll = RobotSphereCollision(robot_collision_params, self.batch_size,
@@ -84,27 +91,26 @@ class RobotSelfCollisionCost(nn.Module):
         res = torch.max(res, dim=-1)[0]
         return res
 
-    def forward(self, q):
+    def forward(self, q, link_pos_seq=None, link_rot_seq=None):
+        cost = self.weight * self.proj_gaussian(self.residual(q, link_pos_seq, link_rot_seq))
+
+        return cost
+
+    def residual(self, q, link_pos_seq=None, link_rot_seq=None):
+        """Clamped and rescaled self penetration [batch, horizon], before weighting and projection."""
         batch_size = q.shape[0]
         horizon = q.shape[1]
-        q = q.view(batch_size * horizon, q.shape[2])
-        
-        res = self.coll.check_self_collisions_nn(q)
+        if(self.collision_mode == 'analytic'):
+            res = self.distance(link_pos_seq, link_rot_seq)
+        else:
+            q = q.view(batch_size * horizon, q.shape[2])
+            res = self.coll.check_self_collisions_nn(q)
         
         res = res.view(batch_size, horizon)
-        res += self.distance_threshold
-        res[res <= 0.0] = 0.0
-
-        res[res >= 0.5] = 0.5
+        res = torch.clamp(res + self.distance_threshold, min=0.0, max=0.5)
 
         # rescale:
         res = res / 0.25
 
-            
-        
-        cost = res
-        
-        cost = self.weight * self.proj_gaussian(cost)
-
-        return cost
+        return res
     
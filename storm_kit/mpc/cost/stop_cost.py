@@ -49,20 +49,16 @@ class StopCost(nn.Module):
             delta_vel = torch.ones_like(self.traj_dt) * max_limit
             self.max_vel = ((sum_matrix @ delta_vel).unsqueeze(-1))
         
+    def residual(self, vels):
+        # velocity above the stopping limit, before weighting and projection:
+        vel_abs = torch.abs(vels.to(**self.tensor_args)) - self.max_vel
+        vel_abs = torch.clamp(vel_abs, min=0.0)
+        return torch.sum(torch.square(vel_abs), dim=-1)
+
     def forward(self, vels):
         inp_device = vels.device
-
-        
-        vel_abs = torch.abs(vels.to(**self.tensor_args))
-
-
-        # max velocity threshold:
-        
-
-        vel_abs = vel_abs - self.max_vel
-        vel_abs[vel_abs < 0.0] = 0.0
         
-        cost = self.weight * self.proj_gaussian(((torch.sum(torch.square(vel_abs), dim=-1))))
+        cost = self.weight * self.proj_gaussian(self.residual(vels))
 
         
         return cost.to(inp_device)
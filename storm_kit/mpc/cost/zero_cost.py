@@ -36,19 +36,23 @@ class ZeroCost(nn.Module):
         self.proj_gaussian = GaussianProjection(gaussian_params=gaussian_params)
         self.hinge_val = hinge_val
         self.max_vel = max_vel
-    def forward(self, vels, goal_dist):
-        inp_device = vels.device
+    def residual(self, vels, goal_dist):
         vel_err = torch.abs(vels.to(self.device))
         goal_dist = goal_dist.to(self.device)
         
 
         # max velocity threshold:
-        vel_err[vel_err < self.max_vel] = 0.0
+        vel_err = vel_err.masked_fill(vel_err < self.max_vel, 0.0)
 
         if(self.hinge_val > 0.0):
             vel_err = torch.where(goal_dist <= self.hinge_val, vel_err, 0.0 * vel_err / goal_dist) #soft hinge
 
-        cost = self.weight * self.proj_gaussian((torch.sum(torch.square(vel_err), dim=-1)))
+        return torch.sum(torch.square(vel_err), dim=-1)
+
+    def forward(self, vels, goal_dist):
+        inp_device = vels.device
+
+        cost = self.weight * self.proj_gaussian(self.residual(vels, goal_dist))
 
         
         return cost.to(inp_device)
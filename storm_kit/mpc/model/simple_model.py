@@ -22,9 +22,6 @@
 # DEALINGS IN THE SOFTWARE.#
 
 #
-import matplotlib
-matplotlib.use('WebAgg') #matplotlib.use('tkagg')
-import matplotlib.pyplot as plt
 import torch
 from typing import List, Tuple, Dict, Optional, Any
 
@@ -144,6 +141,7 @@ class HolonomicModel(DynamicsModelBase):
         
         #plt.show()
         if(False):
+            import matplotlib.pyplot as plt
             fig, axs = plt.subplots(3)
             axs[0].plot(values[idx,:,0].cpu().numpy(),'r')
             axs[0].plot(clamp_values[idx,:,0].cpu().numpy(),'g')
@@ -25,7 +25,6 @@ import torch
 import torch.autograd.profiler as profiler
 
 from ...differentiable_robot_model.differentiable_robot_model import DifferentiableRobotModel
-from urdfpy import URDF
 from .model_base import DynamicsModelBase
 from .integration_utils import build_int_matrix, build_fd_matrix, tensor_step_acc, tensor_step_vel, tensor_step_pos, tensor_step_jerk
 
@@ -48,13 +47,13 @@ class URDFKinematicModel(DynamicsModelBase):
 
         #self.robot_model.half()
         self.n_dofs = self.robot_model._n_dofs
-        self.urdfpy_robot = URDF.load(urdf_path) #only for visualization
+        self._urdfpy_robot = None
         
         self.d_state = 3 * self.n_dofs + 1
         self.d_action = self.n_dofs
 
         #Variables for enforcing joint limits
-        self.joint_names = self.urdfpy_robot.actuated_joint_names
+        self.joint_names = self.robot_model.get_joint_names()
         self.joint_lim_dicts = self.robot_model.get_joint_limits()
         self.state_upper_bounds = torch.zeros(self.d_state, device=self.device, dtype=self.float_dtype)
         self.state_lower_bounds = torch.zeros(self.d_state, device=self.device, dtype=self.float_dtype)
@@ -113,6 +112,15 @@ class URDFKinematicModel(DynamicsModelBase):
         self.action_order = 0
         self._integrate_matrix_nth = build_int_matrix(self.num_traj_points, order=self.action_order, device=self.device, dtype=self.float_dtype, traj_dt=self.traj_dt)
         self._nth_traj_dt = torch.pow(self.traj_dt, self.action_order)
+        self._position_sensitivity = None
+
+    @property
+    def urdfpy_robot(self):
+        # only for visualization, loaded on first use:
+        if(self._urdfpy_robot is None):
+            from urdfpy import URDF
+            self._urdfpy_robot = URDF.load(self.urdf_path)
+        return self._urdfpy_robot
 
     def get_next_state(self, curr_state: torch.Tensor, act:torch.Tensor, dt):
         """ Does a single step from the current state
@@ -170,6 +178,74 @@ class URDFKinematicModel(DynamicsModelBase):
         
         
     
+    def get_position_seq(self, start_state: torch.Tensor, act_seq: torch.Tensor) -> torch.Tensor:
+        """Joint positions [batch, horizon, n_dofs] reached by act_seq from start_state [1, 3 * n_dofs].
+        Unlike rollout_open_loop, the batch size is free and the rollout buffers are not touched.
+        """
+        act_seq = act_seq.to(**self.tensor_args)
+        state_seq = torch.zeros((act_seq.shape[0], self.num_traj_points, self.d_state), **self.tensor_args)
+        state_seq = self.step_fn(start_state.to(**self.tensor_args), self.integrate_action(act_seq), state_seq,
+                                 self._dt_h, self.n_dofs, self._integrate_matrix, self._fd_matrix)
+        return state_seq[:, :, :self.n_dofs]
+
+    def get_position_sensitivity(self) -> torch.Tensor:
+        """Jacobian of the joint positions w.r.t. the actions along the horizon [horizon, horizon].
+        The integration is linear and decoupled across joints, so it is the same for every dof.
+        """
+        if(self._position_sensitivity is None):
+            order = {'pos': 0, 'vel': 1, 'acc': 2, 'jerk': 3}[self.control_space]
+            step = torch.matmul(self._integrate_matrix, torch.diag(self._dt_h))
+            sensitivity = self._integrate_matrix_nth.clone()
+            for _ in range(order):
+                sensitivity = torch.matmul(step, sensitivity)
+            self._position_sensitivity = sensitivity
+        return self._position_sensitivity
+
+    def project_actions(self, start_state: torch.Tensor, act_seq: torch.Tensor,
+                        act_lows: torch.Tensor, act_highs: torch.Tensor) -> torch.Tensor:
+        """Squashes act_seq [batch, horizon, d_act] step by step into the range that keeps the rollout
+        from start_state within the joint position and velocity limits, and within [act_lows, act_highs].
+        In acceleration control, position limits are kept with a braking bound on the velocity: the
+        joint can always stop before its limit by decelerating at the action bound. When the limits
+        can't all hold (e.g. the start state violates them), the action bounds win.
+        Other control spaces than acc and vel return act_seq unchanged.
+        """
+        if(self.control_space not in ['acc', 'vel']):
+            return act_seq
+        n = self.n_dofs
+        start_state = start_state.to(**self.tensor_args).view(1, -1)
+        act_seq = act_seq.to(**self.tensor_args)
+        q = start_state[:, :n]
+        qd = start_state[:, n:2 * n]
+        q_lo, q_hi = self.state_lower_bounds[:n], self.state_upper_bounds[:n]
+        qd_lo, qd_hi = self.state_lower_bounds[n:2 * n], self.state_upper_bounds[n:2 * n]
+        a_max = torch.min(-act_lows, act_highs)
+        out = torch.empty_like(act_seq)
+        for t in range(act_seq.shape[1]):
+            dt = self._dt_h[t]
+            if(self.control_space == 'acc'):
+                # largest velocity after this step that can still stop before the limit: v^2 + 2 a dt v <= 2 a d
+                brake = a_max * dt
+                v_hi = -brake + torch.sqrt(brake * brake + 2.0 * a_max * torch.clamp(q_hi - q, min=0.0))
+                v_lo = brake - torch.sqrt(brake * brake + 2.0 * a_max * torch.clamp(q - q_lo, min=0.0))
+                lo = (torch.max(v_lo, qd_lo) - qd) / dt
+                hi = (torch.min(v_hi, qd_hi) - qd) / dt
+            else:
+                lo = torch.max((q_lo - q) / dt, qd_lo)
+                hi = torch.min((q_hi - q) / dt, qd_hi)
+            mid = 0.5 * (lo + hi)
+            lo, hi = torch.where(lo > hi, mid, lo), torch.where(lo > hi, mid, hi)
+            lo = torch.min(torch.max(lo, act_lows), act_highs)
+            hi = torch.min(torch.max(hi, act_lows), act_highs)
+            act = torch.max(torch.min(act_seq[:, t], hi), lo)
+            out[:, t] = act
+            if(self.control_space == 'acc'):
+                qd = qd + dt * act
+            else:
+                qd = act
+            q = q + dt * qd
+        return out
+
     def rollout_open_loop(self, start_state: torch.Tensor, act_seq: torch.Tensor,
                           dt=None) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
         # batch_size, horizon, d_act = act_seq.shape
@@ -22,7 +22,6 @@
 # DEALINGS IN THE SOFTWARE.#
 from typing import List, Tuple, Dict, Optional, Any
 import torch
-from urdfpy import URDF
 
 from ...differentiable_robot_model.differentiable_robot_model import DifferentiableRobotModel
 from .model_base import DynamicsModelBase
@@ -47,13 +46,13 @@ class URDFKinematicModelBaseline(DynamicsModelBase):
 
         #self.robot_model.half()
         self.n_dofs = self.robot_model._n_dofs
-        self.urdfpy_robot = URDF.load(urdf_path) #only for visualization
+        self._urdfpy_robot = None
         
         self.d_state = 3 * self.n_dofs + 1
         self.d_action = self.n_dofs
 
         #Variables for enforcing joint limits
-        self.joint_names = self.urdfpy_robot.actuated_joint_names
+        self.joint_names = self.robot_model.get_joint_names()
         self.joint_lim_dicts = self.robot_model.get_joint_limits()
         self.state_upper_bounds = torch.zeros(self.d_state, device=self.device, dtype=self.float_dtype)
         self.state_lower_bounds = torch.zeros(self.d_state, device=self.device, dtype=self.float_dtype)
@@ -121,6 +120,14 @@ class URDFKinematicModelBaseline(DynamicsModelBase):
         self._integrate_matrix_nth = build_int_matrix(self.num_traj_points, order=self.action_order, device=self.device, dtype=self.float_dtype, traj_dt=self.traj_dt)
         self._nth_traj_dt = torch.pow(self.traj_dt, self.action_order)
         
+    @property
+    def urdfpy_robot(self):
+        # only for visualization, loaded on first use:
+        if(self._urdfpy_robot is None):
+            from urdfpy import URDF
+            self._urdfpy_robot = URDF.load(self.urdf_path)
+        return self._urdfpy_robot
+
     def get_next_state(self, curr_state: torch.Tensor, act:torch.Tensor, dt):
         """ Does a single step from the current state
         Args:
@@ -31,8 +31,9 @@ from ..model import URDFKinematicModel
 from ...util_file import join_path, get_assets_path
 from ...differentiable_robot_model.coordinate_transform import matrix_to_quaternion, quaternion_to_matrix
 from ...mpc.model.integration_utils import build_fd_matrix
-from ...mpc.rollout.rollout_base import RolloutBase
+from ...mpc.rollout.rollout_base import RolloutBase, rollout_batch_size
 from ..cost.robot_self_collision_cost import RobotSelfCollisionCost
+from ..cost.cost_graph import CostGraph
 
 class ArmBase(RolloutBase):
     """
@@ -57,7 +58,7 @@ class ArmBase(RolloutBase):
         #Create the dynamical system used for rollouts
         self.dynamics_model = URDFKinematicModel(join_path(assets_path,exp_params['model']['urdf_path']),
                                                  dt=exp_params['model']['dt'],
-                                                 batch_size=mppi_params['num_particles'],
+                                                 batch_size=rollout_batch_size(mppi_params),
                                                  horizon=dynamics_horizon,
                                                  tensor_args=self.tensor_args,
                                                  ee_link_name=exp_params['model']['ee_link_name'],
@@ -136,79 +137,95 @@ class ArmBase(RolloutBase):
 
         self.link_pos_seq = torch.zeros((1, 1, len(self.dynamics_model.link_names), 3), **self.tensor_args)
         self.link_rot_seq = torch.zeros((1, 1, len(self.dynamics_model.link_names), 3, 3), **self.tensor_args)
-    def cost_fn(self, state_dict, action_batch, no_coll=False, horizon_cost=True):
-        
-        ee_pos_batch, ee_rot_batch = state_dict['ee_pos_seq'], state_dict['ee_rot_seq']
-        state_batch = state_dict['state_seq']
-        lin_jac_batch, ang_jac_batch = state_dict['lin_jac_seq'], state_dict['ang_jac_seq']
-        link_pos_batch, link_rot_batch = state_dict['link_pos_seq'], state_dict['link_rot_seq']
-        prev_state = state_dict['prev_state_seq']
-        prev_state_tstep = state_dict['prev_state_seq'][:,-1]
-        
-        retract_state = self.retract_state
-        
-        
-        
-        J_full = torch.cat((lin_jac_batch, ang_jac_batch), dim=-2)
-        
-
-        #null-space cost
-        #if self.exp_params['cost']['null_space']['weight'] > 0:
-        null_disp_cost = self.null_cost.forward(state_batch[:,:,0:self.n_dofs] -
-                                                retract_state[:,0:self.n_dofs],
-                                                J_full,
-                                                proj_type='identity',
-                                                dist_type='squared_l2')
-        cost = null_disp_cost
-
-        if(no_coll == True and horizon_cost == False):
-            return cost
-        if(self.exp_params['cost']['manipulability']['weight'] > 0.0):
-            cost += self.manipulability_cost.forward(J_full)
-        
-        
-        if(horizon_cost):
-            if self.exp_params['cost']['stop_cost']['weight'] > 0:
-                cost += self.stop_cost.forward(state_batch[:, :, self.n_dofs:self.n_dofs * 2])
-
-            if self.exp_params['cost']['stop_cost_acc']['weight'] > 0:
-                cost += self.stop_cost_acc.forward(state_batch[:, :, self.n_dofs*2 :self.n_dofs * 3])
 
-            if self.exp_params['cost']['smooth']['weight'] > 0:
-                order = self.exp_params['cost']['smooth']['order']
-                prev_dt = (self.fd_matrix @ prev_state_tstep)[-order:]
-                n_mul = 1
-                state = state_batch[:,:, self.n_dofs * n_mul:self.n_dofs * (n_mul+1)]
-                p_state = prev_state[-order:,self.n_dofs * n_mul: self.n_dofs * (n_mul+1)].unsqueeze(0)
-                p_state = p_state.expand(state.shape[0], -1, -1)
-                state_buffer = torch.cat((p_state, state), dim=1)
-                traj_dt = torch.cat((prev_dt, self.traj_dt))
-                cost += self.smooth_cost.forward(state_buffer, traj_dt)
-
-
-        if self.exp_params['cost']['state_bound']['weight'] > 0:
-            # compute collision cost:
-            cost += self.bound_cost.forward(state_batch[:,:,:self.n_dofs * 3])
-
-        if self.exp_params['cost']['ee_vel']['weight'] > 0:
-            cost += self.ee_vel_cost.forward(state_batch, lin_jac_batch)
+        self.smooth_order = self.exp_params['cost']['smooth']['order']
+        self.cost_graph = self._build_cost_graph()
 
+    def _build_cost_graph(self):
+        """Resolves the active cost terms once from the config, see :class:`.cost.cost_graph.CostGraph`.
+        Terms are grouped so that cost_fn can disable collision and horizon terms per call.
+        """
+        cost_params = self.exp_params['cost']
+        n = self.n_dofs
+        graph = CostGraph(self.tensor_args, profile=self.exp_params.get('profile_cost_terms', False))
+
+        graph.add_term('null_space', self._null_space_residual, 'base',
+                       self.null_cost.weight, self.null_cost.proj_gaussian)
+        if(cost_params['manipulability']['weight'] > 0.0):
+            graph.add_term('manipulability', lambda ctx: self.manipulability_cost.residual(ctx['J_full']),
+                           'task', self.manipulability_cost.weight)
+        if(cost_params['stop_cost']['weight'] > 0):
+            graph.add_term('stop_cost', lambda ctx: self.stop_cost.residual(ctx['state_seq'][:, :, n:n * 2]),
+                           'horizon', self.stop_cost.weight, self.stop_cost.proj_gaussian)
+        if(cost_params['stop_cost_acc']['weight'] > 0):
+            graph.add_term('stop_cost_acc', lambda ctx: self.stop_cost_acc.residual(ctx['state_seq'][:, :, n * 2:n * 3]),
+                           'horizon', self.stop_cost_acc.weight, self.stop_cost_acc.proj_gaussian)
+        if(cost_params['smooth']['weight'] > 0):
+            graph.add_term('smooth', self._smooth_residual, 'horizon', self.smooth_cost.weight)
+        if(cost_params['state_bound']['weight'] > 0):
+            graph.add_term('state_bound', lambda ctx: self.bound_cost.residual(ctx['state_seq'][:, :, :n * 3]),
+                           'task', self.bound_cost.weight, self.bound_cost.proj_gaussian)
+        if(cost_params['ee_vel']['weight'] > 0):
+            graph.add_term('ee_vel', lambda ctx: self.ee_vel_cost.residual(ctx['state_seq'], ctx['lin_jac_seq']),
+                           'task', self.ee_vel_cost.weight, self.ee_vel_cost.gaussian_projection)
+
+        if(cost_params['robot_self_collision']['weight'] > 0):
+            graph.add_term('robot_self_collision',
+                           lambda ctx: self.robot_self_collision_cost.residual(ctx['state_seq'][:, :, :n],
+                                                                               ctx['link_pos_seq'], ctx['link_rot_seq']),
+                           'coll', self.robot_self_collision_cost.weight, self.robot_self_collision_cost.proj_gaussian)
+        if(cost_params['primitive_collision']['weight'] > 0):
+            graph.add_term('primitive_collision',
+                           lambda ctx: self.primitive_collision_cost.residual(ctx['link_pos_seq'], ctx['link_rot_seq']),
+                           'coll', self.primitive_collision_cost.weight)
+        if(cost_params['voxel_collision']['weight'] > 0):
+            graph.add_term('voxel_collision',
+                           lambda ctx: self.voxel_collision_cost.forward(ctx['link_pos_seq'], ctx['link_rot_seq']),
+                           'coll')
+        return graph
+
+    def _null_space_residual(self, ctx):
+        return self.null_cost.residual(ctx['state_seq'][:, :, 0:self.n_dofs] - self.retract_state[:, 0:self.n_dofs],
+                                       ctx['J_full'], proj_type='identity', dist_type='squared_l2')
+
+    def _smooth_residual(self, ctx):
+        order = self.smooth_order
+        prev_state = ctx['prev_state_seq']
+        prev_dt = (self.fd_matrix @ prev_state[:,-1])[-order:]
+        n_mul = 1
+        state = ctx['state_seq'][:,:, self.n_dofs * n_mul:self.n_dofs * (n_mul+1)]
+        p_state = prev_state[-order:,self.n_dofs * n_mul: self.n_dofs * (n_mul+1)].unsqueeze(0)
+        p_state = p_state.expand(state.shape[0], -1, -1)
+        state_buffer = torch.cat((p_state, state), dim=1)
+        traj_dt = torch.cat((prev_dt, self.traj_dt))
+        return self.smooth_cost.residual(state_buffer, traj_dt)
+
+    def _cost_context(self, state_dict):
+        ctx = dict(state_dict)
+        ctx['J_full'] = torch.cat((state_dict['lin_jac_seq'], state_dict['ang_jac_seq']), dim=-2)
+        return ctx
+
+    def _cost_groups(self, no_coll=False, horizon_cost=True):
+        if(no_coll and not horizon_cost):
+            return ('base',)
+        groups = ('base', 'task')
+        if(horizon_cost):
+            groups = groups + ('horizon',)
+        if(not no_coll):
+            groups = groups + ('coll',)
+        return groups
 
+    def cost_fn(self, state_dict, action_batch, no_coll=False, horizon_cost=True):
+        ctx = self._cost_context(state_dict)
+        return self.cost_graph(ctx, self._cost_groups(no_coll, horizon_cost))
 
-        if(not no_coll):
-            if self.exp_params['cost']['robot_self_collision']['weight'] > 0:
-                #coll_cost = self.robot_self_collision_cost.forward(link_pos_batch, link_rot_batch)
-                coll_cost = self.robot_self_collision_cost.forward(state_batch[:,:,:self.n_dofs])
-                cost += coll_cost
-            if self.exp_params['cost']['primitive_collision']['weight'] > 0:
-                coll_cost = self.primitive_collision_cost.forward(link_pos_batch, link_rot_batch)
-                cost += coll_cost
-            if self.exp_params['cost']['voxel_collision']['weight'] > 0:
-                coll_cost = self.voxel_collision_cost.forward(link_pos_batch, link_rot_batch)
-                cost += coll_cost
+    def get_cost_term_times(self):
+        """Time [ms] of every cost term in the last cost_fn call, set profile_cost_terms: True in the task config."""
+        return self.cost_graph.get_term_times()
 
-        
-        return cost
+    def get_cost_report(self):
+        """Time, memory and weighted cost of every term in the last cost_fn call, see :func:`CostGraph.get_report`."""
+        return self.cost_graph.get_report()
     
     def rollout_fn(self, start_state, act_seq):
         """
@@ -239,9 +256,46 @@ class ArmBase(RolloutBase):
             #link_rot_seq=link_rot_seq,
             rollout_time=0.0
         )
+        if(self.cost_graph.profile):
+            sim_trajs['cost_terms'] = self.cost_graph.get_report()
         
         return sim_trajs
 
+    def project_actions(self, start_state, act_seq, act_lows, act_highs):
+        """Squashes act_seq into the joint limits along the rollout, see :meth:`URDFKinematicModel.project_actions`."""
+        n = self.n_dofs
+        start_state = start_state.to(**self.tensor_args).view(1, -1)[:, :n * 3]
+        return self.dynamics_model.project_actions(start_state, act_seq, act_lows, act_highs)
+
+    def cost_gradient(self, start_state, act_seq):
+        """Gradient of the primitive collision cost w.r.t. act_seq [batch, horizon, d_act]. The sdf
+        gradient at the link spheres is mapped to joint positions through the link jacobians, and to
+        the actions through the linear integration of the dynamics model. Discounting is ignored.
+        Unlike rollout_fn, the previous state buffer of the dynamics model is not updated.
+        """
+        if(self.exp_params['cost']['primitive_collision']['weight'] <= 0):
+            return None
+        n = self.n_dofs
+        start_state = start_state.to(**self.tensor_args).view(1, -1)[:, :n * 3]
+        batch_size, horizon = act_seq.shape[0], act_seq.shape[1]
+        q = self.dynamics_model.get_position_seq(start_state, act_seq).reshape(batch_size * horizon, n)
+
+        robot_model = self.dynamics_model.robot_model
+        robot_model.compute_forward_kinematics(q, torch.zeros_like(q), self.exp_params['model']['ee_link_name'])
+        link_poses = [robot_model.get_link_pose(k) for k in self.dynamics_model.link_names]
+        link_pos = torch.stack([pos for pos, _ in link_poses], dim=1)
+        link_rot = torch.stack([rot for _, rot in link_poses], dim=1)
+
+        res = self.primitive_collision_cost.gradient(link_pos, link_rot)
+        if(res is None):
+            return None
+        centers, grad = res
+        q_grad = torch.zeros_like(q)
+        for ki, k in enumerate(self.dynamics_model.link_names):
+            q_grad += robot_model.apply_link_jacobian_transpose(k, centers[:, ki], grad[:, ki])
+        q_grad = q_grad.view(batch_size, horizon, n)
+        return torch.matmul(self.dynamics_model.get_position_sensitivity().T, q_grad)
+
     def update_params(self, retract_state=None):
         """
         Updates the goal targets for the cost functions.
@@ -51,39 +51,50 @@ class ArmReacher(ArmBase):
 
         self.goal_cost = PoseCost(**exp_params["cost"]["goal_pose"], tensor_args=self.tensor_args)
 
-    def cost_fn(self, state_dict, action_batch, no_coll=False, horizon_cost=True, return_dist=False):
-
-        cost = super(ArmReacher, self).cost_fn(state_dict, action_batch, no_coll, horizon_cost)
-        ee_pos_batch, ee_rot_batch = state_dict["ee_pos_seq"], state_dict["ee_rot_seq"]
-
-        state_batch = state_dict["state_seq"]
-        goal_ee_pos = self.goal_ee_pos
-        goal_ee_rot = self.goal_ee_rot
-        retract_state = self.retract_state
-        goal_state = self.goal_state
+        # goal terms are appended to the cost graph built by ArmBase:
+        n = self.n_dofs
+        self.cost_graph.add_term("goal_pose", self._goal_pose_cost, "base")
+        if self.exp_params["cost"]["joint_l2"]["weight"] > 0.0:
+            self.cost_graph.add_term("joint_l2", self._joint_l2_cost, "base")
+        # velocity terms near the goal, disabled when only distances are requested:
+        if self.exp_params["cost"]["zero_acc"]["weight"] > 0:
+            self.cost_graph.add_term(
+                "zero_acc",
+                lambda ctx: self.zero_acc_cost.residual(ctx["state_seq"][:, :, n * 2 : n * 3], goal_dist=ctx["goal_dist"]),
+                "goal",
+                self.zero_acc_cost.weight,
+                self.zero_acc_cost.proj_gaussian,
+            )
+        if self.exp_params["cost"]["zero_vel"]["weight"] > 0:
+            self.cost_graph.add_term(
+                "zero_vel",
+                lambda ctx: self.zero_vel_cost.residual(ctx["state_seq"][:, :, n : n * 2], goal_dist=ctx["goal_dist"]),
+                "goal",
+                self.zero_vel_cost.weight,
+                self.zero_vel_cost.proj_gaussian,
+            )
 
-        goal_cost, rot_err_norm, goal_dist = self.goal_cost.forward(
-            ee_pos_batch, ee_rot_batch, goal_ee_pos, goal_ee_rot
+    def _goal_pose_cost(self, ctx):
+        goal_cost, ctx["rot_err_norm"], ctx["goal_dist"] = self.goal_cost.forward(
+            ctx["ee_pos_seq"], ctx["ee_rot_seq"], self.goal_ee_pos, self.goal_ee_rot
         )
+        return goal_cost
 
-        cost += goal_cost
+    def _joint_l2_cost(self, ctx):
+        if self.goal_state is None:
+            return None
+        disp_vec = ctx["state_seq"][:, :, 0 : self.n_dofs] - self.goal_state[:, 0 : self.n_dofs]
+        return self.dist_cost.forward(disp_vec)
 
-        # joint l2 cost
-        if self.exp_params["cost"]["joint_l2"]["weight"] > 0.0 and goal_state is not None:
-            disp_vec = state_batch[:, :, 0 : self.n_dofs] - goal_state[:, 0 : self.n_dofs]
-            cost += self.dist_cost.forward(disp_vec)
+    def cost_fn(self, state_dict, action_batch, no_coll=False, horizon_cost=True, return_dist=False):
+        ctx = self._cost_context(state_dict)
+        groups = self._cost_groups(no_coll, horizon_cost)
+        if not return_dist:
+            groups = groups + ("goal",)
+        cost = self.cost_graph(ctx, groups)
 
         if return_dist:
-            return cost, rot_err_norm, goal_dist
-
-        if self.exp_params["cost"]["zero_acc"]["weight"] > 0:
-            cost += self.zero_acc_cost.forward(
-                state_batch[:, :, self.n_dofs * 2 : self.n_dofs * 3], goal_dist=goal_dist
-            )
-
-        if self.exp_params["cost"]["zero_vel"]["weight"] > 0:
-            cost += self.zero_vel_cost.forward(state_batch[:, :, self.n_dofs : self.n_dofs * 2], goal_dist=goal_dist)
-
+            return cost, ctx["rot_err_norm"], ctx["goal_dist"]
         return cost
 
     def update_params(self, retract_state=None, goal_state=None, goal_ee_pos=None, goal_ee_rot=None, goal_ee_quat=None):
@@ -24,6 +24,14 @@
 #import torch
 
 
+def rollout_batch_size(mppi_params):
+    # with chunked rollouts the model only holds one chunk of particles:
+    chunk_size = mppi_params.get('chunk_size', None)
+    if(chunk_size and chunk_size < mppi_params['num_particles']):
+        return chunk_size
+    return mppi_params['num_particles']
+
+
 class RolloutBase:
     def __init__(self):
         pass
@@ -33,6 +41,12 @@ class RolloutBase:
         pass
     def current_cost(self, current_state):
         pass
+    def project_actions(self, state, act, act_lows, act_highs):
+        """Feasible act [batch, horizon, d_act] from state, by default only within the action bounds."""
+        return act
+    def cost_gradient(self, state, act):
+        """Cheap gradient of the cost w.r.t. act [batch, horizon, d_act], None when not available."""
+        return None
     def update_params(self):
         pass
 
@@ -0,0 +1,186 @@
+#
+# MIT License
+#
+# Copyright (c) 2020-2021 NVIDIA CORPORATION.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.#
+import copy
+import time
+
+import torch
+import torch.multiprocessing as mp
+
+from .rollout_base import rollout_batch_size
+
+
+def _rollout_worker(rollout_class, exp_params, world_params, tensor_args, start, end, shard_size, num_threads,
+                    visual_traj, state_buf, act_buf, cost_buf, vis_buf, conn):
+    torch.set_num_threads(num_threads)
+    exp_params = copy.deepcopy(exp_params)
+    exp_params['mppi']['num_particles'] = shard_size
+    exp_params['mppi']['chunk_size'] = 0
+    rollout_fn = rollout_class(exp_params=exp_params, tensor_args=tensor_args, world_params=world_params)
+    n = end - start
+    conn.send('ready')
+    while True:
+        cmd, kwargs = conn.recv()
+        if(cmd == 'rollout'):
+            act_seq = act_buf[start:end]
+            if(n < shard_size):
+                # the model has a fixed batch size, pad the last shard:
+                act_seq = torch.cat((act_seq, act_seq[:1].expand(shard_size - n, -1, -1)), dim=0)
+            with torch.no_grad():
+                trajectories = rollout_fn(state_buf, act_seq)
+            cost_buf[start:end] = trajectories['costs'][:n]
+            vis_buf[start:end] = trajectories[visual_traj][:n]
+            conn.send('done')
+        elif(cmd == 'update_params'):
+            rollout_fn.update_params(**kwargs)
+            conn.send('done')
+        elif(cmd == 'close'):
+            break
+    conn.close()
+
+
+class ShardedRollout(object):
+    """Rollout function that shards the particles across persistent worker processes on cpu.
+
+    Every worker holds its own replica of the rollout function for a contiguous slice of the
+    particles. Start state, actions, costs and the visualized trajectory move through shared memory
+    tensors, so the controller only runs the weight and distribution update. Attributes that are not
+    about rolling out (dynamics_model, current_cost, ...) are served by the local rollout function.
+
+    The workers are started on the first rollout, which also happens after unpickling, e.g. in the
+    optimization process of ControlProcess, which is not daemonic for this reason. With chunked MPPI
+    rollouts, every chunk is sharded.
+    """
+    def __init__(self, rollout_fn, exp_params, world_params=None, num_workers=2, threads_per_worker=1,
+                 visual_traj='ee_pos_seq', tensor_args={'device':"cpu", 'dtype':torch.float32}):
+        """
+        Args:
+            rollout_fn: local rollout function, its class is instantiated in every worker
+            exp_params (dict): parameters the rollout function was built with
+            world_params (dict): collision world of the rollout function
+            num_workers (int): worker processes
+            threads_per_worker (int): torch threads in each worker
+            visual_traj (str): trajectory returned for visualization, ee_pos_seq or state_seq
+        """
+        if(torch.device(tensor_args['device']).type != 'cpu'):
+            raise ValueError('sharded rollouts need shared cpu memory, got device {}'.format(tensor_args['device']))
+        self.local = rollout_fn
+        # the mppi section is filled with the controller's objects after this, keep a plain copy:
+        self.exp_params = copy.deepcopy(exp_params)
+        self.world_params = world_params
+        self.num_workers = num_workers
+        self.threads_per_worker = threads_per_worker
+        self.visual_traj = visual_traj
+        self.tensor_args = tensor_args
+        # particles of one rollout call, a chunk when MPPI rolls out in chunks:
+        self.num_particles = rollout_batch_size(exp_params['mppi'])
+        self._workers = None
+        # update_params calls, replayed in order to bring restarted workers to the state of self.local:
+        self._param_calls = []
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for k in ['_workers', '_conns', 'state_buf', 'act_buf', 'cost_buf', 'vis_buf']:
+            state.pop(k, None)
+        state['_workers'] = None
+        return state
+
+    def __getattr__(self, name):
+        # only called for attributes not found on the wrapper:
+        if(name == 'local'):
+            raise AttributeError(name)
+        return getattr(self.local, name)
+
+    def start(self):
+        model = self.local.dynamics_model
+        horizon = model.num_traj_points
+        vis_dim = {'ee_pos_seq': 3, 'state_seq': model.d_state}[self.visual_traj]
+        self.state_buf = torch.zeros(1, model.d_state, **self.tensor_args).share_memory_()
+        self.act_buf = torch.zeros(self.num_particles, horizon, model.d_action, **self.tensor_args).share_memory_()
+        self.cost_buf = torch.zeros(self.num_particles, horizon, **self.tensor_args).share_memory_()
+        self.vis_buf = torch.zeros(self.num_particles, horizon, vis_dim, **self.tensor_args).share_memory_()
+
+        ctx = mp.get_context('spawn')
+        shard_size = (self.num_particles + self.num_workers - 1) // self.num_workers
+        self._workers = []
+        self._conns = []
+        for i in range(self.num_workers):
+            start = i * shard_size
+            end = min(start + shard_size, self.num_particles)
+            parent_conn, child_conn = ctx.Pipe()
+            p = ctx.Process(target=_rollout_worker,
+                            args=(type(self.local), self.exp_params, self.world_params, self.tensor_args,
+                                  start, end, shard_size, self.threads_per_worker, self.visual_traj,
+                                  self.state_buf, self.act_buf, self.cost_buf, self.vis_buf, child_conn))
+            p.daemon = True
+            p.start()
+            self._workers.append(p)
+            self._conns.append(parent_conn)
+        for conn in self._conns:
+            conn.recv()
+        for kwargs in self._param_calls:
+            self._broadcast('update_params', kwargs)
+
+    def _broadcast(self, cmd, kwargs=None):
+        for conn in self._conns:
+            conn.send((cmd, kwargs))
+        for conn in self._conns:
+            conn.recv()
+
+    def rollout_fn(self, start_state, act_seq):
+        if(self._workers is None):
+            self.start()
+        st_time = time.time()
+        if(act_seq.shape[0] != self.num_particles):
+            raise ValueError('sharded rollout holds {} particles, got {}'.format(self.num_particles,
+                                                                               act_seq.shape[0]))
+        self.state_buf.copy_(start_state.view(1, -1)[:, :self.state_buf.shape[1]])
+        self.act_buf.copy_(act_seq)
+        self._broadcast('rollout')
+        sim_trajs = {'actions': act_seq,
+                     'costs': self.cost_buf,
+                     self.visual_traj: self.vis_buf,
+                     'rollout_time': time.time() - st_time}
+        return sim_trajs
+
+    def __call__(self, start_state, act_seq):
+        return self.rollout_fn(start_state, act_seq)
+
+    def update_params(self, **kwargs):
+        self.local.update_params(**kwargs)
+        if(len(self._param_calls) > 0 and self._param_calls[-1].keys() == kwargs.keys()):
+            # overrides the previous call, e.g. a stream of new goals:
+            self._param_calls[-1] = kwargs
+        else:
+            self._param_calls.append(kwargs)
+        if(self._workers is not None):
+            self._broadcast('update_params', kwargs)
+        return True
+
+    def close(self):
+        if(self._workers is None):
+            return
+        for conn in self._conns:
+            conn.send(('close', None))
+        for p in self._workers:
+            p.join()
+        self._workers = None
@@ -31,6 +31,7 @@ from ...mpc.cost.image_collision_cost import ImageCollisionCost
 from ...mpc.cost.bound_cost import BoundCost
 from ...mpc.model.integration_utils import build_fd_matrix, tensor_linspace
 from ...util_file import join_path, get_assets_path
+from .rollout_base import rollout_batch_size
 
 
 class SimpleReacher(object):
@@ -51,7 +52,7 @@ class SimpleReacher(object):
         self.dynamics_model = HolonomicModel(dt=exp_params['model']['dt'],
                                              dt_traj_params=exp_params['model']['dt_traj_params'],
                                              horizon=mppi_params['horizon'],
-                                             batch_size=mppi_params['num_particles'],
+                                             batch_size=rollout_batch_size(mppi_params),
                                              tensor_args=self.tensor_args,
                                              control_space=exp_params['control_space'])
 
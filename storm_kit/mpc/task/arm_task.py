@@ -20,15 +20,19 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 # DEALINGS IN THE SOFTWARE.#
+import os
+
 import numpy as np
 import torch
 import yaml
 
 from ...mpc.control import MPPI
+from ...mpc.control.trajectory_library import TrajectoryLibrary
 from ...mpc.rollout.arm_reacher import ArmBase
+from ...mpc.rollout.sharded_rollout import ShardedRollout
 from ...mpc.utils.mpc_process_wrapper import ControlProcess
 from ...mpc.utils.state_filter import JointStateFilter
-from ...util_file import get_assets_path, get_gym_configs_path
+from ...util_file import get_assets_path, get_cache_path, get_gym_configs_path
 from ...util_file import get_mpc_configs_path as mpc_configs_path
 from ...util_file import join_path, load_yaml
 from .task_base import BaseTask
@@ -52,6 +56,39 @@ class ArmTask(BaseTask):
         rollout_fn = ArmBase(**kwargs)
         return rollout_fn
 
+    def init_trajectory_library(self, controller, library_params, dynamics_model):
+        path = library_params["file"]
+        if not os.path.isabs(path):
+            path = join_path(join_path(get_cache_path(), "trajectory_library"), path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        library = TrajectoryLibrary(
+            dynamics_model.n_dofs,
+            library_params["goal_dim"],
+            controller.horizon,
+            controller.d_action,
+            capacity=library_params["capacity"],
+            goal_weight=library_params["goal_weight"],
+            path=path,
+            tensor_args=self.tensor_args,
+        )
+        controller.set_trajectory_library(
+            library,
+            k=library_params["k"],
+            max_dist=library_params["max_dist"],
+            settle_iters=library_params["settle_iters"],
+            record_every=library_params["record_every"],
+            goal_change_dist=library_params["goal_change_dist"],
+        )
+        return library
+
+    def load_exp_params(self, task_file):
+        """Loads the mpc task parameters, override to modify them before the controller is built."""
+        mpc_yml_file = join_path(mpc_configs_path(), task_file)
+
+        with open(mpc_yml_file) as file:
+            exp_params = yaml.load(file, Loader=yaml.FullLoader)
+        return exp_params
+
     def init_mppi(self, task_file, robot_file, collision_file):
         robot_yml = join_path(get_gym_configs_path(), robot_file)
 
@@ -62,15 +99,17 @@ class ArmTask(BaseTask):
         with open(world_yml) as file:
             world_params = yaml.load(file, Loader=yaml.FullLoader)
 
-        mpc_yml_file = join_path(mpc_configs_path(), task_file)
-
-        with open(mpc_yml_file) as file:
-            exp_params = yaml.load(file, Loader=yaml.FullLoader)
+        exp_params = self.load_exp_params(task_file)
         exp_params["robot_params"] = exp_params["model"]  # robot_params
 
         rollout_fn = self.get_rollout_fn(exp_params=exp_params, tensor_args=self.tensor_args, world_params=world_params)
 
         mppi_params = exp_params["mppi"]
+        num_workers = mppi_params.pop("num_workers", 0)
+        if num_workers > 1:
+            rollout_fn = ShardedRollout(rollout_fn, exp_params, world_params, num_workers=num_workers,
+                                        visual_traj=mppi_params.get("visual_traj", "ee_pos_seq"),
+                                        tensor_args=self.tensor_args)
         dynamics_model = rollout_fn.dynamics_model
         mppi_params["d_action"] = dynamics_model.d_action
         mppi_params["action_lows"] = -exp_params["model"]["max_acc"] * torch.ones(
@@ -89,5 +128,8 @@ class ArmTask(BaseTask):
         mppi_params["rollout_fn"] = rollout_fn
         mppi_params["tensor_args"] = self.tensor_args
         controller = MPPI(**mppi_params)
+        library_params = exp_params.get("trajectory_library", None)
+        if library_params is not None and library_params["enabled"]:
+            self.init_trajectory_library(controller, library_params, dynamics_model)
         self.exp_params = exp_params
         return controller
@@ -24,6 +24,9 @@
 import numpy as np
 import torch
 
+from ...mpc.control.trajectory_library import goal_key_from_rollout
+from ...mpc.rollout.sharded_rollout import ShardedRollout
+from ...mpc.utils.command_streamer import CommandStreamer
 from ...mpc.utils.mpc_process_wrapper import ControlProcess
 from ...mpc.utils.state_filter import JointStateFilter
 
@@ -32,6 +35,8 @@ class BaseTask:
     def __init__(self, tensor_args={"device": "cpu", "dtype": torch.float32}):
         self.tensor_args = tensor_args
         self.prev_qdd_des = None
+        self.streamer = None
+        self._streamed_command = None
 
     def init_aux(self):
         self.state_filter = JointStateFilter(
@@ -45,6 +50,23 @@ class BaseTask:
         self.n_dofs = self.controller.rollout_fn.dynamics_model.n_dofs
         self.zero_acc = np.zeros(self.n_dofs)
 
+    def start_streaming(self, servo_dt=0.001, blend_time=0.02, callback=None, clock=None):
+        """Streams servo rate setpoints of every new mpc trajectory from a separate thread.
+
+        Setpoints are read with self.streamer.get_setpoint() or pushed to callback(t, q, qd). Only
+        acceleration control spaces can be streamed. clock returns the current time in the time base
+        of the t_step given to get_command, it is required when t_step is not wall clock time (e.g.
+        simulation time), see :class:`CommandStreamer`.
+        """
+        control_space = self.controller.rollout_fn.dynamics_model.control_space
+        if control_space != "acc":
+            raise ValueError("only acc control spaces can be streamed, got {}".format(control_space))
+        self.streamer = CommandStreamer(self.n_dofs, servo_dt=servo_dt, blend_time=blend_time,
+                                        max_knots=len(self.control_process.traj_tstep), callback=callback,
+                                        clock=clock)
+        self.streamer.start()
+        return self.streamer
+
     def get_rollout_fn(self, **kwargs):
         raise NotImplementedError
 
@@ -53,6 +75,7 @@ class BaseTask:
 
     def update_params(self, **kwargs):
         self.controller.rollout_fn.update_params(**kwargs)
+        self.controller.set_goal(goal_key_from_rollout(self.controller.rollout_fn))
         self.control_process.update_params(**kwargs)
         return True
 
@@ -77,6 +100,10 @@ class BaseTask:
 
         qdd_des = next_command
         self.prev_qdd_des = qdd_des
+        if self.streamer is not None and self.control_process.command is not self._streamed_command:
+            # val holds the time of each action of the truncated trajectory:
+            self._streamed_command = self.control_process.command
+            self.streamer.update_trajectory(t_step, filt_state["position"], filt_state["velocity"], best_action, val)
         cmd_des = self.state_filter.integrate_acc(qdd_des)
 
         return cmd_des
@@ -103,7 +130,16 @@ class BaseTask:
         return self.control_process.opt_dt
 
     def close(self):
+        if self.streamer is not None:
+            self.streamer.close()
         self.control_process.close()
+        if isinstance(self.controller.rollout_fn, ShardedRollout):
+            self.controller.rollout_fn.close()
+        # inserts of get_command(WAIT=True), the optimization process saved its own on close. When both
+        # optimized, the file keeps this copy:
+        library = self.controller.traj_library
+        if library is not None and library.path is not None and library.n_unsaved > 0:
+            library.save()
 
     @property
     def top_trajs(self):
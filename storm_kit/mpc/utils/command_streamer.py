@@ -0,0 +1,214 @@
+#
+# MIT License
+#
+# Copyright (c) 2020-2021 NVIDIA CORPORATION.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.#
+import threading
+import time
+
+import numpy as np
+
+
+class CommandStreamer(object):
+    """Streams servo rate position/velocity setpoints from mpc acceleration trajectories.
+
+    Every trajectory from the mpc is integrated on its (non-uniform) time grid to knot positions and
+    velocities, which are interpolated with cubic hermite splines. When a new trajectory arrives, the
+    setpoint blends from the previous spline to the new one over blend_time, so the servo loop does not
+    see a jump at the switch. A thread evaluates the spline every servo_dt and either calls callback or
+    keeps the latest setpoint for get_setpoint, so the servo rate does not depend on the mpc rate.
+
+    Trajectories are stored in a ring of three preallocated slots (active, blending out, being written).
+    """
+    def __init__(self, n_dofs, servo_dt=0.001, blend_time=0.02, max_knots=128, callback=None, clock=None):
+        """
+        Args:
+            n_dofs (int): joints
+            servo_dt (float): period of the streaming thread [s]
+            blend_time (float): duration of the blend at trajectory switches [s]
+            max_knots (int): longest trajectory that can be streamed
+            callback (callable): called as callback(t, q, qd) from the streaming thread every tick
+            clock (callable): current time in the mpc's time base, i.e. the time of the t_start given to
+                update_trajectory. Needed when that time is not wall clock time, e.g. simulation time.
+                Defaults to None: wall clock time aligned with the first trajectory's t_start.
+        """
+        self.n_dofs = n_dofs
+        self.servo_dt = servo_dt
+        self.blend_time = blend_time
+        self.max_knots = max_knots
+        self.callback = callback
+        self.clock = clock
+
+        self._knot_t = np.zeros((3, max_knots + 1))
+        self._knot_q = np.zeros((3, max_knots + 1, n_dofs))
+        self._knot_qd = np.zeros((3, max_knots + 1, n_dofs))
+        self._n_knots = [0, 0, 0]
+        self._active = -1
+        self._prev = -1
+        self._blend_start = -np.inf
+        self._t_offset = None
+
+        self._q = np.zeros(n_dofs)
+        self._qd = np.zeros(n_dofs)
+        self._q_blend = np.zeros(n_dofs)
+        self._qd_blend = np.zeros(n_dofs)
+        self.q_des = np.zeros(n_dofs)
+        self.qd_des = np.zeros(n_dofs)
+        self.t_des = None
+        self.overruns = 0
+
+        self._lock = threading.Lock()
+        self._done = False
+        self._thread = None
+
+    def update_trajectory(self, t_start, q0, qd0, acc_seq, tstep):
+        """Sets a new trajectory, blending from the current one.
+
+        Args:
+            t_start (float): time of q0, qd0 in the mpc's time
+            q0 (np.ndarray): [n_dofs] joint positions at t_start
+            qd0 (np.ndarray): [n_dofs] joint velocities at t_start
+            acc_seq (np.ndarray): [k, n_dofs] accelerations, acc_seq[i] is applied until tstep[i]
+            tstep (np.ndarray): [k] end times of the accelerations, increasing and after t_start
+        """
+        acc_seq = np.asarray(acc_seq)
+        tstep = np.asarray(tstep)
+        k = min(acc_seq.shape[0], self.max_knots)
+        with self._lock:
+            slot = 3 - self._active - self._prev if self._active >= 0 and self._prev >= 0 else (self._active + 1) % 3
+        t = self._knot_t[slot]
+        q = self._knot_q[slot]
+        qd = self._knot_qd[slot]
+
+        # semi-implicit euler on the trajectory's grid, same as the rollout's integration:
+        t[0] = t_start
+        t[1:k + 1] = tstep[:k]
+        dt = np.diff(t[:k + 1])[:, None]
+        q[0] = q0
+        qd[0] = qd0
+        np.cumsum(acc_seq[:k] * dt, axis=0, out=qd[1:k + 1])
+        qd[1:k + 1] += qd0
+        np.cumsum(qd[1:k + 1] * dt, axis=0, out=q[1:k + 1])
+        q[1:k + 1] += q0
+
+        with self._lock:
+            if(self.clock is None and self._t_offset is None):
+                self._t_offset = time.perf_counter() - t_start
+            self._n_knots[slot] = k + 1
+            self._prev = self._active
+            self._active = slot
+            self._blend_start = self._mpc_time()
+
+    def _mpc_time(self):
+        # None until the wall clock is aligned with the mpc:
+        if(self.clock is not None):
+            return self.clock()
+        if(self._t_offset is None):
+            return None
+        return time.perf_counter() - self._t_offset
+
+    def _evaluate_slot(self, slot, t, q_out, qd_out):
+        # cubic hermite interpolation of the knots, holding the last knot after the end:
+        n = self._n_knots[slot]
+        knot_t = self._knot_t[slot]
+        knot_q = self._knot_q[slot]
+        knot_qd = self._knot_qd[slot]
+        if(t >= knot_t[n - 1]):
+            q_out[:] = knot_q[n - 1]
+            qd_out[:] = 0.0
+            return
+        if(t <= knot_t[0]):
+            q_out[:] = knot_q[0]
+            qd_out[:] = knot_qd[0]
+            return
+        i = int(np.searchsorted(knot_t[:n], t, side='right')) - 1
+        h = knot_t[i + 1] - knot_t[i]
+        s = (t - knot_t[i]) / h
+        s2 = s * s
+        s3 = s2 * s
+        q_out[:] = ((2.0 * s3 - 3.0 * s2 + 1.0) * knot_q[i] + (s3 - 2.0 * s2 + s) * h * knot_qd[i] +
+                    (-2.0 * s3 + 3.0 * s2) * knot_q[i + 1] + (s3 - s2) * h * knot_qd[i + 1])
+        qd_out[:] = ((6.0 * s2 - 6.0 * s) / h * (knot_q[i] - knot_q[i + 1]) + (3.0 * s2 - 4.0 * s + 1.0) * knot_qd[i] +
+                     (3.0 * s2 - 2.0 * s) * knot_qd[i + 1])
+
+    def evaluate(self, t, q_out, qd_out):
+        """Writes the setpoint at time t (in the mpc's time) into q_out, qd_out.
+
+        Returns:
+            bool: False if no trajectory was received yet
+        """
+        with self._lock:
+            active, prev, blend_start = self._active, self._prev, self._blend_start
+            if(active < 0):
+                return False
+            self._evaluate_slot(active, t, q_out, qd_out)
+            s = (t - blend_start) / self.blend_time if self.blend_time > 0.0 else 1.0
+            if(prev >= 0 and s < 1.0):
+                s = max(s, 0.0)
+                self._evaluate_slot(prev, t, self._q_blend, self._qd_blend)
+                # smoothstep weight, its rate enters the velocity:
+                w = s * s * (3.0 - 2.0 * s)
+                dw = 6.0 * s * (1.0 - s) / self.blend_time
+                qd_out += (1.0 - w) * (self._qd_blend - qd_out) + dw * (q_out - self._q_blend)
+                q_out += (1.0 - w) * (self._q_blend - q_out)
+        return True
+
+    def get_setpoint(self):
+        """Latest setpoint computed by the streaming thread.
+
+        Returns:
+            tuple: (t, q, qd) copies, t is None before the first trajectory
+        """
+        with self._lock:
+            return self.t_des, self.q_des.copy(), self.qd_des.copy()
+
+    def _run(self):
+        # ticks are paced in wall clock time, setpoints are evaluated in the mpc's time:
+        next_tick = time.perf_counter()
+        while not self._done:
+            t = self._mpc_time()
+            if(t is not None):
+                if(self.evaluate(t, self._q, self._qd)):
+                    with self._lock:
+                        self.q_des[:] = self._q
+                        self.qd_des[:] = self._qd
+                        self.t_des = t
+                    if(self.callback is not None):
+                        self.callback(t, self._q, self._qd)
+            next_tick += self.servo_dt
+            sleep_time = next_tick - time.perf_counter()
+            if(sleep_time > 0.0):
+                time.sleep(sleep_time)
+            else:
+                # missed a tick, restart the schedule instead of bursting to catch up:
+                self.overruns += 1
+                next_tick = time.perf_counter()
+
+    def start(self):
+        self._done = False
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        self._done = True
+        if(self._thread is not None):
+            self._thread.join()
+            self._thread = None
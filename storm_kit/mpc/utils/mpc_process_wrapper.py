@@ -20,6 +20,7 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 # DEALINGS IN THE SOFTWARE.#
+import atexit
 import copy
 import os
 import sys
@@ -34,7 +35,53 @@ import torch
 # import multiprocessing import Queue
 from torch.multiprocessing import Pool, Process, Queue, set_start_method
 
-from ..utils.torch_utils import find_first_idx, find_last_idx
+from ..control.trajectory_library import goal_key_from_rollout
+from ..rollout.sharded_rollout import ShardedRollout
+
+
+def integrate_command_window(curr_state, act_seq, dt, n_dofs, control_space='acc'):
+    """Steps a state through a window of commands in closed form.
+
+    Same as semi-implicit euler steps of dt for every command of act_seq, with the repeated sums
+    written as weighted sums over the window (the rows of the model's integration matrix applied once,
+    twice and three times).
+
+    Args:
+        curr_state (np.ndarray): [3 * n_dofs (+ extra)] position, velocity, acceleration
+        act_seq (np.ndarray): [k, n_dofs] commands applied for dt each
+        dt (float): time per command
+        n_dofs (int): joints
+        control_space (str): order of the commands, one of pos, vel, acc, jerk
+
+    Returns:
+        np.ndarray: state after the window, extra entries of curr_state are kept
+    """
+    next_state = np.array(curr_state, dtype=np.float64)
+    k = act_seq.shape[0]
+    if(k == 0):
+        return next_state
+    act_seq = np.asarray(act_seq, dtype=np.float64)
+    q, qd, qdd = next_state[:n_dofs], next_state[n_dofs:2 * n_dofs], next_state[2 * n_dofs:3 * n_dofs]
+    # remaining steps after each command, i.e. the last row of the repeated integration matrix:
+    w1 = np.arange(k, 0, -1, dtype=np.float64)
+    if(control_space == 'pos'):
+        q_n, qd_n, qdd_n = act_seq[-1], np.zeros(n_dofs), np.zeros(n_dofs)
+    elif(control_space == 'vel'):
+        q_n = q + dt * act_seq.sum(0)
+        qd_n, qdd_n = act_seq[-1], np.zeros(n_dofs)
+    elif(control_space == 'acc'):
+        qd_n = qd + dt * act_seq.sum(0)
+        q_n = q + k * dt * qd + dt ** 2 * (w1 @ act_seq)
+        qdd_n = act_seq[-1]
+    elif(control_space == 'jerk'):
+        w2 = w1 * (w1 + 1) / 2.0
+        qdd_n = qdd + dt * act_seq.sum(0)
+        qd_n = qd + k * dt * qdd + dt ** 2 * (w1 @ act_seq)
+        q_n = q + k * dt * qd + (k * (k + 1) / 2.0) * dt ** 2 * qdd + dt ** 3 * (w2 @ act_seq)
+    else:
+        raise NotImplementedError('control space {} is not supported'.format(control_space))
+    next_state[:n_dofs], next_state[n_dofs:2 * n_dofs], next_state[2 * n_dofs:3 * n_dofs] = q_n, qd_n, qdd_n
+    return next_state
 
 
 class ControlProcess(object):
@@ -58,6 +105,7 @@ class ControlProcess(object):
 
         self.traj_tstep = copy.deepcopy(controller.rollout_fn.dynamics_model._traj_tstep.detach().cpu())
         self.command_tstep = self.traj_tstep
+        self._command_tstep_np = self.command_tstep.numpy()
         self.mpc_dt = 0.0  # None
         self.params = None
         self.top_trajs = None
@@ -72,24 +120,33 @@ class ControlProcess(object):
         self.opt_process = Process(
             target=optimize_process, args=("control_instance.p", self.opt_queue, self.result_queue)
         )
-        self.opt_process.daemon = True
+        # sharded rollout workers are children of the optimization process, a daemonic process can't have any:
+        self.opt_process.daemon = not isinstance(controller.rollout_fn, ShardedRollout)
         self.opt_process.start()
+        if not self.opt_process.daemon:
+            # non daemonic processes are joined at exit, stop it before that:
+            atexit.register(self.close)
         self.controller = controller
         self.control_dt = control_dt
         self.prev_mpc_tstep = 0.0
 
+    def first_command_idx(self, t_step):
+        # index of the first command after t_step, same as find_first_idx without a device sync:
+        return int(np.searchsorted(self._command_tstep_np, t_step, side='right'))
+
+    def set_command_tstep(self, t_step):
+        self.command_tstep = self.traj_tstep + t_step
+        self._command_tstep_np = self.command_tstep.numpy()
+
     def predict_next_state(self, t_step, curr_state):
         # predict next state
         # given current t_step, integrate to t_step+mpc_dt
-        t1_idx = find_first_idx(self.command_tstep, t_step) - 1
-        t2_idx = find_first_idx(self.command_tstep, t_step + self.mpc_dt)  # - 1
+        t1_idx = max(self.first_command_idx(t_step) - 1, 0)
+        t2_idx = self.first_command_idx(t_step + self.mpc_dt)
 
         # integrate from t1->t2
-        for i in range(t1_idx, t2_idx):
-            command = self.command[0][i]
-            curr_state = self.controller.rollout_fn.dynamics_model.get_next_state(curr_state, command, self.mpc_dt)
-
-        return curr_state
+        return integrate_command_window(curr_state, self.command[0][t1_idx:t2_idx], self.mpc_dt, self.n_dofs,
+                                        self.controller.rollout_fn.dynamics_model.control_space)
 
     def get_command_debug(self, t_step, curr_state, debug=False, control_dt=0.01):
         """This function runs the controller in the same process and waits for optimization to  complete before return of a new command
@@ -103,7 +160,7 @@ class ControlProcess(object):
             curr_state = self.predict_next_state(t_step, curr_state)
 
         current_state = np.append(curr_state, t_step + self.mpc_dt)
-        shift_steps = find_first_idx(self.command_tstep, t_step + self.mpc_dt)
+        shift_steps = self.first_command_idx(t_step + self.mpc_dt)
 
         state_tensor = torch.as_tensor(current_state, **self.controller.tensor_args).unsqueeze(0)
 
@@ -111,7 +168,7 @@ class ControlProcess(object):
         command = list(self.controller.optimize(state_tensor, shift_steps=shift_steps))
         mpc_time = time.time() - mpc_time
         command[0] = command[0].cpu().numpy()
-        self.command_tstep = self.traj_tstep + t_step
+        self.set_command_tstep(t_step)
 
         self.opt_dt = mpc_time
         self.mpc_dt = t_step - self.prev_mpc_tstep
@@ -139,7 +196,7 @@ class ControlProcess(object):
 
             # planned command:
 
-            shift_steps = find_first_idx(self.command_tstep, t_step + self.mpc_dt)  # - 1
+            shift_steps = self.first_command_idx(t_step + self.mpc_dt)
             if shift_steps < 0:
                 shift_steps = 0
 
@@ -164,7 +221,7 @@ class ControlProcess(object):
 
         if not self.result_queue.empty():  # and self.command is None):
             command_data = self.result_queue.get()
-            self.command_tstep = self.traj_tstep + command_data["t_step"]
+            self.set_command_tstep(command_data["t_step"])
 
             self.command = command_data["command"]
             self.opt_dt = command_data["mpc_dt"]
@@ -187,7 +244,7 @@ class ControlProcess(object):
 
     def truncate_command(self, command, trunc_tstep, command_tstep):
         # print(trunc_tstep, command_tstep[:4])
-        f_idx = find_first_idx(command_tstep, trunc_tstep)  # - 1
+        f_idx = int(np.searchsorted(np.asarray(command_tstep), trunc_tstep, side='right'))
         if f_idx == -1:
             f_idx = 0
         # print(f_idx)
@@ -198,6 +255,8 @@ class ControlProcess(object):
         self.params = kwargs
 
     def close(self):
+        if self.done:
+            return
         self.done = True
         opt_data = {"state": None, "dt": None, "done": self.done, "params": None}
         self.opt_queue.put(opt_data)
@@ -229,6 +288,12 @@ def optimize_process(control_string, opt_queue, result_queue):
     while True:
         opt_data = opt_queue.get()
         if opt_data["done"]:
+            # the parent saves its own copy, only save what this process added:
+            library = controller.traj_library
+            if library is not None and library.path is not None and library.n_unsaved > 0:
+                library.save()
+            if isinstance(controller.rollout_fn, ShardedRollout):
+                controller.rollout_fn.close()
             break
         current_state = opt_data["state"]
         state_tensor = torch.as_tensor(current_state, **controller.tensor_args).unsqueeze(0)
@@ -238,6 +303,7 @@ def optimize_process(control_string, opt_queue, result_queue):
         if opt_data["params"] is not None:
             # print('updating goal...')
             controller.rollout_fn.update_params(**opt_data["params"])
+            controller.set_goal(goal_key_from_rollout(controller.rollout_fn))
             goal_count += 1
             if goal_count == 100:
                 # controller.reset_mean()
@@ -49,7 +49,8 @@ class RobotStateFilter(object):
             if('acceleration' in self.filter_keys):
                 self.filtered_state['acceleration'] = 0.0* raw_state['position']
             #return self.filtered_state
-        self.prev_filtered_state = copy.deepcopy(self.filtered_state)
+        # entries are replaced below, not updated in place, so a shallow copy keeps the previous state:
+        self.prev_filtered_state = dict(self.filtered_state)
         for k in self.filter_keys:
             if(k in raw_state.keys()):
                 self.filtered_state[k] = self.filter_coeff[k] * raw_state[k] + (1.0 - self.filter_coeff[k]) * self.filtered_state[k]
@@ -57,81 +58,225 @@ class RobotStateFilter(object):
             self.filtered_state['acceleration'] = (self.filtered_state['velocity'] - self.prev_filtered_state['velocity']) / dt
         return self.filtered_state
         
-class JointStateFilter(object):
-    
-    def __init__(self, raw_joint_state=None, filter_coeff=0.4, dt=0.1, filter_keys=['position','velocity','acceleration']):
-        self.cmd_joint_state = copy.deepcopy(raw_joint_state)
+class BatchJointStateFilter(object):
+    """Exponential filter of joint states for a batch of robots, stored in one contiguous array.
 
-        self.filter_coeff = {}
-        if not isinstance(filter_coeff,dict):
-            for k in filter_keys:
-                self.filter_coeff[k] = filter_coeff
-        else:
-            self.filter_coeff = filter_coeff
+    The state of every robot is laid out as [position, velocity, acceleration] like the mpc state
+    vector, so arrays received from a robot or from shared memory can be filtered without conversion.
+    """
+    STATE_KEYS = ['position', 'velocity', 'acceleration']
+
+    def __init__(self, n_dofs, batch_size=1, filter_coeff=0.4, dt=0.1, filter_keys=['position','velocity','acceleration']):
+        self.n_dofs = n_dofs
+        self.batch_size = batch_size
         self.dt = dt
         self.filter_keys = filter_keys
+        if not isinstance(filter_coeff, dict):
+            filter_coeff = {k:filter_coeff for k in filter_keys}
+        # keys that are not filtered keep their previous value:
+        self.coeff = np.array([filter_coeff[k] if k in filter_keys else 0.0 for k in self.STATE_KEYS]).reshape(3, 1)
+        self.state = np.zeros((batch_size, 3 * n_dofs))
+        self._state_view = self.state.reshape(batch_size, 3, n_dofs)
+        self.initialized = False
         self.prev_cmd_qdd = None
-    def filter_joint_state(self, raw_joint_state):
-        if(self.cmd_joint_state is None):
-            self.cmd_joint_state = copy.deepcopy(raw_joint_state)
-            return self.cmd_joint_state
 
-        for k in self.filter_keys:
-            self.cmd_joint_state[k] = self.filter_coeff[k] * raw_joint_state[k] + (1.0 - self.filter_coeff[k]) * self.cmd_joint_state[k]
+    @property
+    def position(self):
+        return self._state_view[:, 0]
 
-        return self.cmd_joint_state
+    @property
+    def velocity(self):
+        return self._state_view[:, 1]
+
+    @property
+    def acceleration(self):
+        return self._state_view[:, 2]
+
+    def reset(self):
+        self.initialized = False
+        self.prev_cmd_qdd = None
+
+    def filter(self, raw_state):
+        """
+        Args:
+            raw_state (np.ndarray): [batch_size, 3 * n_dofs] or [3 * n_dofs] joint states
+
+        Returns:
+            np.ndarray: [batch_size, 3 * n_dofs] filtered state, owned by the filter
+        """
+        raw_state = np.asarray(raw_state).reshape(self.batch_size, 3, self.n_dofs)
+        if(not self.initialized):
+            self._state_view[:] = raw_state
+            self.initialized = True
+            return self.state
+        self._state_view += self.coeff * (raw_state - self._state_view)
+        return self.state
 
     def forward_predict_internal_state(self, dt=None):
         if(self.prev_cmd_qdd is None):
             return
-        dt = self.dt if dt is None else dt 
-        self.cmd_joint_state['acceleration'] = self.prev_cmd_qdd
-        self.cmd_joint_state['velocity'] = self.cmd_joint_state['velocity'] + self.prev_cmd_qdd * dt
-        self.cmd_joint_state['position'] = self.cmd_joint_state['position'] + self.cmd_joint_state['velocity'] * dt
-        
+        self.predict_internal_state(self.prev_cmd_qdd, dt)
 
     def predict_internal_state(self, qdd_des=None, dt=None):
         if(qdd_des is None):
             return
-        dt = self.dt if dt is None else dt 
-        self.cmd_joint_state['acceleration'] = qdd_des
-        self.cmd_joint_state['velocity'] = self.cmd_joint_state['velocity'] + qdd_des * dt
-        self.cmd_joint_state['position'] = self.cmd_joint_state['position'] + self.cmd_joint_state['velocity'] * dt
-        
+        dt = self.dt if dt is None else dt
+        self.acceleration[:] = qdd_des
+        self.velocity[:] += self.acceleration * dt
+        self.position[:] += self.velocity * dt
+
+    def integrate_jerk(self, qddd_des, raw_state=None, dt=None):
+        dt = self.dt if dt is None else dt
+        if(raw_state is not None):
+            self.filter(raw_state)
+        self.acceleration[:] += qddd_des * dt
+        self.velocity[:] += self.acceleration * dt
+        self.position[:] += self.velocity * dt
+        self.prev_cmd_qdd = self.acceleration.copy()
+        return self.state
+
+    def integrate_acc(self, qdd_des, raw_state=None, dt=None):
+        dt = self.dt if dt is None else dt
+        if(raw_state is not None):
+            self.filter(raw_state)
+        self.acceleration[:] = qdd_des
+        self.velocity[:] += self.acceleration * dt
+        self.position[:] += self.velocity * dt
+        self.prev_cmd_qdd = self.acceleration.copy()
+        return self.state
+
+    def integrate_vel(self, qd_des, raw_state=None, dt=None):
+        dt = self.dt if dt is None else dt
+        if(raw_state is not None):
+            self.filter(raw_state)
+        self.velocity[:] = qd_des
+        self.position[:] += self.velocity * dt
+        return self.state
+
+
+class AlphaBetaGammaFilter(BatchJointStateFilter):
+    """Constant acceleration tracking filter (alpha-beta-gamma, the steady state form of a kalman filter)
+    on joint position measurements. Velocity and acceleration are estimated instead of smoothed, so the
+    estimate does not lag a moving joint like the exponential filter does.
+    """
+    def __init__(self, n_dofs, batch_size=1, dt=0.1, alpha=0.5, beta=0.1, gamma=0.01):
+        super(AlphaBetaGammaFilter, self).__init__(n_dofs, batch_size=batch_size, dt=dt)
+        self.alpha = alpha
+        self.beta = beta
+        self.gamma = gamma
+
+    @classmethod
+    def from_fading_memory(cls, n_dofs, theta, batch_size=1, dt=0.1):
+        """Gains of the critically damped filter, theta in (0, 1) trades noise rejection (close to 1)
+        against tracking (close to 0).
+        """
+        alpha = 1.0 - theta ** 3
+        beta = 1.5 * (1.0 - theta) ** 2 * (1.0 + theta)
+        gamma = 0.5 * (1.0 - theta) ** 3
+        return cls(n_dofs, batch_size=batch_size, dt=dt, alpha=alpha, beta=beta, gamma=gamma)
+
+    def filter(self, raw_state, dt=None):
+        """
+        Args:
+            raw_state (np.ndarray): [batch_size, 3 * n_dofs], [3 * n_dofs] joint states or
+                [batch_size, n_dofs], [n_dofs] joint positions, only the positions are used
+            dt (float): time since the last measurement
+
+        Returns:
+            np.ndarray: [batch_size, 3 * n_dofs] estimated state, owned by the filter
+        """
+        dt = self.dt if dt is None else dt
+        q_meas = np.asarray(raw_state).reshape(self.batch_size, -1)[:, :self.n_dofs]
+        if(not self.initialized):
+            self.state[:] = 0.0
+            self.position[:] = q_meas
+            self.initialized = True
+            return self.state
+        # predict with constant acceleration:
+        self.position[:] += self.velocity * dt + 0.5 * self.acceleration * dt ** 2
+        self.velocity[:] += self.acceleration * dt
+        residual = q_meas - self.position
+        # correct:
+        self.position[:] += self.alpha * residual
+        self.velocity[:] += (self.beta / dt) * residual
+        self.acceleration[:] += (2.0 * self.gamma / dt ** 2) * residual
+        return self.state
+
+
+class JointStateFilter(BatchJointStateFilter):
+    """Single robot joint state filter on dicts with position, velocity and acceleration keys.
+
+    The filter runs on the array of :class:`BatchJointStateFilter`, the dicts returned are copies
+    so that callers can keep them across calls.
+    """
+    def __init__(self, raw_joint_state=None, filter_coeff=0.4, dt=0.1, filter_keys=['position','velocity','acceleration']):
+        self.filter_coeff = {}
+        if not isinstance(filter_coeff,dict):
+            for k in filter_keys:
+                self.filter_coeff[k] = filter_coeff
+        else:
+            self.filter_coeff = filter_coeff
+        self._init_args = (dt, filter_keys)
+        self._cmd_joint_state = None
+        self.dt = dt
+        self.filter_keys = filter_keys
+        self.prev_cmd_qdd = None
+        if(raw_joint_state is not None):
+            self.filter_joint_state(raw_joint_state)
+
+    def _allocate(self, raw_joint_state):
+        # dofs are only known with the first state:
+        n_dofs = len(raw_joint_state['position'])
+        dt, filter_keys = self._init_args
+        super(JointStateFilter, self).__init__(n_dofs, 1, self.filter_coeff, dt, filter_keys)
+        self._cmd_joint_state = {'position': self.position[0],
+                                 'velocity': self.velocity[0],
+                                 'acceleration': self.acceleration[0]}
+
+    @property
+    def cmd_joint_state(self):
+        if(self._cmd_joint_state is None or not self.initialized):
+            return None
+        return self._copy_state()
+
+    def _copy_state(self):
+        return {k: v.copy() for k, v in self._cmd_joint_state.items()}
+
+    def _to_array(self, raw_joint_state):
+        raw = np.zeros(3 * self.n_dofs)
+        for i, k in enumerate(self.STATE_KEYS):
+            if(k in raw_joint_state):
+                raw[i * self.n_dofs:(i + 1) * self.n_dofs] = raw_joint_state[k]
+        return raw
+
+    def filter_joint_state(self, raw_joint_state):
+        if(self._cmd_joint_state is None):
+            self._allocate(raw_joint_state)
+        self.filter(self._to_array(raw_joint_state))
+        return self._copy_state()
 
     def integrate_jerk(self, qddd_des, raw_joint_state, dt=None):
-        dt = self.dt if dt is None else dt 
         self.filter_joint_state(raw_joint_state)
-        self.cmd_joint_state['acceleration'] = self.cmd_joint_state['acceleration'] + qddd_des * dt
-        self.cmd_joint_state['velocity'] = self.cmd_joint_state['velocity'] + self.cmd_joint_state['acceleration'] * dt
-        self.cmd_joint_state['position'] = self.cmd_joint_state['position'] + self.cmd_joint_state['velocity'] * dt
-        self.prev_cmd_qdd = self.cmd_joint_state['acceleration']
-        return self.cmd_joint_state
+        super(JointStateFilter, self).integrate_jerk(qddd_des, dt=dt)
+        return self._copy_state()
 
     def integrate_acc(self, qdd_des, raw_joint_state=None, dt=None):
-        dt = self.dt if dt is None else dt
         if(raw_joint_state is not None):
             self.filter_joint_state(raw_joint_state)
-        self.cmd_joint_state['acceleration'] = qdd_des
-        self.cmd_joint_state['velocity'] = self.cmd_joint_state['velocity'] + qdd_des * dt
-        self.cmd_joint_state['position'] = self.cmd_joint_state['position'] + self.cmd_joint_state['velocity'] * dt
-        self.prev_cmd_qdd = self.cmd_joint_state['acceleration']
-        return self.cmd_joint_state
+        super(JointStateFilter, self).integrate_acc(qdd_des, dt=dt)
+        return self._copy_state()
 
     def integrate_vel(self, qd_des, raw_joint_state, dt=None):
-        dt = self.dt if dt is None else dt
         self.filter_joint_state(raw_joint_state)
-        self.cmd_joint_state['velocity'] = qd_des #self.cmd_joint_state['velocity'] + qdd_des * dt
-        self.cmd_joint_state['position'] = self.cmd_joint_state['position'] + self.cmd_joint_state['velocity'] * dt
-
-        return self.cmd_joint_state
+        super(JointStateFilter, self).integrate_vel(qd_des, dt=dt)
+        return self._copy_state()
 
     def integrate_pos(self, q_des, raw_joint_state, dt=None):
         dt = self.dt if dt is None else dt
         self.filter_joint_state(raw_joint_state)
 
-        self.cmd_joint_state['velocity'] = (q_des - self.cmd_joint_state['position']) / dt
-        self.cmd_joint_state['position'] = self.cmd_joint_state['position'] + self.cmd_joint_state['velocity'] * dt
+        self.velocity[:] = (q_des - self.position) / dt
+        self.position[:] += self.velocity * dt
 
         # This needs to also update the acceleration via finite differencing.
         raise NotImplementedError
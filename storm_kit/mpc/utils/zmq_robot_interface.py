@@ -20,102 +20,184 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 # DEALINGS IN THE SOFTWARE.#
-import numpy as np
+import struct
+import threading
 import time
+
+import numpy as np
 import zmq
-from threading import Thread
-
-def send_array(socket, A, flags=0, copy=True, track=False):
-    """send a numpy array with metadata"""
-    md = dict(
-        dtype = str(A.dtype),
-        shape = A.shape,
-    )
-    socket.send_json(md, flags|zmq.SNDMORE)
-    return socket.send(A, flags, copy=copy, track=track)
-
-def recv_array(socket, flags=0, copy=True, track=False):
-    """recv a numpy array"""
-    md = socket.recv_json(flags=flags)
-    msg = socket.recv(flags=flags, copy=copy, track=track)
-    buf = memoryview(msg)
-    A = np.frombuffer(buf, dtype=md['dtype'])
-    return A.reshape(md['shape'])
+
+# one frame per array: fixed little endian header followed by the raw array data.
+# header fields: dtype code, ndim, reserved, sequence number, rows, cols, send time [s]
+HEADER = struct.Struct('<BBHIIId')
+DTYPES = [np.dtype(np.float32), np.dtype(np.float64), np.dtype(np.int32), np.dtype(np.int64), np.dtype(np.uint8)]
+DTYPE_CODES = {dtype:code for code, dtype in enumerate(DTYPES)}
+
+
+def pack_array(buf, A, seq=0, stamp=0.0):
+    """Writes header and data of a 1D or 2D array into buf.
+
+    Returns:
+        int: number of bytes used in buf
+    """
+    A = np.asarray(A)
+    if(A.ndim > 2):
+        raise ValueError('only 1D and 2D arrays can be sent, got shape {}'.format(A.shape))
+    rows, cols = (1, A.shape[0]) if A.ndim == 1 else A.shape
+    HEADER.pack_into(buf, 0, DTYPE_CODES[A.dtype], A.ndim, 0, seq, rows, cols, stamp)
+    n_bytes = HEADER.size + A.nbytes
+    np.frombuffer(buf, dtype=A.dtype, count=A.size, offset=HEADER.size)[:] = A.ravel()
+    return n_bytes
+
+def unpack_array(buf):
+    """Reads an array written by pack_array without copying it.
+
+    Returns:
+        tuple: (array, sequence number, send time)
+    """
+    code, ndim, _, seq, rows, cols, stamp = HEADER.unpack_from(buf, 0)
+    A = np.frombuffer(buf, dtype=DTYPES[code], count=rows * cols, offset=HEADER.size)
+    A = A.reshape(cols) if ndim == 1 else A.reshape(rows, cols)
+    return A, seq, stamp
+
+def recv_array(socket, flags=0, copy=False):
+    """Receives one array frame. With copy=False the array is a read only view of the zmq frame.
+
+    Returns:
+        tuple: (array, sequence number, send time)
+    """
+    frame = socket.recv(flags=flags, copy=copy)
+    return unpack_array(frame.buffer if not copy else frame)
+
+
+class ArraySender(object):
+    """Sends arrays with pack_array from a ring of preallocated buffers without copying them into zmq.
+
+    A buffer is only reused once zmq reports that the previous message using it has been sent.
+    """
+    def __init__(self, socket, capacity=4096, n_buffers=4):
+        self.socket = socket
+        self.seq = 0
+        self._buffers = [bytearray(capacity) for _ in range(n_buffers)]
+        self._trackers = [None for _ in range(n_buffers)]
+        self._idx = 0
+
+    def _get_buffer(self, n_bytes):
+        for _ in range(len(self._buffers)):
+            idx = self._idx
+            self._idx = (self._idx + 1) % len(self._buffers)
+            tracker = self._trackers[idx]
+            if(tracker is None or tracker.done):
+                if(len(self._buffers[idx]) < n_bytes):
+                    self._buffers[idx] = bytearray(n_bytes)
+                return idx
+        # every buffer is still owned by zmq, a fresh one is cheaper than waiting:
+        self._buffers.append(bytearray(n_bytes))
+        self._trackers.append(None)
+        return len(self._buffers) - 1
+
+    def send(self, A, topic=None, flags=0):
+        A = np.asarray(A)
+        idx = self._get_buffer(HEADER.size + A.nbytes)
+        buf = self._buffers[idx]
+        n_bytes = pack_array(buf, A, self.seq, time.time())
+        self.seq = (self.seq + 1) % (2 ** 32)
+        if(topic is not None):
+            self.socket.send(topic, flags | zmq.SNDMORE)
+        self._trackers[idx] = self.socket.send(memoryview(buf)[:n_bytes], flags, copy=False, track=True)
+        return self._trackers[idx]
+
 
 class SimComms(object):
+    """Publishes commands and keeps the latest robot state received on the subscribed topic.
+
+    A single receive thread blocks in a zmq.Poller; commands are sent directly from the calling thread
+    so they leave without waiting on a polling period. Both sockets take a full zmq endpoint through
+    pub_address/sub_address, e.g. inproc:// endpoints when the robot side shares the zmq context.
+    """
     def __init__(self, pub_topic='control_traj', sub_topic='robot_state', host='127.0.0.1', pub_port='5001',
-                 sub_port='5002'):
-        self.dt = 1 / 1000.0
+                 sub_port='5002', pub_address=None, sub_address=None, context=None, poll_timeout=100):
         self.done = False
-        self.context = zmq.Context()
+        self.poll_timeout = poll_timeout
+        self.context = zmq.Context.instance() if context is None else context
         self.pub_socket = self.context.socket(zmq.PUB)
-        self.pub_socket.bind("tcp://{}:{}".format(host, pub_port))
-        
-        
-        self.pub_topic = pub_topic
+        self.pub_socket.bind(pub_address if pub_address is not None else "tcp://{}:{}".format(host, pub_port))
+        self.pub_topic = pub_topic.encode()
+        self.sender = ArraySender(self.pub_socket)
+
         self.sub_socket = self.context.socket(zmq.SUB)
-        self.sub_socket.setsockopt(zmq.RCVTIMEO, 1000)
-        self.sub_socket.connect("tcp://{}:{}".format(host, sub_port))
+        self.sub_socket.connect(sub_address if sub_address is not None else "tcp://{}:{}".format(host, sub_port))
         self.sub_topic = sub_topic
         self.sub_socket.subscribe(self.sub_topic)
-        #self.state = None
         self.state_message = None
         self.state_topic = None
-        self.pub_array = None
-        
-        self.t1 = Thread(target=self.thread_fn_sub)
-        self.t1.start()
-        self.t2 = Thread(target=self.thread_fn_pub)
-        self.t2.start()
+        self.state_seq = None
+        self.state_stamp = None
+        self._state_cv = threading.Condition()
 
+        self.t1 = threading.Thread(target=self.thread_fn_sub)
+        self.t1.daemon = True
+        self.t1.start()
 
     def thread_fn_sub(self):
+        poller = zmq.Poller()
+        poller.register(self.sub_socket, zmq.POLLIN)
+        topic = self.sub_topic.encode()
         while not self.done:
-            try:
-                topic = self.sub_socket.recv_string(flags=zmq.NOBLOCK)
-            except zmq.Again as e:
-                time.sleep(self.dt)
+            if(not poller.poll(self.poll_timeout)):
                 continue
-            state = recv_array(self.sub_socket, flags=zmq.NOBLOCK, copy=True, track=False)
-
-            if(topic == self.sub_topic):
-                self.state_message = state
-                self.state_topic = topic
-    def thread_fn_pub(self):
-        #print(self.done)
-        while(not self.done):
-            if(self.pub_array is not None):
-                #print(self.robot_state_pub)
-                #print(self.pub_topic, self.pub_array)
-                self.pub_socket.send_string(self.pub_topic, flags=zmq.SNDMORE)
-                send_array(self.pub_socket,self.pub_array, flags=0, copy=True, track=False)
-                self.pub_array = None
-            time.sleep(self.dt)
-        return True
+            # drain everything queued, only the newest state matters:
+            state = None
+            while True:
+                try:
+                    msg_topic = self.sub_socket.recv(flags=zmq.NOBLOCK)
+                except zmq.Again:
+                    break
+                msg = recv_array(self.sub_socket, copy=False)
+                if(msg_topic == topic):
+                    state = msg
+            if(state is not None):
+                with self._state_cv:
+                    self.state_message, self.state_seq, self.state_stamp = state
+                    self.state_topic = self.sub_topic
+                    self._state_cv.notify_all()
 
-        
     def close(self):
         self.done = True
+        self.t1.join()
         self.sub_socket.close()
         self.pub_socket.close()
-        self.context.term()
+
     def send_command(self, cmd):
-        #print("setting command...")
-        self.pub_array = cmd
-        #print(self.done)
-        #print(self.pub_array)
-        
-    def get_state(self):
-        state_message = self.state_message
-        self.state_message = None
+        self.sender.send(cmd, topic=self.pub_topic)
+
+    def get_state(self, timeout=0.0):
+        """Returns the newest state and clears it.
+
+        Args:
+            timeout (float): seconds to wait for a state, 0 returns at once, None waits forever
+
+        Returns:
+            np.ndarray: state or None if no new state arrived
+        """
+        with self._state_cv:
+            if(self.state_message is None and timeout != 0.0):
+                self._state_cv.wait_for(lambda: self.state_message is not None, timeout)
+            state_message = self.state_message
+            self.state_message = None
         return state_message
 
 
 
 
 class RobotInterface(object):
-    def __init__(self, pub_topic='control_traj', sub_topic='robot_state', host='127.0.0.1', pub_port='5001', sub_port='5002',pair_port='5003'):
-
+    def __init__(self, pub_topic='control_traj', sub_topic='robot_state', host='127.0.0.1', pub_port='5001', sub_port='5002',pair_port='5003',
+                 *, n_dofs, pub_address=None, sub_address=None, context=None):
+        """
+        Args:
+            n_dofs (int): joints of the robot, required to split the received states. States longer than
+                3 * n_dofs carry the goal pose, time index and open loop flag.
+        """
         self.sub_hz = 500.0
         self.pub_topic = pub_topic
         self.sub_topic = sub_topic
@@ -123,30 +205,34 @@ class RobotInterface(object):
         self.pub_port = pub_port
         self.sub_port = sub_port
         self.state_topic = sub_topic
+        self.n_dofs = n_dofs
         self.zmq_comms = SimComms(sub_topic=sub_topic,
                                   pub_topic=pub_topic,
                                   host=host,
                                   sub_port=sub_port,
-                                  pub_port=pub_port)
+                                  pub_port=pub_port,
+                                  pub_address=pub_address,
+                                  sub_address=sub_address,
+                                  context=context)
         
         
-    def get_state(self):
-        #print("waiting on state")
-        self.state = self.zmq_comms.get_state()
+    def get_state(self, timeout=None):
+        self.state = None
         while(self.state is None):
-            try:
-                self.state = self.zmq_comms.get_state()
-            except KeyboardInterrupt:
-                exit()
+            # wakes up on arrival, the timeout only bounds how long a ctrl-c waits:
+            self.state = self.zmq_comms.get_state(timeout=0.1 if timeout is None else timeout)
+            if(timeout is not None and self.state is None):
+                return None
         
-        self.state = np.ravel(self.state)
-        
-        if(len(self.state) > 6*3):
-            state = self.state[:-9]
-            goal_pose = self.state[-9:-2]
-            #print(self.state)
+        # the received array is a read-only view of the zmq frame, copy it once so the state is owned
+        # by the caller:
+        self.state = np.array(self.state).ravel()
+
+        if(len(self.state) > self.n_dofs * 3):
+            state = self.state[:self.n_dofs * 3]
+            goal_pose = self.state[self.n_dofs * 3:self.n_dofs * 3 + 7]
             t_idx = self.state[-2:-1]
-            open_loop = self.state[-1:0]
+            open_loop = self.state[-1]
         else:
             state = self.state
             goal_pose, t_idx, open_loop = None, None, 0
@@ -164,19 +250,19 @@ class RobotInterface(object):
         
         if append_time:
             command_times = np.arange(start=0.0,stop=dt*len(action_traj), step=dt).reshape(len(action_traj),1)
-            #print(command_times)
         command = action_traj
         if append_time:        
             command = np.concatenate((command, command_times),axis=-1)
-        #print(command)
         self.zmq_comms.send_command(command)
     
    
     def publish_command(self, command_state_seq, mode='acc', append_time=True):
+        """Publishes one of position, velocity or acceleration of a [horizon, 3 * n_dofs + 1] state sequence."""
         num_commands = command_state_seq.shape[0]
-        q = np.array(command_state_seq[:,:6]) #TODO: Remove hardode!
-        qd = np.array(command_state_seq[:,6:12])
-        qdd = np.array(command_state_seq[:, 12:18])
+        n_dofs = self.n_dofs
+        q = command_state_seq[:, :n_dofs]
+        qd = command_state_seq[:, n_dofs:2 * n_dofs]
+        qdd = command_state_seq[:, 2 * n_dofs:3 * n_dofs]
         if append_time:
             command_times = np.array(command_state_seq[:, -1]).reshape(num_commands,1)
 
@@ -190,7 +276,6 @@ class RobotInterface(object):
             command = command_state_seq
         if append_time:        
             command = np.concatenate((command, command_times),axis=-1)
-        print('Publishing plan', command.shape)
         self.zmq_comms.send_command(command)
     
         
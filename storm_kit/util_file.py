@@ -50,6 +50,11 @@ def get_weights_path():
     path = os.path.join(content_path,'weights')
     return path
 
+def get_cache_path():
+    # compiled robot descriptions and other derived data, STORM_KIT_CACHE overrides the location
+    path = os.environ.get('STORM_KIT_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'storm_kit'))
+    return path
+
 def join_path(path1,path2):
     return os.path.join(path1,path2)
 